@@ -1,5 +1,7 @@
 import os
 
+import pytest
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 root_dir_content = os.listdir(BASE_DIR)
 PROJECT_DIR_NAME = 'yatube'
@@ -36,4 +38,19 @@ assert any(app in INSTALLED_APPS for app in ['posts.apps.PostsConfig', 'posts'])
 pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
+    'tests.fixtures.fixture_perf',
 ]
+
+
+@pytest.fixture(autouse=True)
+def temp_storage(settings, tmp_path):
+    """Очередь миниатюр и загрузки тестов не попадают в дерево проекта."""
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    settings.THUMBNAIL_QUEUE_DIR = str(tmp_path / 'thumbnail_queue')
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--perf-update-baseline', action='store_true',
+        help='Перезаписать tests/perf_baseline.json текущими замерами',
+    )
@@ -0,0 +1,60 @@
+import random
+
+import pytest
+from faker import Faker
+
+
+@pytest.fixture
+def perf_data(mixer, user):
+    """Наполняет базу объёмом, похожим на живой: авторы, группы, посты,
+    комментарии и подписки. Данные детерминированы."""
+    from django.contrib.auth.models import User
+    from posts import timeline
+    from posts.counters import recount_groups, recount_posts, recount_users
+    from posts.models import Comment, Follow, Group, Post
+
+    fake = Faker('ru_RU')
+    fake.seed_instance(17)
+    rnd = random.Random(17)
+    authors = mixer.cycle(30).blend(
+        User, username=(f'author{index}' for index in range(30))
+    )
+    groups = mixer.cycle(5).blend(
+        Group, slug=(f'group-{index}' for index in range(5))
+    )
+    Post.objects.bulk_create(
+        Post(
+            text=fake.paragraph(nb_sentences=5),
+            author=rnd.choice(authors + [user]),
+            group=rnd.choice(groups + [None]),
+        )
+        for _ in range(400)
+    )
+    posts = list(Post.objects.values_list('pk', flat=True))
+    Comment.objects.bulk_create(
+        Comment(
+            post_id=rnd.choice(posts),
+            author=rnd.choice(authors),
+            text=fake.sentence(),
+        )
+        for _ in range(800)
+    )
+    Follow.objects.bulk_create(
+        Follow(user=user, author=author) for author in authors[:10]
+    )
+    Follow.objects.bulk_create(
+        Follow(user=follower, author=author)
+        for follower in authors
+        for author in rnd.sample(authors, 5)
+        if follower != author
+    )
+    recount_posts()
+    recount_groups()
+    recount_users()
+    timeline.rebuild(User.objects.values_list('pk', flat=True))
+    return {
+        'user': user,
+        'author': authors[0],
+        'group': groups[0],
+        'post': Post.objects.filter(author=user).first(),
+    }
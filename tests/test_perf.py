@@ -0,0 +1,128 @@
+import gc
+import json
+import os
+import statistics
+import time
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'perf_baseline.json')
+RUNS = 15
+# Число запросов должно совпадать с базовой линией или быть меньше.
+# Время сильно зависит от машины, поэтому сравнивается только по
+# PERF_CHECK_LATENCY=1 и с запасом.
+CHECK_LATENCY = os.environ.get('PERF_CHECK_LATENCY') == '1'
+LATENCY_FACTOR = float(os.environ.get('PERF_LATENCY_FACTOR', 3))
+LATENCY_SLACK_MS = float(os.environ.get('PERF_LATENCY_SLACK_MS', 25))
+
+URLS = {
+    'index': lambda data: reverse('posts:index'),
+    'group_list': lambda data: reverse(
+        'posts:group_list', args=[data['group'].slug]),
+    'profile': lambda data: reverse(
+        'posts:profile', args=[data['author'].username]),
+    'search': lambda data: reverse('posts:search') + '?q=' + (
+        data['post'].text.split()[0]),
+    'post_detail': lambda data: reverse(
+        'posts:post_detail', args=[data['post'].pk]),
+    'post_comments': lambda data: reverse(
+        'posts:post_comments', args=[data['post'].pk]),
+    'post_create': lambda data: reverse('posts:post_create'),
+    'post_edit': lambda data: reverse(
+        'posts:post_edit', args=[data['post'].pk]),
+    'add_comment': lambda data: reverse(
+        'posts:add_comment', args=[data['post'].pk]),
+    'follow_index': lambda data: reverse('posts:follow_index'),
+    'profile_follow': lambda data: reverse(
+        'posts:profile_follow', args=[data['author'].username]),
+    'profile_unfollow': lambda data: reverse(
+        'posts:profile_unfollow', args=[data['author'].username]),
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def measure(client, url):
+    """Холодный кэш на каждом запросе: меряем работу с БД и рендер."""
+    client.get(url)
+    timings, queries = [], 0
+    # Паузы сборщика мусора из-за предыдущих тестов не должны попадать
+    # в замер.
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(RUNS):
+            cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code in (200, 302), url
+            queries = max(queries, len(captured))
+    finally:
+        gc.enable()
+    return {
+        'queries': queries,
+        'p50_ms': round(statistics.median(timings), 1),
+        'p95_ms': round(percentile(timings, 0.95), 1),
+    }
+
+
+def regressions(name, result, baseline):
+    expected = baseline.get(name)
+    if expected is None:
+        return [f'{name}: нет в базовой линии']
+    found = []
+    if result['queries'] > expected['queries']:
+        found.append(
+            f'{name}: {result["queries"]} запросов вместо '
+            f'{expected["queries"]}'
+        )
+    limit = expected['p95_ms'] * LATENCY_FACTOR + LATENCY_SLACK_MS
+    if CHECK_LATENCY and result['p95_ms'] > limit:
+        found.append(
+            f'{name}: p95 {result["p95_ms"]} мс при пороге {limit:.1f} мс'
+        )
+    return found
+
+
+class TestPerformance:
+
+    @pytest.mark.django_db(transaction=True)
+    def test_posts_urls_do_not_regress(self, perf_data, user_client,
+                                       request):
+        from posts.urls import urlpatterns
+
+        assert {pattern.name for pattern in urlpatterns} == set(URLS), (
+            'Добавьте новый адрес из `posts/urls.py` в `URLS` '
+            'в `tests/test_perf.py`'
+        )
+        results = {
+            name: measure(user_client, url(perf_data))
+            for name, url in URLS.items()
+        }
+        if request.config.getoption('--perf-update-baseline'):
+            with open(BASELINE_PATH, 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2, sort_keys=True,
+                          ensure_ascii=False)
+                baseline_file.write('\n')
+            return
+        with open(BASELINE_PATH) as baseline_file:
+            baseline = json.load(baseline_file)
+        found = [
+            problem
+            for name, result in results.items()
+            for problem in regressions(name, result, baseline)
+        ]
+        assert not found, (
+            'Производительность ухудшилась:\n' + '\n'.join(found)
+            + '\nЕсли это ожидаемо, обновите базовую линию: '
+            'pytest tests/test_perf.py --perf-update-baseline'
+        )
@@ -0,0 +1,54 @@
+"""Бэкенд SQLite, настраивающий каждое новое соединение через PRAGMA.
+
+Параметры берутся из `OPTIONS['pragmas']` базы и дополняют
+`DEFAULT_PRAGMAS`; значение None оставляет умолчание SQLite.
+"""
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+# WAL позволяет читать во время записи, а с `synchronous = NORMAL`
+# fsync делается только на контрольных точках. Соединение ждёт
+# блокировку записи `busy_timeout` мс, а не сразу падает
+# с «database is locked».
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+_PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+_PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def pragma_statements(pragmas):
+    statements = []
+    for name, value in pragmas.items():
+        if value is None:
+            continue
+        if not _PRAGMA_NAME.match(name) or not _PRAGMA_VALUE.match(
+                str(value)):
+            raise ImproperlyConfigured(
+                f'Недопустимая настройка SQLite: {name} = {value!r}'
+            )
+        statements.append(f'PRAGMA {name} = {value}')
+    return statements
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # `sqlite3.connect()` не знает этого параметра.
+        pragmas = {**DEFAULT_PRAGMAS, **params.pop('pragmas', {})}
+        self.pragma_statements = pragma_statements(pragmas)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for statement in self.pragma_statements:
+            conn.execute(statement)
+        return conn
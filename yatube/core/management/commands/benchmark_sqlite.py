@@ -0,0 +1,179 @@
+import os
+import random
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, OperationalError
+from django.db.utils import ConnectionHandler
+
+from core.backends.sqlite3.base import DEFAULT_PRAGMAS
+
+TUNED_ENGINE = 'core.backends.sqlite3'
+AUTHORS = 100
+
+SCHEMA = (
+    'CREATE TABLE bench_post (id INTEGER PRIMARY KEY, '
+    'author_id INTEGER NOT NULL, text TEXT NOT NULL, pub_date REAL NOT NULL)',
+    'CREATE INDEX bench_post_author ON bench_post (author_id, pub_date)',
+)
+INSERT = (
+    'INSERT INTO bench_post (author_id, text, pub_date) VALUES (%s, %s, %s)'
+)
+SELECT = (
+    'SELECT id, text, pub_date FROM bench_post WHERE author_id = %s '
+    'ORDER BY pub_date DESC LIMIT 10'
+)
+
+
+def read_params(rnd):
+    return (rnd.randrange(AUTHORS),)
+
+
+def write_params(rnd):
+    return (rnd.randrange(AUTHORS), 'Новый пост', time.time())
+
+
+def tuned_options():
+    """OPTIONS основной базы, если она уже на настроенном бэкенде."""
+    database = settings.DATABASES[DEFAULT_DB_ALIAS]
+    if database['ENGINE'] == TUNED_ENGINE:
+        return database.get('OPTIONS', {})
+    return {}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Side:
+    """Счётчики читателей или писателей одного прогона."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+
+    def add(self, latencies, errors):
+        with self.lock:
+            self.latencies += latencies
+            self.errors += errors
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность SQLite при одновременном '
+        'чтении и записи: стандартный бэкенд Django против '
+        'core.backends.sqlite3 с PRAGMA из настроек. Каждый прогон идёт '
+        'во временной базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=5)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--rows', type=int, default=20000)
+        parser.add_argument(
+            '--dir', help='Каталог для временных баз, например на том же '
+                          'диске, что и рабочая.',
+        )
+
+    def handle(self, *args, **options):
+        profiles = (
+            ('django', 'django.db.backends.sqlite3', {}),
+            ('tuned', TUNED_ENGINE, tuned_options()),
+        )
+        pragmas = {**DEFAULT_PRAGMAS, **tuned_options().get('pragmas', {})}
+        self.stdout.write('PRAGMA: ' + ', '.join(
+            f'{name}={value}' for name, value in pragmas.items()
+            if value is not None
+        ))
+        self.stdout.write(
+            f'{"бэкенд":<8}{"чтений/с":>10}{"записей/с":>11}'
+            f'{"чтение p95":>12}{"запись p95":>12}{"ошибок":>8}'
+        )
+        results = {}
+        for name, engine, engine_options in profiles:
+            with tempfile.TemporaryDirectory(dir=options['dir']) as directory:
+                handler = ConnectionHandler({DEFAULT_DB_ALIAS: {
+                    'ENGINE': engine,
+                    'NAME': os.path.join(directory, 'bench.sqlite3'),
+                    'OPTIONS': engine_options,
+                }})
+                reads, writes = self.measure(handler, options)
+            elapsed = options['duration']
+            results[name] = (
+                len(reads.latencies) / elapsed, len(writes.latencies) / elapsed
+            )
+            self.stdout.write(
+                f'{name:<8}{results[name][0]:>10.0f}{results[name][1]:>11.0f}'
+                f'{percentile(reads.latencies, 0.95):>12.2f}'
+                f'{percentile(writes.latencies, 0.95):>12.2f}'
+                f'{reads.errors + writes.errors:>8}'
+            )
+        base, tuned = results['django'], results['tuned']
+        self.stdout.write(
+            f'Ускорение: чтение ×{tuned[0] / max(base[0], 1e-9):.2f}, '
+            f'запись ×{tuned[1] / max(base[1], 1e-9):.2f}'
+        )
+
+    def measure(self, handler, options):
+        self.prepare(handler[DEFAULT_DB_ALIAS], options['rows'])
+        handler[DEFAULT_DB_ALIAS].close()
+        reads, writes = Side(), Side()
+        deadline = time.monotonic() + options['duration']
+        threads = [
+            threading.Thread(
+                target=self.work,
+                args=(handler, deadline, reads, SELECT, read_params, seed),
+            )
+            for seed in range(options['readers'])
+        ] + [
+            threading.Thread(
+                target=self.work,
+                args=(handler, deadline, writes, INSERT, write_params,
+                      -seed - 1),
+            )
+            for seed in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return reads, writes
+
+    def prepare(self, connection, rows):
+        rnd = random.Random(0)
+        now = time.time()
+        with connection.cursor() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            cursor.executemany(INSERT, [
+                (rnd.randrange(AUTHORS), f'Пост {i}', now - i)
+                for i in range(rows)
+            ])
+
+    def work(self, handler, deadline, side, sql, params, seed):
+        """Один поток: свой коннект, запросы в автокоммите до срока."""
+        connection = handler[DEFAULT_DB_ALIAS]
+        rnd = random.Random(seed)
+        latencies, errors = [], 0
+        try:
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql, params(rnd))
+                        cursor.fetchall()
+                except OperationalError:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection.close()
+        side.add(latencies, errors)
@@ -0,0 +1,154 @@
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+
+logger = logging.getLogger('yatube.profiling')
+_local = threading.local()
+_MISSING = object()
+
+
+class Profile:
+    """Замеры одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.sql_ms += (time.perf_counter() - started) * 1000
+
+    @property
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+def current_profile():
+    return getattr(_local, 'profile', None)
+
+
+def _timed_render(render):
+    @wraps(render)
+    def wrapper(self, context):
+        profile = current_profile()
+        if profile is None:
+            return render(self, context)
+        # Вложенные шаблоны (`include`, теги) уже входят во время
+        # внешнего, поэтому считается только верхний уровень.
+        profile.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            profile.template_depth -= 1
+            if not profile.template_depth:
+                profile.template_ms += (time.perf_counter() - started) * 1000
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def _counted_get(get):
+    @wraps(get)
+    def wrapper(self, key, default=None, version=None):
+        value = get(self, key, _MISSING, version)
+        profile = current_profile()
+        if profile is not None:
+            if value is _MISSING:
+                profile.cache_misses += 1
+            else:
+                profile.cache_hits += 1
+        return default if value is _MISSING else value
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def instrument():
+    """Один раз оборачивает рендер шаблонов и чтение из кэшей.
+
+    Без активного замера обёртки только проверяют thread-local.
+    `get_many` в стандартных бэкендах вызывает `get`, поэтому тоже
+    учитывается.
+    """
+    if not getattr(Template.render, 'profiled', False):
+        Template.render = _timed_render(Template.render)
+    for alias in settings.CACHES:
+        backend = type(caches[alias])
+        if not getattr(backend.get, 'profiled', False):
+            backend.get = _counted_get(backend.get)
+
+
+class ProfilingMiddleware:
+    """Замеряет выборку запросов: общее время, SQL, шаблоны и кэш.
+
+    Включается настройкой `REQUEST_PROFILING`; доля замеряемых запросов
+    задаётся `REQUEST_PROFILING_SAMPLE_RATE`. Результат уходит
+    в заголовок `Server-Timing` и в лог `yatube.profiling` одной
+    JSON-строкой.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.REQUEST_PROFILING_SAMPLE_RATE
+        instrument()
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        profile = _local.profile = Profile()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(profile.execute)
+                    )
+                response = self.get_response(request)
+        finally:
+            _local.profile = None
+        self.report(request, response, profile)
+        return response
+
+    def report(self, request, response, profile):
+        total_ms = profile.total_ms
+        response['Server-Timing'] = ', '.join((
+            f'total;dur={total_ms:.1f}',
+            f'sql;dur={profile.sql_ms:.1f};desc="{profile.sql_count} queries"',
+            f'tpl;dur={profile.template_ms:.1f}',
+            f'cache;desc="{profile.cache_hits} hits, '
+            f'{profile.cache_misses} misses"',
+        ))
+        match = request.resolver_match
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 2),
+            'sql_count': profile.sql_count,
+            'sql_ms': round(profile.sql_ms, 2),
+            'template_ms': round(profile.template_ms, 2),
+            'cache_hits': profile.cache_hits,
+            'cache_misses': profile.cache_misses,
+        }, ensure_ascii=False))
@@ -1,3 +1,94 @@
-# from django.test import TestCase
+import os
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Post
+
+User = get_user_model()
+
+
+class ProfilingMiddlewareTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='profiled')
+        Post.objects.create(author=author, text='Пост для замера')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(REQUEST_PROFILING=True,
+                       REQUEST_PROFILING_SAMPLE_RATE=1)
+    def test_server_timing_and_log(self):
+        with self.assertLogs('yatube.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('posts:index'))
+        timing = response['Server-Timing']
+        for metric in ('total;dur=', 'sql;dur=', 'tpl;dur=', 'cache;desc='):
+            with self.subTest(metric=metric):
+                self.assertIn(metric, timing)
+        self.assertIn('"status": 200', logs.output[0])
+        self.assertNotIn('"sql_count": 0', logs.output[0])
+        self.assertRegex(logs.output[0], r'"cache_misses": [1-9]')
+
+    @override_settings(REQUEST_PROFILING=True,
+                       REQUEST_PROFILING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotIn('Server-Timing', response)
+
+
+class SqliteBackendTest(SimpleTestCase):
+    def connect(self, pragmas):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        handler = ConnectionHandler({DEFAULT_DB_ALIAS: {
+            'ENGINE': 'core.backends.sqlite3',
+            'NAME': os.path.join(directory.name, 'test.sqlite3'),
+            'OPTIONS': {'pragmas': pragmas},
+        }})
+        connection = handler[DEFAULT_DB_ALIAS]
+        self.addCleanup(connection.close)
+        return connection
+
+    def pragma(self, connection, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_defaults_applied_to_new_connection(self):
+        connection = self.connect({})
+        self.assertEqual(self.pragma(connection, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(connection, 'synchronous'), 1)
+        self.assertEqual(self.pragma(connection, 'busy_timeout'), 5000)
+        self.assertEqual(self.pragma(connection, 'temp_store'), 2)
+
+    def test_settings_override_and_disable_pragmas(self):
+        connection = self.connect({'journal_mode': None, 'busy_timeout': 100})
+        self.assertEqual(self.pragma(connection, 'journal_mode'), 'delete')
+        self.assertEqual(self.pragma(connection, 'busy_timeout'), 100)
+
+    def test_invalid_pragma(self):
+        connection = self.connect({'cache_size': '1; DROP TABLE x'})
+        with self.assertRaises(ImproperlyConfigured):
+            connection.ensure_connection()
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command(
+            'benchmark_sqlite', duration=0.2, rows=100, readers=1, writers=1,
+            stdout=out,
+        )
+        self.assertIn('tuned', out.getvalue())
+        self.assertIn('Ускорение', out.getvalue())
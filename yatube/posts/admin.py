@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from posts.models import Group, Post, Follow
+from posts.search import get_backend
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -16,6 +17,13 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        return get_backend().filter_queryset(queryset, search_term), False
+
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
@@ -0,0 +1,149 @@
+"""JSON-версия лент и страницы поста только для чтения.
+
+Посты сериализуются из строк `values()`, без экземпляров моделей;
+комментарии поста — страницами веток, как на HTML-странице.
+ETag ленты строится из её поколений в кэше (их меняют сигналы при любой
+правке видимых на ней данных) и ключа самого нового поста, поэтому
+повторный запрос с `If-None-Match` стоит одного индексного запроса.
+"""
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition, require_safe
+
+from .comments import comment_thread
+from .conditional import feed_etag, post_etag, post_state
+from .models import Group, Post, User
+from .utils import CursorPaginator
+
+POST_VALUES = (
+    'id', 'text', 'pub_date', 'updated', 'image', 'comments_count',
+    'author__username', 'author__first_name', 'author__last_name',
+    'group__slug', 'group__title',
+)
+
+
+def _image_url(name):
+    if not name:
+        return None
+    return Post._meta.get_field('image').storage.url(name)
+
+
+def serialize_post(row):
+    return {
+        'id': row['id'],
+        'text': row['text'],
+        'pub_date': row['pub_date'],
+        'updated': row['updated'],
+        'image': _image_url(row['image']),
+        'comments_count': row['comments_count'],
+        'author': {
+            'username': row['author__username'],
+            'first_name': row['author__first_name'],
+            'last_name': row['author__last_name'],
+        },
+        'group': row['group__slug'] and {
+            'slug': row['group__slug'],
+            'title': row['group__title'],
+        },
+    }
+
+
+def serialize_comment(comment):
+    return {
+        'id': comment.pk,
+        'parent': comment.parent_id,
+        'text': comment.text,
+        'created': comment.created,
+        'author': comment.author.username,
+    }
+
+
+def json_response(data, **kwargs):
+    return JsonResponse(
+        data,
+        encoder=DjangoJSONEncoder,
+        json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False},
+        **kwargs,
+    )
+
+
+def _links(request, page):
+    def link(cursor):
+        if cursor is None:
+            return None
+        return request.build_absolute_uri(f'{request.path}?cursor={cursor}')
+
+    return {
+        'next': link(page.next_cursor),
+        'previous': link(page.previous_cursor),
+    }
+
+
+def feed_paginator(posts):
+    return CursorPaginator(posts.values(*POST_VALUES), settings.PAGE_SIZE)
+
+
+def _page(request, posts):
+    page = feed_paginator(posts).cursor_page(request.GET.get('cursor'))
+    return {
+        'results': [serialize_post(row) for row in page],
+        **_links(request, page),
+    }
+
+
+def feed_view(posts_for, scope, owner=None):
+    """Представление ленты: `posts_for` отдаёт посты по аргументам URL.
+
+    `owner` проверяет, что группа или автор существуют; проверка нужна
+    только для пустой страницы, иначе лишний запрос шёл бы на каждый
+    опрос.
+    """
+
+    def etag_func(request, **kwargs):
+        return feed_etag(
+            posts_for(**kwargs), scope(**kwargs), request.GET.get('cursor')
+        )
+
+    @require_safe
+    @condition(etag_func=etag_func)
+    def view(request, **kwargs):
+        data = _page(request, posts_for(**kwargs))
+        if not data['results'] and owner and not owner(**kwargs).exists():
+            raise Http404
+        return json_response(data)
+
+    view.posts_for = posts_for
+    return view
+
+
+index = feed_view(Post.objects.all, lambda: 'index')
+group_posts = feed_view(
+    lambda slug: Post.objects.filter(group__slug=slug),
+    lambda slug: f'group:{slug}',
+    lambda slug: Group.objects.filter(slug=slug),
+)
+profile = feed_view(
+    lambda username: Post.objects.filter(author__username=username),
+    lambda username: f'profile:{username}',
+    lambda username: User.objects.filter(username=username),
+)
+
+
+def _post_etag(request, post_id):
+    return post_etag(
+        post_id, post_state(request, post_id), request.GET.get('cursor'))
+
+
+@require_safe
+@condition(etag_func=_post_etag)
+def post_detail(request, post_id):
+    row = get_object_or_404(Post.objects.values(*POST_VALUES), pk=post_id)
+    data = serialize_post(row)
+    comments, page = comment_thread(post_id, request.GET.get('cursor'))
+    data['comments'] = {
+        'results': [serialize_comment(comment) for comment in comments],
+        **_links(request, page),
+    }
+    return json_response(data)
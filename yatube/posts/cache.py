@@ -0,0 +1,222 @@
+import hashlib
+import math
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+
+def version_key(scope, pk):
+    return f'version:{scope}:{pk}'
+
+
+def _initial_version():
+    # Версия, вытесненная из кэша, не должна начинаться заново с 1,
+    # иначе снова станут видны старые фрагменты с той же версией.
+    return int(time.time() * 1000)
+
+
+def get_versions(*pairs):
+    """Текущие версии объектов, переданных парами `(scope, pk)`."""
+    keys = [version_key(scope, pk) for scope, pk in pairs]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(scope, pk):
+    """Инвалидирует все ключи, построенные на версии объекта."""
+    key = version_key(scope, pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), None)
+
+
+def post_card_key(post, group_page):
+    post_version, author_version, group_version = get_versions(
+        ('post', post.pk),
+        ('user', post.author_id),
+        ('group', post.group_id),
+    )
+    return 'post_card:{}:{}:{}:{}:{}:{}:{}'.format(
+        post.pk,
+        post.updated.timestamp(),
+        post.comments_count,
+        post_version,
+        author_version,
+        group_version,
+        int(group_page),
+    )
+
+
+def get_post_card(post, group_page, render):
+    """Готовая карточка поста из кэша или результат `render()`."""
+    key = post_card_key(post, group_page)
+    html = cache.get(key)
+    if html is None:
+        html = render()
+        cache.set(key, html, settings.POST_CARD_CACHE_TIMEOUT)
+    return html
+
+
+# Поколение, общее для всех лент: меняется при правке групп и авторов,
+# которые видны в карточках на любых страницах.
+ALL_FEEDS = 'all'
+
+
+def feed_scopes(post):
+    """Ленты, на которых виден пост: главная, группа и профиль автора."""
+    scopes = ['index', f'profile:{post.author.username}']
+    if post.group_id:
+        scopes.append(f'group:{post.group.slug}')
+    return scopes
+
+
+def bump_feeds(*scopes):
+    """Меняет поколение лент, чтобы их кэш перестал использоваться."""
+    for scope in scopes:
+        bump_version('feed', scope)
+
+
+def lock_key(key):
+    return f'lock:{key}'
+
+
+def acquire_lock(key):
+    """Атомарно берёт блокировку пересчёта ключа через `cache.add`."""
+    return cache.add(lock_key(key), 1, settings.VIEW_CACHE_LOCK_TIMEOUT)
+
+
+def release_lock(key):
+    cache.delete(lock_key(key))
+
+
+def _is_fresh(entry):
+    # Вероятностное раннее истечение (XFetch): чем дольше пересчёт и
+    # ближе срок, тем вероятнее, что кто-то обновит запись заранее.
+    early = entry['delta'] * settings.VIEW_CACHE_EARLY_BETA * -math.log(
+        1.0 - random.random()
+    )
+    return time.time() + early < entry['expires']
+
+
+def _to_response(request, entry):
+    """Ответ из записи кэша; по его ETag и Last-Modified запрос может
+    получить 304 без обращения к базе."""
+    response = HttpResponse(entry['content'], status=entry['status'])
+    for header, value in entry['headers']:
+        response[header] = value
+    last_modified = response.get('Last-Modified')
+    return get_conditional_response(
+        request,
+        etag=response.get('ETag'),
+        last_modified=last_modified and parse_http_date_safe(last_modified),
+        response=response,
+    )
+
+
+def _store(key, response, delta, timeout):
+    cache.set(key, {
+        'content': response.content,
+        'status': response.status_code,
+        'headers': list(response.items()),
+        'expires': time.time() + timeout,
+        'delta': delta,
+    }, timeout + settings.VIEW_CACHE_STALE_TIMEOUT)
+
+
+def _cacheable(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_USED')
+    )
+
+
+def _wait_for(key):
+    """Ждёт запись, пока держится блокировка пересчёта.
+
+    Владелец снимает блокировку и тогда, когда ответ не кэшируется
+    (404, куки, исключение): после этого ждать нечего.
+    """
+    deadline = time.time() + settings.VIEW_CACHE_LOCK_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(settings.VIEW_CACHE_POLL_INTERVAL)
+        found = cache.get_many([key, lock_key(key)])
+        if key in found:
+            return found[key]
+        if lock_key(key) not in found:
+            return None
+    return None
+
+
+def cached_view(key_func, timeout=None):
+    """Кэширует ответ представления с защитой от «давки» пересчётов.
+
+    Истёкшую запись пересчитывает только запрос, взявший блокировку,
+    остальные получают устаревший ответ. Если записи нет совсем,
+    остальные запросы недолго ждут её появления. По умолчанию время
+    жизни берётся из `FEED_CACHE_TIMEOUT`.
+
+    Декоратор `condition()` ставится внутри: тогда ETag сохраняется
+    вместе с ответом и при попадании в кэш не вычисляется заново.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            key = key_func(request, *args, **kwargs)
+            entry = cache.get(key)
+            if entry is not None and _is_fresh(entry):
+                return _to_response(request, entry)
+            locked = acquire_lock(key)
+            if not locked:
+                entry = entry or _wait_for(key)
+                if entry is not None:
+                    return _to_response(request, entry)
+            try:
+                started = time.time()
+                response = view(request, *args, **kwargs)
+                if _cacheable(request, response):
+                    _store(
+                        key,
+                        response,
+                        time.time() - started,
+                        timeout or settings.FEED_CACHE_TIMEOUT,
+                    )
+            finally:
+                # Чужую блокировку не снимаем: её владелец ещё считает.
+                if locked:
+                    release_lock(key)
+            return response
+        return wrapper
+    return decorator
+
+
+def cache_feed(scope, timeout=None):
+    """Кэш страницы ленты, ключ которого включает поколения ленты.
+
+    `scope` получает аргументы представления и возвращает имя ленты.
+    """
+    def key_func(request, *args, **kwargs):
+        generations = get_versions(
+            ('feed', ALL_FEEDS),
+            ('feed', scope(request, *args, **kwargs)),
+        )
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        return 'feed:{}:{}:{}:{}'.format(
+            *generations, request.user.pk or 0, path
+        )
+
+    return cached_view(key_func, timeout)
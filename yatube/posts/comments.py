@@ -0,0 +1,32 @@
+from django.conf import settings
+
+from .models import COMMENT_PATH_STEP, Comment
+from .utils import CursorPaginator
+
+
+def comment_roots(post_id):
+    """Курсорный пагинатор корней веток, новые первыми."""
+    return CursorPaginator(
+        Comment.objects.filter(post_id=post_id).roots().select_related(
+            'author'),
+        settings.COMMENTS_PAGE_SIZE,
+        ordering=('-created', '-id'),
+    )
+
+
+def comment_thread(post_id, cursor=None):
+    """Страница веток комментариев: корни по ключу `(created, id)`,
+    новые первыми, и все ответы на них одним диапазонным запросом.
+
+    Возвращает комментарии в порядке обхода и страницу корней с
+    курсорами соседних страниц.
+    """
+    page = comment_roots(post_id).cursor_page(cursor)
+    replies = {}
+    for reply in Comment.objects.subtrees(page).select_related('author'):
+        replies.setdefault(reply.path[:COMMENT_PATH_STEP], []).append(reply)
+    comments = []
+    for root in page:
+        comments.append(root)
+        comments.extend(replies.get(root.path, []))
+    return comments, page
@@ -0,0 +1,94 @@
+"""ETag и Last-Modified для условных GET-запросов.
+
+Функции вызываются декоратором `condition()` до представления и
+обходятся одним индексным запросом; версии объектов и поколения лент
+берутся из кэша.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import OuterRef, Subquery
+
+from .cache import ALL_FEEDS, get_versions
+from .models import Comment, Post
+from .utils import CURSOR_ORDERING
+
+# Меняется вместе с разметкой или форматом ответа, чтобы старые ETag
+# не совпали с новыми.
+FORMAT_VERSION = 1
+
+
+def make_etag(*parts):
+    raw = json.dumps(
+        [FORMAT_VERSION, *parts], cls=DjangoJSONEncoder, separators=(',', ':')
+    )
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def viewer(request):
+    """Что в ответе зависит от пользователя: шапка, кнопки и формы.
+
+    Токен CSRF в формах действителен, пока не сменилась его cookie.
+    """
+    return (
+        request.user.pk,
+        request.user.get_username(),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+    )
+
+
+def feed_etag(posts, scope, *extra):
+    """ETag страницы ленты `scope`, собранной из `posts`."""
+    newest = posts.order_by(*CURSOR_ORDERING).values_list(
+        'pub_date', 'id').first()
+    return make_etag(
+        get_versions(('feed', ALL_FEEDS), ('feed', scope)),
+        newest,
+        settings.PAGE_SIZE,
+        *extra,
+    )
+
+
+def post_state(request, post_id):
+    """Всё, от чего зависит страница поста, одним запросом.
+
+    Результат запоминается в запросе: его читают и `etag_func`,
+    и `last_modified_func`.
+    """
+    cache = request.__dict__.setdefault('_post_states', {})
+    if post_id not in cache:
+        last_comment = Comment.objects.filter(
+            post=OuterRef('pk')
+        ).order_by('-created').values('created')[:1]
+        cache[post_id] = Post.objects.filter(pk=post_id).annotate(
+            last_comment=Subquery(last_comment)
+        ).order_by().values(
+            'updated', 'comments_count', 'author_id', 'group_id',
+            'last_comment',
+        ).first()
+    return cache[post_id]
+
+
+def post_etag(post_id, state, *extra):
+    if state is None:
+        return None
+    return make_etag(
+        get_versions(
+            ('post', post_id),
+            ('user', state['author_id']),
+            ('group', state['group_id']),
+        ),
+        state['updated'],
+        state['comments_count'],
+        state['last_comment'],
+        *extra,
+    )
+
+
+def post_last_modified(state):
+    """Время последней правки поста или последнего комментария."""
+    if state is None:
+        return None
+    return max(filter(None, (state['updated'], state['last_comment'])))
@@ -0,0 +1,65 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+def _apply(queryset, **deltas):
+    """Атомарно сдвигает счётчики через `F()`, не уходя ниже нуля."""
+    updated = 0
+    for field, delta in deltas.items():
+        target = queryset
+        if delta < 0:
+            target = target.filter(**{f'{field}__gte': -delta})
+        updated = target.update(**{field: F(field) + delta})
+    return updated
+
+
+def change_post(post_id, delta):
+    _apply(Post.objects.filter(pk=post_id), comments_count=delta)
+
+
+def change_group(group_id, delta):
+    if group_id:
+        _apply(Group.objects.filter(pk=group_id), posts_count=delta)
+
+
+def change_user(user_id, **deltas):
+    updated = _apply(UserStats.objects.filter(pk=user_id), **deltas)
+    if not updated and all(delta > 0 for delta in deltas.values()):
+        # Пользователь создан в обход сигналов: считаем всё заново.
+        recount_users(User.objects.filter(pk=user_id))
+
+
+def _count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+def recount_posts(posts=None):
+    posts = Post.objects.all() if posts is None else posts
+    return posts.update(comments_count=_count(Comment, 'post'))
+
+
+def recount_groups(groups=None):
+    groups = Group.objects.all() if groups is None else groups
+    return groups.update(posts_count=_count(Post, 'group'))
+
+
+def recount_users(users=None):
+    users = User.objects.all() if users is None else users
+    UserStats.objects.bulk_create(
+        (UserStats(user_id=user_id) for user_id in users.filter(
+            stats__isnull=True).values_list('pk', flat=True)),
+        ignore_conflicts=True,
+    )
+    return UserStats.objects.filter(user__in=users).update(
+        posts_count=_count(Post, 'author'),
+        followers_count=_count(Follow, 'author'),
+        following_count=_count(Follow, 'user'),
+    )
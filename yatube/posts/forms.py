@@ -1,6 +1,11 @@
 from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
 
-from .models import Post, Comment
+from .models import COMMENT_PATH_STEP, Comment, Post
+from .uploads import check_size, downscale, validate_image
+from .utils import parse_id
 
 
 class PostForm(forms.ModelForm):
@@ -8,8 +13,61 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['image'].validators.append(validate_image)
+        # Слишком большой файл сохранён обрезанным: не даём полю разбирать
+        # его как картинку и сообщаем о размере в clean_image().
+        self.oversized = None
+        image = self.files.get('image')
+        if image is not None:
+            try:
+                check_size(image)
+            except ValidationError as error:
+                self.oversized = error
+                self.files = self.files.copy()
+                del self.files['image']
+
+    def clean_image(self):
+        if self.oversized:
+            raise self.oversized
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            return downscale(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
+    """Ответ на комментарий приходит скрытым `parent` вне полей формы:
+    на странице поста форма состоит из одного поля."""
+
     class Meta:
         model = Comment
         fields = ('text',)
+
+    def __init__(self, *args, post=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.post = post
+
+    def clean(self):
+        cleaned_data = super().clean()
+        parent_id = self.data.get('parent', '')
+        if parent_id:
+            parent = Comment.objects.only('id', 'path').filter(
+                pk=parse_id(parent_id),
+                post=self.post,
+            ).first()
+            if parent is None:
+                raise ValidationError('Комментарий для ответа не найден.')
+            self.instance.parent = self.limit_depth(parent)
+        return cleaned_data
+
+    def limit_depth(self, parent):
+        """Слишком глубокий ответ прикрепляется к предку на последнем
+        допустимом уровне."""
+        max_depth = settings.COMMENT_MAX_DEPTH
+        if parent.depth < max_depth:
+            return parent
+        return Comment.objects.only('id', 'path').get(
+            path=parent.path[:COMMENT_PATH_STEP * max_depth]
+        )
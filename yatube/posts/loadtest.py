@@ -0,0 +1,350 @@
+"""Нагрузочный прогон WSGI-приложения без внешних инструментов.
+
+Запросы отправляются либо прямо в `yatube.wsgi.application` в том же
+процессе, либо по HTTP на локальный сервер. Число SQL-запросов считает
+обёртка `count_queries`: она отдаёт его в заголовке ответа, поэтому
+в режиме сокета оно известно, только если сервер запущен этой же
+командой.
+"""
+import bisect
+import http.client
+import io
+import random
+import re
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.db import connection
+from django.middleware.csrf import CSRF_TOKEN_LENGTH
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+QUERIES_HEADER = 'X-DB-Queries'
+# Верхние границы корзин гистограммы задержек, мс.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+# Доля адресов в смеси по умолчанию.
+DEFAULT_MIX = {
+    'index': 30,
+    'group_list': 15,
+    'profile': 15,
+    'post_detail': 25,
+    'follow_index': 10,
+    'add_comment': 5,
+}
+# Эти адреса запрашиваются только от имени вошедших пользователей.
+AUTH_ONLY = {'follow_index', 'add_comment'}
+# Ссылки пагинатора на соседние страницы ленты.
+CURSOR_LINK = re.compile(r'href="\?cursor=([^"&]+)"')
+# Сколько найденных курсоров помнит поток и как часто по ним переходит.
+MAX_CURSORS = 100
+FOLLOW_CURSOR_SHARE = 0.5
+
+
+def count_queries(application):
+    """WSGI-обёртка, добавляющая в ответ число SQL-запросов."""
+
+    def wrapped(environ, start_response):
+        queries = 0
+
+        def counter(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        def counting_start_response(status, headers, exc_info=None):
+            headers.append((QUERIES_HEADER, str(queries)))
+            return start_response(status, headers, exc_info)
+
+        with connection.execute_wrapper(counter):
+            return application(environ, counting_start_response)
+
+    return wrapped
+
+
+class Response:
+    def __init__(self, status, headers, body=b''):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def queries(self):
+        value = self.headers.get(QUERIES_HEADER.lower())
+        return None if value is None else int(value)
+
+
+class InProcessTransport:
+    """Вызывает WSGI-приложение напрямую, без сети."""
+
+    def __init__(self, application):
+        self.application = application
+
+    def request(self, method, path, headers, body=b''):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': io.StringIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = f'HTTP_{key}'
+            environ[key] = value
+        started = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            started['status'] = int(status.split()[0])
+            started['headers'] = {
+                name.lower(): value for name, value in response_headers
+            }
+
+        result = self.application(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return Response(started['status'], started['headers'], body)
+
+
+class SocketTransport:
+    """Ходит на сервер по HTTP с keep-alive; одно соединение на поток."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, headers, body=b''):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=60
+            )
+        try:
+            self.local.connection.request(method, path, body, headers)
+            response = self.local.connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            self.local.connection.close()
+            self.local.connection = None
+            raise
+        return Response(response.status, {
+            name.lower(): value for name, value in response.getheaders()
+        }, body)
+
+
+class Stats:
+    """Задержки и счётчики по адресам; складывается между потоками."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.queries = Counter()
+        self.counted = Counter()
+        self.errors = Counter()
+        self.statuses = {}
+
+    def add(self, name, elapsed_ms, response):
+        self.latencies.setdefault(name, []).append(elapsed_ms)
+        self.statuses.setdefault(name, Counter())[response.status] += 1
+        if response.status >= 400:
+            self.errors[name] += 1
+        if response.queries is not None:
+            self.queries[name] += response.queries
+            self.counted[name] += 1
+
+    def fail(self, name):
+        self.errors[name] += 1
+
+    def merge(self, other):
+        for name, values in other.latencies.items():
+            self.latencies.setdefault(name, []).extend(values)
+        for name, statuses in other.statuses.items():
+            self.statuses.setdefault(name, Counter()).update(statuses)
+        self.queries.update(other.queries)
+        self.counted.update(other.counted)
+        self.errors.update(other.errors)
+        return self
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def histogram(values):
+    counts = [0] * (len(BUCKETS) + 1)
+    for value in values:
+        counts[bisect.bisect_left(BUCKETS, value)] += 1
+    return counts
+
+
+class Plan:
+    """Что запрашивать: смесь адресов, объекты и сессии пользователей.
+
+    Собирается один раз в основном процессе и передаётся в рабочие.
+    """
+
+    def __init__(self, mix, auth_ratio, sessions, group_slugs, usernames,
+                 post_ids, seed=0):
+        self.auth_ratio = auth_ratio
+        self.sessions = sessions
+        self.group_slugs = group_slugs
+        self.usernames = usernames
+        self.post_ids = post_ids
+        self.seed = seed
+        self.csrf_token = get_random_string(CSRF_TOKEN_LENGTH)
+        missing = self.missing()
+        self.mix = {
+            name: weight for name, weight in mix.items()
+            if name not in missing and weight > 0
+        }
+        self.names = list(self.mix)
+        self.weights = list(self.mix.values())
+
+    def missing(self):
+        """Адреса, для которых в базе нет данных."""
+        missing = set()
+        if not self.group_slugs:
+            missing.add('group_list')
+        if not self.usernames:
+            missing.add('profile')
+        if not self.post_ids:
+            missing.update({'post_detail', 'add_comment'})
+        if not self.sessions:
+            missing.update(AUTH_ONLY)
+        return missing
+
+    def path(self, name, rnd, cursors=()):
+        if name == 'index':
+            # Клиенты листают ленту по курсорам из ссылок на страницах,
+            # а не по номерам страниц.
+            if cursors and rnd.random() < FOLLOW_CURSOR_SHARE:
+                cursor = cursors.pop(rnd.randrange(len(cursors)))
+                return reverse('posts:index') + f'?cursor={cursor}'
+            return reverse('posts:index')
+        if name == 'group_list':
+            return reverse(
+                'posts:group_list', args=[rnd.choice(self.group_slugs)])
+        if name == 'profile':
+            return reverse('posts:profile', args=[rnd.choice(self.usernames)])
+        if name in ('post_detail', 'add_comment'):
+            return reverse(f'posts:{name}', args=[rnd.choice(self.post_ids)])
+        return reverse(f'posts:{name}')
+
+    def request(self, rnd, cursors=()):
+        """`(имя, метод, путь, заголовки, тело)` очередного запроса.
+
+        `cursors` — курсоры, найденные на уже полученных страницах ленты.
+        """
+        name = rnd.choices(self.names, self.weights)[0]
+        headers = {'Host': 'localhost'}
+        body = b''
+        logged_in = self.sessions and (
+            name in AUTH_ONLY or rnd.random() < self.auth_ratio
+        )
+        cookies = {}
+        if logged_in:
+            cookies[settings.SESSION_COOKIE_NAME] = rnd.choice(self.sessions)
+        method = 'GET'
+        if name == 'add_comment':
+            method = 'POST'
+            # В cookie и в форме один и тот же замаскированный токен,
+            # после снятия маски они совпадают.
+            cookies[settings.CSRF_COOKIE_NAME] = self.csrf_token
+            body = urlencode({
+                'text': f'Нагрузочный комментарий {rnd.random():.6f}',
+                'csrfmiddlewaretoken': self.csrf_token,
+            }).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            headers['Content-Length'] = str(len(body))
+        if cookies:
+            headers['Cookie'] = '; '.join(
+                f'{key}={value}' for key, value in cookies.items()
+            )
+        return name, method, self.path(name, rnd, cursors), headers, body
+
+
+def drive(plan, transport, deadline, requests, rnd):
+    """Шлёт запросы, пока не истечёт время или лимит запросов."""
+    stats = Stats()
+    sent = 0
+    cursors = []
+    while time.monotonic() < deadline and (
+        requests is None or sent < requests
+    ):
+        name, method, path, headers, body = plan.request(rnd, cursors)
+        sent += 1
+        started = time.perf_counter()
+        try:
+            response = transport.request(method, path, headers, body)
+        except Exception:
+            stats.fail(name)
+            continue
+        stats.add(name, (time.perf_counter() - started) * 1000, response)
+        if name == 'index' and len(cursors) < MAX_CURSORS:
+            cursors.extend(
+                CURSOR_LINK.findall(response.body.decode(errors='replace')))
+    return stats
+
+
+def run_threads(plan, transport, threads, duration, requests, worker=0):
+    """Прогон в `threads` потоках текущего процесса."""
+    deadline = time.monotonic() + duration
+    shares = [None] * threads
+    if requests is not None:
+        shares = [
+            requests // threads + (index < requests % threads)
+            for index in range(threads)
+        ]
+    results = [None] * threads
+
+    def target(index):
+        rnd = random.Random(f'{plan.seed}:{worker}:{index}')
+        try:
+            results[index] = drive(
+                plan, transport, deadline, shares[index], rnd
+            )
+        finally:
+            connection.close()
+
+    if threads == 1:
+        rnd = random.Random(f'{plan.seed}:{worker}:0')
+        return drive(plan, transport, deadline, shares[0], rnd)
+    pool = [
+        threading.Thread(target=target, args=(index,))
+        for index in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    total = Stats()
+    for stats in results:
+        if stats is not None:
+            total.merge(stats)
+    return total
+
+
+def worker_run(plan, url, threads, duration, requests, worker):
+    """Точка входа рабочего процесса."""
+    if url:
+        transport = SocketTransport(url)
+    else:
+        from yatube.wsgi import application
+        transport = InProcessTransport(count_queries(application))
+    return run_threads(plan, transport, threads, duration, requests, worker)
@@ -0,0 +1,100 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from posts.counters import recount_users
+from posts.models import Follow, Post, User
+from posts.timeline import HybridFeedPaginator, fan_out, follow_feed
+
+
+def _timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает fan-out на запись и pull на чтение для авторов '
+        'с разным числом подписчиков. Данные откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--followers', type=int, nargs='+',
+            default=[10, 100, 1000, 10000],
+        )
+        parser.add_argument(
+            '--active-ratio', type=float, default=0.05,
+            help='Доля подписчиков, читающих ленту после каждого поста.',
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        options['repeat'] = min(options['repeat'], settings.PAGE_SIZE * 2)
+        self.stdout.write(
+            f'{"followers":>10} {"push, ms":>10} {"pull, ms":>10} '
+            f'{"winner":>8}'
+        )
+        for followers in options['followers']:
+            with transaction.atomic():
+                push, pull = self.measure(followers, options['repeat'])
+                transaction.set_rollback(True)
+            pull_total = pull * followers * options['active_ratio']
+            winner = 'push' if push <= pull_total else 'pull'
+            self.stdout.write(
+                f'{followers:>10} {push:>10.2f} {pull_total:>10.2f} '
+                f'{winner:>8}'
+            )
+
+    def measure(self, followers, repeat):
+        """Время fan-out одного поста и добавка pull к чтению страницы."""
+        author = User.objects.create(username=f'bench_author_{followers}')
+        User.objects.bulk_create(
+            User(username=f'bench_{followers}_{i}') for i in range(followers)
+        )
+        readers = User.objects.filter(
+            username__startswith=f'bench_{followers}_')
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=author) for reader in readers
+        )
+        # bulk_create обходит сигналы, а по этому счётчику выбирается режим.
+        recount_users(User.objects.filter(pk=author.pk))
+        reader = readers.first()
+        Post.objects.bulk_create(
+            Post(author=author, text=f'Пост {i}')
+            for i in range(settings.PAGE_SIZE * 2)
+        )
+        posts = iter(Post.objects.filter(author=author)[:repeat])
+        cache.clear()
+        with override_settings(FEED_CELEBRITY_THRESHOLD=followers + 1):
+            self.check_mode(author, reader, pulled=False)
+            push = _timed(lambda: fan_out(next(posts)), repeat)
+            plain = _timed(lambda: self.read(reader), repeat)
+        cache.clear()
+        with override_settings(FEED_CELEBRITY_THRESHOLD=1):
+            self.check_mode(author, reader, pulled=True)
+            pulled = _timed(lambda: self.read(reader), repeat)
+        cache.clear()
+        return push, max(pulled - plain, 0)
+
+    def check_mode(self, author, reader, pulled):
+        paginator = HybridFeedPaginator(
+            follow_feed(reader), settings.PAGE_SIZE, user=reader
+        )
+        if (author.pk in paginator.pulled_authors) != pulled:
+            raise CommandError(
+                f'Автор должен {"" if pulled else "не "}подтягиваться '
+                f'при чтении, проверьте счётчик подписчиков.'
+            )
+
+    def read(self, reader):
+        paginator = HybridFeedPaginator(
+            follow_feed(reader), settings.PAGE_SIZE, user=reader
+        )
+        list(paginator.cursor_page())
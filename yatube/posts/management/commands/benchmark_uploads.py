@@ -0,0 +1,96 @@
+import multiprocessing
+import resource
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import django
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import MemoryFileUploadHandler
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from PIL import Image
+
+from posts.forms import PostForm
+from posts.uploads import StreamingUploadHandler
+
+
+# JPEG декодируется сразу уменьшенным, PNG — только целиком.
+FORMATS = {'JPEG': {'quality': 95}, 'PNG': {'compress_level': 1}}
+
+
+def make_photo(width, height, image_format='JPEG'):
+    """Картинка из шума: сжимается плохо, как настоящая фотография."""
+    noise = Image.effect_noise((width, height), 64)
+    image = Image.merge('RGB', (noise, noise.rotate(90, expand=False), noise))
+    data = BytesIO()
+    image.save(data, image_format, **FORMATS[image_format])
+    return data.getvalue()
+
+
+def measure(mode, photo, image_format='JPEG'):
+    """Разбирает запрос с картинкой и валидирует форму поста."""
+    extension = image_format.lower()
+    request = RequestFactory().post('/create/', {
+        'text': 'Тест',
+        'image': SimpleUploadedFile(
+            f'photo.{extension}', photo, f'image/{extension}'),
+    })
+    if mode == 'memory':
+        handler = MemoryFileUploadHandler(request)
+        limit = len(photo) * 2
+    else:
+        handler = StreamingUploadHandler(request)
+        limit = 0
+    request.upload_handlers = [handler]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=limit):
+        form = PostForm(request.POST, request.FILES)
+        valid = form.is_valid()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return valid, peak, (rss_after - rss_before) * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пик памяти при загрузке большой картинки в память и '
+        'потоком на диск.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=8000)
+        parser.add_argument('--height', type=int, default=6000)
+        parser.add_argument(
+            '--formats', nargs='+', choices=FORMATS, default=list(FORMATS),
+            help='PNG больше POST_IMAGE_MAX_PIXELS_UNDRAFTABLE отклоняется '
+                 'по заголовку, не раскрываясь.',
+        )
+
+    def handle(self, *args, **options):
+        for image_format in options['formats']:
+            photo = make_photo(
+                options['width'], options['height'], image_format)
+            self.stdout.write(
+                f'{image_format} {options["width"]}×{options["height"]}, '
+                f'{len(photo) / 2 ** 20:.1f} МБ'
+            )
+            self.compare(photo, image_format)
+
+    def compare(self, photo, image_format):
+        # Свежий процесс на каждый прогон: ru_maxrss — пиковое значение,
+        # и после fork оно досталось бы от родителя.
+        context = multiprocessing.get_context('spawn')
+        for mode in ('memory', 'streaming'):
+            with ProcessPoolExecutor(
+                1, mp_context=context, initializer=django.setup
+            ) as executor:
+                valid, peak, rss = executor.submit(
+                    measure, mode, photo, image_format).result()
+            self.stdout.write(
+                f'  {mode}: форма {"принята" if valid else "отклонена"}, '
+                f'пик Python-аллокаций {peak / 2 ** 20:.1f} МБ, '
+                f'рост RSS {rss / 2 ** 20:.1f} МБ'
+            )
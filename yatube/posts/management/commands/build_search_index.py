@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.search.inverted import build_index
+
+
+class Command(BaseCommand):
+    help = 'Собирает файл инвертированного индекса для поиска по постам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=settings.SEARCH_INDEX_PATH,
+            help='Куда записать индекс.',
+        )
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        terms = build_index(options['path'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс записан в {options["path"]}, термов: {terms}'
+        ))
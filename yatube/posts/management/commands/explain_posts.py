@@ -0,0 +1,147 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from posts import api
+from posts.comments import comment_roots
+from posts.models import Comment, Follow, Group, Post, User
+from posts.search import get_backend
+from posts.timeline import HybridFeedPaginator, celebrity_stats, follow_feed
+from posts.utils import CURSOR_ORDERING, CursorPaginator
+
+# Признаки плана, означающие полный проход таблицы или лишнюю сортировку.
+WARNINGS = ('SCAN', 'USE TEMP B-TREE')
+# По этим таблицам и проход по индексу — ошибка: страница должна читаться
+# диапазоном, а не перебором строк до курсора.
+RANGE_TABLES = ('posts_post', 'posts_timelineentry')
+# Ожидаемые шаги: поиск по FTS5 идёт через виртуальную таблицу, а
+# сортировка по bm25 возможна только среди найденных строк. Посты старше
+# ленты читаются диапазонами индекса по каждому автору и сортируются
+# после слияния; это редкий путь за `TIMELINE_DEPTH`.
+EXPECTED = {
+    'search: индекс': ('VIRTUAL TABLE', 'USE TEMP B-TREE FOR ORDER BY'),
+    'follow_index: старые посты': ('USE TEMP B-TREE FOR ORDER BY',),
+}
+
+
+def deep_position():
+    """Ключ самого старого поста: курсор в глубине таблицы, где полный
+    проход был бы самым дорогим. Без постов — дата в далёком прошлом."""
+    oldest = Post.objects.order_by(*CURSOR_ORDERING).reverse().values_list(
+        'pub_date', 'id').first()
+    return oldest or (timezone.now() - timedelta(days=365 * 10), 1)
+
+
+def _page(paginator, position):
+    """Запрос страницы после курсора, как при переходе по `?cursor=`."""
+    return paginator.page_queryset(position, False, paginator.per_page + 1)
+
+
+def flagged(name, detail):
+    """Отмечает полный проход, проход таблиц постов и ленты даже по
+    индексу и лишнюю сортировку, кроме ожидаемых для запроса шагов."""
+    if any(step in detail for step in EXPECTED.get(name, ())):
+        return False
+    words = detail.split()
+    if words[:1] == ['SCAN'] and words[1:2] and words[1] in RANGE_TABLES:
+        return True
+    return any(
+        warning in detail for warning in WARNINGS
+    ) and 'USING' not in detail
+
+
+def view_querysets():
+    """Запросы представлений приложения posts.
+
+    Собираются теми же функциями, что вызывают представления, поэтому
+    не расходятся с ними. Значение — queryset или пара `(sql, params)`.
+    """
+    user = User(pk=1, username='user')
+    group = Group(pk=1, slug='group')
+    post = Post(pk=1)
+    root = Comment(pk=1, path='0000000001')
+    follow_paginator = HybridFeedPaginator(
+        follow_feed(user), settings.PAGE_SIZE, user=user
+    )
+    position = deep_position()
+
+    def feed(posts):
+        return _page(CursorPaginator(posts, settings.PAGE_SIZE), position)
+
+    queries = {
+        'index': feed(Post.objects.for_feed()),
+        'group_posts: группа': Group.objects.filter(slug=group.slug),
+        'group_posts': feed(group.posts.for_feed()),
+        'profile: автор': User.objects.filter(username=user.username),
+        'profile': feed(user.posts.for_feed()),
+        'profile: подписка': Follow.objects.filter(user=user, author=user),
+        'post_detail': Post.objects.for_detail().filter(pk=post.pk),
+        'post_detail: комментарии': _page(comment_roots(post.pk), position),
+        'post_detail: ответы': Comment.objects.subtrees([root]),
+        'follow_index': _page(follow_paginator, position),
+        'follow_index: старые посты': follow_paginator.older_queryset(
+            position, False, settings.PAGE_SIZE + 1
+        ),
+        'follow_index: знаменитости': celebrity_stats(),
+        'follow_index: pull': follow_paginator.pull_queryset(
+            user.pk, position, False, settings.PAGE_SIZE + 1
+        ),
+        'add_comment': Post.objects.only('id').filter(pk=post.pk),
+        'add_comment: ответ': Comment.objects.only('id', 'path').filter(
+            pk=root.pk, post=post
+        ),
+        # Так посты найденных id выбирает `in_bulk()`.
+        'search': Post.objects.for_feed().filter(pk__in=[1, 2]).order_by(),
+        'api: index': _page(
+            api.feed_paginator(api.index.posts_for()), position),
+        'api: group_posts': _page(api.feed_paginator(
+            api.group_posts.posts_for(slug=group.slug)), position),
+        'api: profile': _page(api.feed_paginator(
+            api.profile.posts_for(username=user.username)), position),
+        'api: post_detail': Post.objects.values(
+            *api.POST_VALUES).filter(pk=post.pk),
+    }
+    results = get_backend().results('пост')
+    if hasattr(results, 'statement'):
+        queries['search: индекс'] = results.statement(0, settings.PAGE_SIZE)
+    return queries
+
+
+def _statement(query):
+    if isinstance(query, tuple):
+        return query
+    return query.query.sql_with_params()
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет EXPLAIN QUERY PLAN для запросов представлений posts '
+        'и отмечает полные проходы таблиц.'
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Команда поддерживает только SQLite.')
+        problems = 0
+        with connection.cursor() as cursor:
+            for name, query in view_querysets().items():
+                sql, params = _statement(query)
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    warning = flagged(name, detail)
+                    problems += warning
+                    line = f'  {detail}'
+                    self.stdout.write(
+                        self.style.WARNING(line) if warning else line
+                    )
+        if problems:
+            self.stdout.write(self.style.WARNING(
+                f'Найдено проблемных шагов плана: {problems}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('Полных проходов нет'))
@@ -0,0 +1,193 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (ThreadedWSGIServer,
+                                          WSGIRequestHandler)
+from django.test import Client
+
+from posts.loadtest import (BUCKETS, DEFAULT_MIX, Plan, Stats, count_queries,
+                            histogram, percentile, worker_run)
+from posts.models import Group, Post, User
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise CommandError(
+                f'Неизвестный адрес «{name}», доступны: '
+                f'{", ".join(DEFAULT_MIX)}'
+            )
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон смеси запросов к приложению: в том же процессе '
+        'или по HTTP. Печатает пропускную способность, задержки и число '
+        'SQL-запросов по адресам. Запросы на запись меняют базу.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument(
+            '--requests', type=int,
+            help='Остановиться после стольких запросов на процесс.',
+        )
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument(
+            '--processes', type=int, default=0,
+            help='Рабочие процессы; 0 — только текущий процесс.',
+        )
+        target = parser.add_mutually_exclusive_group()
+        target.add_argument(
+            '--url', help='Адрес уже запущенного сервера, например '
+                          'http://127.0.0.1:8000.',
+        )
+        target.add_argument(
+            '--serve', action='store_true',
+            help='Поднять многопоточный HTTP-сервер на свободном порту.',
+        )
+        parser.add_argument(
+            '--mix', type=parse_mix, default=DEFAULT_MIX,
+            help='Веса адресов: index=30,post_detail=25,…',
+        )
+        parser.add_argument(
+            '--auth-ratio', type=float, default=0.3,
+            help='Доля запросов на чтение от вошедших пользователей.',
+        )
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--sample', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def plan(self, options):
+        sample = options['sample']
+        users = list(User.objects.filter(
+            follower__isnull=False).distinct().order_by('pk')[
+                :options['users']])
+        if len(users) < options['users']:
+            users += list(User.objects.exclude(
+                pk__in=[user.pk for user in users]
+            ).order_by('pk')[:options['users'] - len(users)])
+        sessions = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            sessions.append(client.session.session_key)
+        post_ids = list(Post.objects.order_by('-pk').values_list(
+            'pk', flat=True)[:sample])
+        return Plan(
+            options['mix'],
+            options['auth_ratio'],
+            sessions,
+            list(Group.objects.order_by('-posts_count').values_list(
+                'slug', flat=True)[:sample]),
+            list(User.objects.order_by('-stats__posts_count').values_list(
+                'username', flat=True)[:sample]),
+            post_ids,
+            options['seed'],
+        )
+
+    def serve(self):
+        from yatube.wsgi import application
+
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+        server.set_app(count_queries(application))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, f'http://127.0.0.1:{server.server_port}'
+
+    def run(self, plan, url, options):
+        args = (
+            plan, url, options['threads'], options['duration'],
+            options['requests'],
+        )
+        if not options['processes']:
+            return worker_run(*args, 0)
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(
+            options['processes'], mp_context=context,
+            initializer=django.setup,
+        ) as executor:
+            futures = [
+                executor.submit(worker_run, *args, worker)
+                for worker in range(options['processes'])
+            ]
+            total = Stats()
+            for future in futures:
+                total.merge(future.result())
+            return total
+
+    def report(self, stats, elapsed):
+        self.stdout.write(
+            f'{"адрес":<14}{"запросов":>9}{"в сек":>8}{"p50":>8}{"p95":>8}'
+            f'{"p99":>8}{"max":>8}{"SQL":>6}{"ошибок":>8}'
+        )
+        names = sorted(set(stats.latencies) | set(stats.errors))
+        for name in names:
+            latencies = sorted(stats.latencies.get(name, []))
+            counted = stats.counted[name]
+            queries = (
+                f'{stats.queries[name] / counted:.1f}' if counted else '—'
+            )
+            if latencies:
+                timings = ''.join(f'{value:>8.1f}' for value in (
+                    percentile(latencies, 0.5),
+                    percentile(latencies, 0.95),
+                    percentile(latencies, 0.99),
+                    latencies[-1],
+                ))
+            else:
+                timings = f'{"—":>8}' * 4
+            self.stdout.write(
+                f'{name:<14}{len(latencies):>9}'
+                f'{len(latencies) / elapsed:>8.1f}'
+                f'{timings}{queries:>6}'
+                f'{stats.errors[name]:>8}'
+            )
+        total = sum(map(len, stats.latencies.values()))
+        self.stdout.write(
+            f'Всего: {total} запросов за {elapsed:.1f} с, '
+            f'{total / elapsed:.1f} в секунду, '
+            f'SQL-запросов: {sum(stats.queries.values())}'
+        )
+        self.stdout.write('\nГистограмма задержек, мс:')
+        self.stdout.write(f'{"адрес":<14}' + ''.join(
+            f'{"≤" + str(bound):>7}' for bound in BUCKETS
+        ) + f'{">" + str(BUCKETS[-1]):>7}')
+        for name in names:
+            counts = histogram(stats.latencies.get(name, []))
+            self.stdout.write(
+                f'{name:<14}' + ''.join(f'{count:>7}' for count in counts)
+            )
+
+    def handle(self, *args, **options):
+        plan = self.plan(options)
+        if not plan.names:
+            raise CommandError('Нет данных ни для одного адреса из смеси.')
+        url, server = options['url'], None
+        if options['serve']:
+            server, url = self.serve()
+        self.stdout.write(
+            f'Цель: {url or "WSGI в процессе"}, '
+            f'потоков: {options["threads"]}, '
+            f'процессов: {options["processes"] or 1}'
+        )
+        started = time.monotonic()
+        try:
+            stats = self.run(plan, url, options)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        self.report(stats, time.monotonic() - started)
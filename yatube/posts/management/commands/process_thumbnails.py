@@ -0,0 +1,38 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.thumbnails import ThumbnailQueue, process
+
+
+class Command(BaseCommand):
+    help = 'Готовит миниатюры картинок постов из очереди на диске.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.THUMBNAIL_WORKERS,
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Разобрать очередь и завершиться.',
+        )
+
+    def handle(self, *args, **options):
+        queue = ThumbnailQueue()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                recovered = queue.recover()
+                if recovered:
+                    self.stdout.write(f'Возвращено в очередь: {recovered}')
+                names = queue.pending()
+                if names:
+                    done = sum(executor.map(
+                        lambda name: process(queue, name), names
+                    ))
+                    self.stdout.write(f'Обработано заданий: {done}')
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(settings.THUMBNAIL_QUEUE_POLL_INTERVAL)
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Follow, TimelineEntry, User
+from posts.timeline import cap, rebuild, release_all
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help='Пересобрать только ленты этих пользователей.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Сколько пользователей пересобирать в одной транзакции.',
+        )
+        parser.add_argument(
+            '--maintain', action='store_true',
+            help='Не пересобирать ленты, а только разложить посты бывших '
+                 'знаменитостей и обрезать ленты до TIMELINE_DEPTH записей. '
+                 'Для запуска из cron.',
+        )
+
+    def handle(self, *args, **options):
+        if options['maintain']:
+            released = release_all()
+            cap(TimelineEntry.objects.values('user_id'))
+            self.stdout.write(self.style.SUCCESS(
+                f'Ленты обрезаны, авторов возвращено в раскладку: {released}'
+            ))
+            return
+        if options['usernames']:
+            user_ids = User.objects.filter(
+                username__in=options['usernames']
+            ).values_list('id', flat=True)
+        else:
+            user_ids = Follow.objects.values_list('user_id', flat=True).union(
+                TimelineEntry.objects.values_list('user_id', flat=True)
+            )
+        user_ids = sorted(user_ids)
+        batch_size = options['batch_size']
+        for start in range(0, len(user_ids), batch_size):
+            rebuild(user_ids[start:start + batch_size])
+        released = release_all()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобрано лент: {len(user_ids)}, '
+            f'авторов возвращено в раскладку: {released}'
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import recount_groups, recount_posts, recount_users
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики постов, групп и авторов.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Постов: {recount_posts()}')
+        self.stdout.write(f'Групп: {recount_groups()}')
+        self.stdout.write(f'Пользователей: {recount_users()}')
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
@@ -0,0 +1,288 @@
+import multiprocessing
+import os
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from posts import seeding
+from posts.counters import recount_groups, recount_posts, recount_users
+from posts.models import Comment, Follow, Group, Post, User
+from posts.search.fts import install_fts, uninstall_fts
+
+
+class Command(BaseCommand):
+    help = (
+        'Наполняет базу синтетическими пользователями, группами, постами, '
+        'комментариями и подписками для нагрузочных замеров. При одинаковом '
+        '--seed данные одинаковые.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--groups', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument(
+            '--comments', type=int,
+            help='Число комментариев; по умолчанию равно числу постов.',
+        )
+        parser.add_argument(
+            '--follows-per-user', type=float, default=20,
+            help='Среднее число подписок; распределение с длинным хвостом.',
+        )
+        parser.add_argument(
+            '--alpha', type=float, default=1.1,
+            help='Показатель закона Ципфа для популярности авторов и постов.',
+        )
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--prefix', default='seed',
+            help='Префикс имён пользователей и адресов групп.',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Процессы, готовящие строки; 0 — всё в текущем процессе.',
+        )
+        parser.add_argument(
+            '--skip-timelines', action='store_true',
+            help='Не пересобирать ленты подписок (долго на больших '
+                 'объёмах); без них лента подписок будет пустой.',
+        )
+
+    def run(self, func, jobs):
+        """Отдаёт результаты `func(*job)` по порядку заданий."""
+        if self.executor is None:
+            for job in jobs:
+                yield job, func(*job)
+            return
+        window = deque()
+        for job in jobs:
+            window.append((job, self.executor.submit(func, *job)))
+            if len(window) >= self.workers * 2:
+                job, future = window.popleft()
+                yield job, future.result()
+        while window:
+            job, future = window.popleft()
+            yield job, future.result()
+
+    def chunks(self, total):
+        for batch, start in enumerate(range(0, total, self.batch_size)):
+            yield batch, min(self.batch_size, total - start)
+
+    def progress(self, label, done, total, started):
+        rate = done / max(time.monotonic() - started, 1e-6)
+        self.stdout.write(f'{label}: {done}/{total}, {rate:.0f} строк/с')
+
+    def last_ids(self, model, count):
+        """Первичные ключи последних `count` строк.
+
+        Пишет только этот процесс, поэтому это и есть только что
+        вставленные строки.
+        """
+        return sorted(model.objects.order_by('-pk').values_list(
+            'pk', flat=True)[:count])
+
+    def insert(self, model, objects):
+        with transaction.atomic():
+            model.objects.bulk_create(objects)
+            return self.last_ids(model, len(objects))
+
+    def insert_rows(self, model, fields, rows):
+        """Вставляет кортежи значений в обход `bulk_create`.
+
+        На миллионах строк сборка SQL для каждого объекта обходится
+        дороже самой записи.
+        """
+        ops = connection.ops
+        columns = [model._meta.get_field(name).column for name in fields]
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            ops.quote_name(model._meta.db_table),
+            ', '.join(map(ops.quote_name, columns)),
+            ', '.join(['%s'] * len(columns)),
+        )
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+    def seed_users(self, total, prefix, seed):
+        first_names, last_names = seeding.names(seed)
+        user_ids = []
+        started = time.monotonic()
+        for batch, size in self.chunks(total):
+            start = batch * self.batch_size
+            user_ids += self.insert(User, [
+                User(
+                    username=f'{prefix}{index}',
+                    first_name=first_names[index % len(first_names)],
+                    last_name=last_names[index * 7 % len(last_names)],
+                    password='!',
+                )
+                for index in range(start, start + size)
+            ])
+            self.progress('Пользователи', len(user_ids), total, started)
+        return user_ids
+
+    def seed_groups(self, total, prefix):
+        return self.insert(Group, [
+            Group(
+                title=f'Группа {index}',
+                slug=f'{prefix}-{index}',
+                description=f'Сгенерированная группа {index}',
+            )
+            for index in range(total)
+        ]) if total else []
+
+    def seed_posts(self, total, user_ids, group_ids, until, seconds):
+        post_ids, ages = array('I'), array('d')
+        started = time.monotonic()
+        jobs = (
+            (batch, size, len(group_ids), seconds)
+            for batch, size in self.chunks(total)
+        )
+        adapt = connection.ops.adapt_datetimefield_value
+        fields = (
+            'author', 'group', 'text', 'pub_date', 'updated', 'image',
+            'comments_count',
+        )
+        for _, rows in self.run(seeding.post_rows, jobs):
+            values = []
+            for author, group, text, age in rows:
+                pub_date = adapt(seeding.moment(until, age))
+                values.append((
+                    user_ids[author],
+                    None if group is None else group_ids[group],
+                    text, pub_date, pub_date, '', 0,
+                ))
+                ages.append(age)
+            with transaction.atomic():
+                self.insert_rows(Post, fields, values)
+                post_ids.extend(self.last_ids(Post, len(values)))
+            self.progress('Посты', len(post_ids), total, started)
+        return post_ids, ages
+
+    def seed_comments(self, total, user_ids, post_ids, ages, until):
+        done = 0
+        started = time.monotonic()
+        jobs = self.chunks(total)
+        adapt = connection.ops.adapt_datetimefield_value
+        fields = ('post', 'author', 'text', 'created', 'path')
+        for _, rows in self.run(seeding.comment_rows, jobs):
+            self.insert_rows(Comment, fields, [
+                (
+                    post_ids[post],
+                    user_ids[author],
+                    text,
+                    adapt(seeding.moment(until, ages[post] * (1 - share))),
+                    '',
+                )
+                for post, author, text, share in rows
+            ])
+            done += len(rows)
+            self.progress('Комментарии', done, total, started)
+        Comment.objects.fill_paths()
+
+    def seed_follows(self, user_ids, mean):
+        done = 0
+        started = time.monotonic()
+        jobs = (
+            (batch, range(batch * self.batch_size,
+                          batch * self.batch_size + size), mean)
+            for batch, size in self.chunks(len(user_ids))
+        )
+        for _, rows in self.run(seeding.follow_rows, jobs):
+            self.insert_rows(Follow, ('user', 'author'), [
+                (user_ids[user], user_ids[author]) for user, author in rows
+            ])
+            done += len(rows)
+            self.progress('Подписки', done, '?', started)
+
+    def rebuild_timelines(self):
+        # Ленты ограничены TIMELINE_DEPTH постами на пользователя, так что
+        # объём пересборки известен заранее.
+        users = Follow.objects.values('user_id').distinct().count()
+        self.stdout.write(
+            f'Ленты подписок: {users} пользователей, до '
+            f'{users * settings.TIMELINE_DEPTH} записей…'
+        )
+        started = time.monotonic()
+        call_command('rebuild_timelines', stdout=self.stdout)
+        self.stdout.write(
+            f'Ленты пересобраны за {time.monotonic() - started:.0f} с')
+
+    def executor_for(self, options):
+        if not self.workers:
+            return nullcontext()
+        # Процессам нужны только функции из `posts.seeding`, а не копия
+        # открытого соединения с БД.
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=seeding.init,
+            initargs=(options['seed'], options['users'], options['posts'],
+                      options['alpha']),
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('Нужно хотя бы два пользователя.')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Пользователи с префиксом «{prefix}» уже есть, '
+                f'укажите другой --prefix.'
+            )
+        self.batch_size = options['batch_size']
+        self.workers = options['workers']
+        seeding.init(options['seed'], options['users'], options['posts'],
+                     options['alpha'])
+        until = timezone.now()
+        seconds = options['days'] * 86400
+        comments = options['comments']
+        if comments is None:
+            comments = options['posts']
+        if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+            # Данные можно сгенерировать заново, надёжность записи не нужна.
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA synchronous = OFF')
+        # Триггеры полнотекстового индекса замедляют вставку в разы:
+        # индекс пересобирается целиком в конце, даже после ошибки.
+        uninstall_fts()
+        started = time.monotonic()
+        try:
+            with self.executor_for(options) as self.executor:
+                user_ids = self.seed_users(
+                    options['users'], prefix, options['seed'])
+                group_ids = self.seed_groups(options['groups'], prefix)
+                post_ids, ages = self.seed_posts(
+                    options['posts'], user_ids, group_ids, until, seconds)
+                if post_ids:
+                    self.seed_comments(
+                        comments, user_ids, post_ids, ages, until)
+                self.seed_follows(user_ids, options['follows_per_user'])
+        finally:
+            self.stdout.write('Полнотекстовый индекс…')
+            install_fts()
+        self.stdout.write('Счётчики…')
+        recount_posts()
+        recount_groups()
+        recount_users()
+        if options['skip_timelines']:
+            self.stdout.write(self.style.WARNING(
+                'Ленты подписок не пересобраны: запустите '
+                'rebuild_timelines, иначе они останутся пустыми.'
+            ))
+        else:
+            self.rebuild_timelines()
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.0f} с'
+        ))
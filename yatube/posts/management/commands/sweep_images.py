@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts.thumbnails import sweep_images
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки постов, на которые больше не ссылается ни один '
+        'пост. Запускается периодически, например из cron.'
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Удалено картинок: {sweep_images()}')
@@ -0,0 +1,101 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts.models import Post
+from posts.thumbnails import warm_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Заранее готовит миниатюры всех картинок постов. Можно прервать и '
+        'продолжить с сохранённой позиции.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов; 0 — работать в текущем процессе.',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(
+                settings.THUMBNAIL_QUEUE_DIR, 'warm_thumbnails.checkpoint'
+            ),
+        )
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Начать с первого поста, забыв сохранённую позицию.',
+        )
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as checkpoint:
+                return int(checkpoint.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, path, last_pk):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.tmp', 'w') as checkpoint:
+            checkpoint.write(str(last_pk))
+        os.replace(f'{path}.tmp', path)
+
+    def batches(self, last_pk, batch_size):
+        posts = Post.objects.exclude(image='').order_by('pk')
+        while True:
+            ids = list(posts.filter(pk__gt=last_pk).values_list(
+                'pk', flat=True)[:batch_size])
+            if not ids:
+                return
+            last_pk = ids[-1]
+            yield ids
+
+    def run(self, batches, workers):
+        """Отдаёт результаты пачек по порядку, держа в работе не больше
+        двух пачек на процесс."""
+        if not workers:
+            for ids in batches:
+                yield ids, warm_batch(ids)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            window = deque()
+            for ids in batches:
+                # Процессы создаются при первой отправке задачи и не должны
+                # унаследовать открытое соединение с БД.
+                connections.close_all()
+                window.append((ids, executor.submit(warm_batch, ids)))
+                if len(window) >= workers * 2:
+                    ids, future = window.popleft()
+                    yield ids, future.result()
+            while window:
+                ids, future = window.popleft()
+                yield ids, future.result()
+
+    def handle(self, *args, **options):
+        path = options['checkpoint']
+        last_pk = 0 if options['reset'] else self.read_checkpoint(path)
+        if last_pk:
+            self.stdout.write(f'Продолжаем после поста {last_pk}')
+        started = time.monotonic()
+        generated = skipped = 0
+        batches = self.batches(last_pk, options['batch_size'])
+        for ids, (done, cached) in self.run(batches, options['workers']):
+            generated += done
+            skipped += cached
+            self.write_checkpoint(path, ids[-1])
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'До поста {ids[-1]}: готово {generated}, '
+                f'пропущено {skipped}, '
+                f'{(generated + skipped) / elapsed:.1f} картинок/с'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {generated}, уже были в кэше: {skipped}'
+        ))
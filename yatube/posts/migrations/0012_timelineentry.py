@@ -0,0 +1,93 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:51
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+import datetime
+import django.db.models.deletion
+
+
+def fill_timelines(apps, schema_editor):
+    # Ленты подписок читаются из TimelineEntry: одним INSERT … SELECT
+    # раскладываем каждому подписчику не больше TIMELINE_DEPTH новейших
+    # постов авторов, на которых подписка уже оформлена. Более старые
+    # посты лента читает из постов напрямую.
+    connection = schema_editor.connection
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    depth = settings.TIMELINE_DEPTH
+    # Посты автора старше его depth-го поста в ленту не попадут.
+    oldest = Post.objects.using(connection.alias).filter(
+        author_id=models.OuterRef('author_id')
+    ).order_by('-pub_date', '-id').values('pub_date')[depth - 1:depth]
+    rows = Follow.objects.using(connection.alias).filter(
+        author__posts__pub_date__gte=Coalesce(
+            models.Subquery(oldest),
+            models.Value(
+                datetime.datetime.min.replace(tzinfo=timezone.utc),
+                output_field=models.DateTimeField(),
+            ),
+        ),
+    ).annotate(
+        entry_post=models.F('author__posts__id'),
+        entry_date=models.F('author__posts__pub_date'),
+        place=models.Window(
+            RowNumber(),
+            partition_by=[models.F('user_id')],
+            order_by=[models.F('entry_date').desc(),
+                      models.F('entry_post').desc()],
+        ),
+    ).values('user_id', 'entry_post', 'entry_date', 'place')
+    sql, params = rows.query.sql_with_params()
+    ops = connection.ops
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '{} {} (user_id, post_id, pub_date) SELECT user_id, entry_post, '
+            'entry_date FROM ({}) AS ranked WHERE place <= %s {}'.format(
+                ops.insert_statement(ignore_conflicts=True),
+                ops.quote_name(TimelineEntry._meta.db_table),
+                sql,
+                ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+            ),
+            (*params, depth),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0011_comment_created'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, help_text='Загрузите картинку', upload_to='posts/', verbose_name='Картинка'),
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации поста')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='posts.Post', verbose_name='пост')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='владелец ленты')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи ленты',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='timeline_user_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
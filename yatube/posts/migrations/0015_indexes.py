@@ -0,0 +1,66 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:59
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_follows(apps, schema_editor):
+    # Ограничение раньше не применялось, поэтому дубли могли накопиться.
+    db = schema_editor.connection.alias
+    Follow = apps.get_model('posts', 'Follow')
+    keep = Follow.objects.using(db).values('user', 'author').annotate(
+        first_id=Min('id')
+    ).values('first_id')
+    if not Follow.objects.using(db).exclude(id__in=keep).delete()[0]:
+        return
+    UserStats = apps.get_model('posts', 'UserStats')
+
+    def count(field):
+        return Coalesce(Subquery(
+            Follow.objects.using(db).filter(**{field: OuterRef('pk')}).order_by(
+            ).values(field).annotate(total=Count('pk')).values('total')
+        ), 0)
+
+    UserStats.objects.using(db).update(
+        followers_count=count('author'),
+        following_count=count('user'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userstats',
+            name='followers_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, verbose_name='Число подписчиков'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created'], name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-pub_date', '-id'], name='post_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='post_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-pub_date', '-id'], name='post_group_pub_date_idx'),
+        ),
+        migrations.RunPython(
+            remove_duplicate_follows, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_follow'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from posts.search.fts import install_fts, uninstall_fts
+
+
+def install(apps, schema_editor):
+    install_fts(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    uninstall_fts(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-17 07:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pulled(apps, schema_editor):
+    # Посты нынешних знаменитостей не раскладывались по лентам.
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.using(schema_editor.connection.alias).filter(
+        followers_count__gte=settings.FEED_CELEBRITY_THRESHOLD
+    ).update(timeline_pulled=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_comment_threads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='timeline_pulled',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='Посты не разложены по лентам'),
+        ),
+        migrations.RunPython(mark_pulled, migrations.RunPython.noop),
+    ]
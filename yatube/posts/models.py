@@ -1,10 +1,34 @@
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from django.db import models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+from .storage import ContentAddressedStorage
 
 User = get_user_model()
 
 
-class Group(models.Model):
+class CounterFieldsMixin:
+    """Не перезаписывает денормализованные счётчики при обычном `save()`.
+
+    Счётчики меняются только атомарными `F()`-обновлениями, поэтому
+    сохранение объекта, загруженного раньше, не должно их затирать.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Group(CounterFieldsMixin, models.Model):
     title = models.CharField(
         max_length=200,
         verbose_name='Заголовок'
@@ -16,12 +40,51 @@ class Group(models.Model):
     description = models.TextField(
         verbose_name='Описание'
     )
+    posts_count = models.PositiveIntegerField(
+        'Число постов',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('posts_count',)
 
     def __str__(self):
         return self.title
 
 
-class Post(models.Model):
+# Колонки, которые нужны карточке поста и ключу её кэша.
+FEED_FIELDS = (
+    'id', 'text', 'pub_date', 'updated', 'image', 'comments_count',
+    'author__id', 'author__username', 'author__first_name',
+    'author__last_name', 'group__id', 'group__slug', 'group__title',
+)
+
+
+def feed_fields(prefix=''):
+    """`FEED_FIELDS` для выборок, где пост — связанный объект."""
+    return tuple(prefix + field for field in FEED_FIELDS)
+
+
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты для лент: автор и группа в одном запросе, только колонки
+        карточки и все варианты картинок одним дополнительным запросом.
+
+        Число комментариев уже хранится в `comments_count`, поэтому
+        аннотации не нужны.
+        """
+        return self.select_related('author', 'group').only(
+            *FEED_FIELDS
+        ).prefetch_related('image_variants')
+
+    def for_detail(self):
+        """Пост для отдельной страницы вместе со счётчиками автора."""
+        return self.select_related(
+            'author__stats', 'group'
+        ).prefetch_related('image_variants')
+
+
+class Post(CounterFieldsMixin, models.Model):
     text = models.TextField(
         verbose_name='Текст поста',
         help_text='Введите текст поста',
@@ -30,6 +93,10 @@ class Post(models.Model):
         'Дата публикации',
         auto_now_add=True
     )
+    updated = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True
+    )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -48,21 +115,163 @@ class Post(models.Model):
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True,
+        db_index=True,
         help_text='Загрузите картинку',
     )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('comments_count',)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name_plural = 'Посты'
         verbose_name = 'Пост'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='post_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
 
+class PostImageVariant(models.Model):
+    """Уменьшенная копия картинки поста для `srcset`."""
+
+    FORMATS = (('webp', 'WebP'), ('jpeg', 'JPEG'))
+
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='image_variants',
+        verbose_name='Пост'
+    )
+    image = models.CharField('Файл', max_length=255)
+    format = models.CharField('Формат', max_length=10, choices=FORMATS)
+    width = models.PositiveIntegerField('Ширина')
+    height = models.PositiveIntegerField('Высота')
+    size = models.PositiveIntegerField('Размер, байт')
+
+    class Meta:
+        ordering = ['format', 'width']
+        verbose_name = 'Вариант картинки'
+        verbose_name_plural = 'Варианты картинок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['post', 'format', 'width'],
+                name='unique_post_image_variant',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.image} {self.width}w'
+
+    @property
+    def url(self):
+        return default_storage.url(self.image)
+
+
+class UserStats(models.Model):
+    """Денормализованные счётчики пользователя."""
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='пользователь'
+    )
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0, db_index=True
+    )
+    following_count = models.PositiveIntegerField(
+        'Число подписок', default=0
+    )
+    timeline_pulled = models.BooleanField(
+        'Посты не разложены по лентам', default=False, db_index=True
+    )
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+
+# Ширина сегмента материализованного пути комментария: первичный ключ,
+# дополненный нулями, чтобы пути сортировались как строки.
+COMMENT_PATH_STEP = 10
+
+
+def comment_path_segment(pk):
+    return str(pk).zfill(COMMENT_PATH_STEP)
+
+
+def root_comment_path():
+    """Выражение пути для комментариев верхнего уровня."""
+    return LPad(
+        Cast('id', models.CharField()), COMMENT_PATH_STEP, Value('0')
+    )
+
+
+class CommentQuerySet(models.QuerySet):
+    def roots(self):
+        return self.filter(parent__isnull=True)
+
+    def subtrees(self, roots):
+        """Ответы на комментарии `roots` в порядке обхода дерева.
+
+        Каждое поддерево — диапазон по индексу `path`.
+        """
+        condition = models.Q()
+        for root in roots:
+            condition |= models.Q(
+                path__gt=root.path, path__lt=root.path + ':'
+            )
+        if not condition:
+            return self.none()
+        return self.filter(condition).order_by('path')
+
+    def fill_paths(self):
+        """Проставляет путь комментариям, вставленным без `save()`.
+
+        Родитель должен уже иметь путь: ответы заполняются после корней.
+        """
+        pending = self.filter(path='')
+        updated = pending.filter(parent__isnull=True).update(
+            path=root_comment_path()
+        )
+        parent_path = Comment.objects.filter(
+            pk=OuterRef('parent_id')
+        ).values('path')[:1]
+        return updated + pending.filter(parent__isnull=False).update(
+            path=Concat(Subquery(parent_path), root_comment_path())
+        )
+
+
 class Comment(models.Model):
-    """Модель комментариев."""
+    """Модель комментариев.
+
+    `path` — пути от корня ветки: ключи предков и самого комментария
+    по `COMMENT_PATH_STEP` символов, поэтому всё поддерево выбирается
+    одним диапазонным запросом.
+    """
 
     post = models.ForeignKey(
         Post,
@@ -76,6 +285,21 @@ class Comment(models.Model):
         related_name='comments',
         verbose_name='автор комментария'
     )
+    parent = models.ForeignKey(
+        'self',
+        blank=True,
+        null=True,
+        on_delete=models.CASCADE,
+        related_name='replies',
+        verbose_name='ответ на комментарий'
+    )
+    path = models.CharField(
+        'путь в ветке',
+        max_length=255,
+        default='',
+        editable=False,
+        db_index=True,
+    )
     text = models.TextField(
         'текст комментария',
         help_text='Введите комментарий'
@@ -85,6 +309,30 @@ class Comment(models.Model):
         verbose_name='Создан'
     )
 
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['post', 'created'], name='comment_post_created_idx'
+            ),
+            models.Index(
+                fields=['post', 'parent', '-created', '-id'],
+                name='comment_post_roots_idx',
+            ),
+        ]
+
+    @property
+    def depth(self):
+        return max(len(self.path) // COMMENT_PATH_STEP - 1, 0)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if not self.path:
+            prefix = self.parent.path if self.parent_id else ''
+            self.path = prefix + comment_path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
 
 class Follow(models.Model):
     """Модель подписки на авторов."""
@@ -103,6 +351,43 @@ class Follow(models.Model):
     )
 
     class Meta:
-        models.UniqueConstraint(
-            fields=['user', 'author'], name='unique_follow'
-        )
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'], name='unique_follow'
+            ),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Запись материализованной ленты подписок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='владелец ленты'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='пост'
+    )
+    pub_date = models.DateTimeField(
+        'Дата публикации поста'
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='unique_timeline_entry'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_pub_date_idx',
+            ),
+        ]
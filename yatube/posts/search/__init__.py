@@ -0,0 +1,24 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+BACKENDS = {
+    'fts': 'posts.search.fts.FtsSearchBackend',
+    'inverted': 'posts.search.inverted.InvertedIndexBackend',
+}
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    """Поисковый бэкенд из `POSTS_SEARCH_BACKEND`.
+
+    Настройка принимает псевдоним из `BACKENDS` или путь к классу. Без
+    неё используется FTS5, а если SQLite собран без него — собственный
+    инвертированный индекс.
+    """
+    name = settings.POSTS_SEARCH_BACKEND
+    if name is None:
+        from .fts import fts_available
+        name = 'fts' if fts_available() else 'inverted'
+    return import_string(BACKENDS.get(name, name))()
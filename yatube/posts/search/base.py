@@ -0,0 +1,27 @@
+class BaseSearchBackend:
+    """Интерфейс поискового бэкенда постов.
+
+    `results()` возвращает последовательность для `Paginator`: она
+    умеет `count()` и срезы, а посты в срезе несут атрибут
+    `highlighted` с размеченным фрагментом текста. Методы `post_*` и
+    `comment_*` вызываются сигналами; бэкенды, которые синхронизируются
+    сами (например, триггерами БД), их не переопределяют.
+    """
+
+    def results(self, query):
+        raise NotImplementedError
+
+    def filter_queryset(self, queryset, query):
+        raise NotImplementedError
+
+    def post_saved(self, post, old_text=None):
+        pass
+
+    def post_deleted(self, post):
+        pass
+
+    def comment_saved(self, comment):
+        pass
+
+    def comment_deleted(self, comment):
+        pass
@@ -0,0 +1,177 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from posts.models import Post
+
+from .base import BaseSearchBackend
+
+FTS_TABLE = 'posts_post_fts'
+# Служебные символы, которыми SQLite отмечает совпадения в сниппете;
+# в тексте постов они не встречаются и заменяются на <mark> после
+# экранирования HTML.
+MARK_START, MARK_END = '\x02', '\x03'
+SNIPPET_TOKENS = 32
+
+FTS_TABLE_SQL = f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    text,
+    content='posts_post',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)"""
+FTS_TRIGGERS = {
+    f'{FTS_TABLE}_ai': f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai
+        AFTER INSERT ON posts_post BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+        END""",
+    f'{FTS_TABLE}_ad': f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad
+        AFTER DELETE ON posts_post BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+            VALUES ('delete', old.id, old.text);
+        END""",
+    f'{FTS_TABLE}_au': f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+        AFTER UPDATE OF text ON posts_post BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+            VALUES ('delete', old.id, old.text);
+            INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+        END""",
+}
+
+
+def fts_available(using=connection):
+    if using.vendor != 'sqlite':
+        return False
+    with using.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        options = {row[0] for row in cursor.fetchall()}
+    return 'ENABLE_FTS5' in options
+
+
+def install_fts(using=connection):
+    """Создаёт FTS5-индекс и триггеры, если их нет.
+
+    SQLite пересоздаёт таблицу при `ALTER` в миграциях и теряет её
+    триггеры, поэтому функция вызывается и после каждой миграции;
+    если триггеров не было, индекс перестраивается целиком.
+    """
+    if not fts_available(using):
+        return False
+    with using.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')"
+            " AND name LIKE %s",
+            [f'{FTS_TABLE}%'],
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        cursor.execute(FTS_TABLE_SQL)
+        missing = set(FTS_TRIGGERS) - existing
+        for name in missing:
+            cursor.execute(FTS_TRIGGERS[name])
+        if missing:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+            )
+    return True
+
+
+def uninstall_fts(using=connection):
+    with using.cursor() as cursor:
+        for name in FTS_TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def match_expression(query):
+    """Превращает пользовательский ввод в безопасный запрос FTS5.
+
+    Каждое слово ищется по префиксу, все слова должны встретиться.
+    """
+    words = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def highlight(snippet):
+    return mark_safe(
+        escape(snippet)
+        .replace(MARK_START, '<mark>')
+        .replace(MARK_END, '</mark>')
+    )
+
+
+def filter_posts(queryset, query):
+    """Ограничивает queryset постами, подходящими под запрос."""
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (expression,),
+    ))
+
+
+class FtsSearchResults:
+    """Результаты поиска, отсортированные по bm25, для `Paginator`.
+
+    Срез выполняет один запрос к FTS-индексу с LIMIT/OFFSET и
+    подгружает посты с авторами и группами.
+    """
+
+    def __init__(self, query):
+        self.expression = match_expression(query)
+
+    def count(self):
+        if not self.expression:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT count(*) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s',
+                [self.expression],
+            )
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def statement(self, start, stop):
+        """SQL и параметры выборки найденных постов со сниппетами."""
+        return (
+            f"SELECT rowid, snippet({FTS_TABLE}, 0, %s, %s, '…', %s) "
+            f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}) LIMIT %s OFFSET %s',
+            [MARK_START, MARK_END, SNIPPET_TOKENS, self.expression,
+             stop - start, start],
+        )
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        if not self.expression or index.stop <= start:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(*self.statement(start, index.stop))
+            rows = cursor.fetchall()
+        posts = Post.objects.for_feed().in_bulk(
+            [post_id for post_id, _ in rows]
+        )
+        results = []
+        for post_id, snippet in rows:
+            post = posts.get(post_id)
+            if post is not None:
+                post.highlighted = highlight(snippet)
+                results.append(post)
+        return results
+
+
+class FtsSearchBackend(BaseSearchBackend):
+    """Поиск по FTS5-индексу SQLite, который ведут триггеры."""
+
+    def results(self, query):
+        return FtsSearchResults(query)
+
+    def filter_queryset(self, queryset, query):
+        return filter_posts(queryset, query)
@@ -0,0 +1,379 @@
+import fcntl
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from posts.models import Comment, Post
+
+from .base import BaseSearchBackend
+from .stemmer import stem, tokenize
+
+MAGIC = b'YIDX'
+VERSION = 1
+# magic, версия, число термов.
+HEADER = struct.Struct('<4sII')
+# Смещение и длина терма, смещение и длина списка документов.
+ENTRY = struct.Struct('<IIQI')
+OR_WORDS = {'or', 'или'}
+SNIPPET_WORDS = 40
+
+
+def _postings(doc_ids):
+    return array('I', sorted(doc_ids))
+
+
+class InvertedIndex:
+    """Инвертированный индекс с хранением в memory-mapped файле.
+
+    Файл содержит отсортированный словарь термов фиксированной ширины
+    и списки идентификаторов документов (`uint32`). При открытии
+    читается только заголовок, терм ищется бинарным поиском прямо в
+    отображённой памяти.
+
+    Изменения после сборки дописываются в журнал `<path>.log`, общий для
+    всех процессов; каждый процесс догоняет журнал в `refresh()` и
+    держит его в памяти поверх файла. Когда журнал вырастает больше
+    `SEARCH_INDEX_LOG_MAX_SIZE`, он сливается в новый файл индекса.
+    Запись в журнал и слияние идут под исключительной блокировкой
+    `<path>.lock`, чтение — под разделяемой.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.log_path = f'{path}.log'
+        self._lock = threading.RLock()
+        self._file = None
+        self._mm = None
+        self._mtime = None
+        self._terms = 0
+        self._log_offset = 0
+        self.added = defaultdict(set)
+        self.removed = defaultdict(set)
+        self.deleted = set()
+        self.refresh()
+
+    def _file_lock(self, operation):
+        lock_file = open(f'{self.path}.lock', 'a')
+        fcntl.flock(lock_file, operation)
+        return lock_file
+
+    def refresh(self):
+        """Переоткрывает пересобранный файл и догоняет журнал."""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return
+            with self._file_lock(fcntl.LOCK_SH):
+                self._reload()
+
+    def _reload(self):
+        stat = os.stat(self.path)
+        # Новый файл индекса приходит через `os.replace` с новым inode.
+        mtime = (stat.st_ino, stat.st_mtime_ns)
+        if mtime != self._mtime:
+            self._open(mtime)
+        try:
+            with open(self.log_path, 'rb') as log:
+                log.seek(self._log_offset)
+                for line in log:
+                    self._apply(*json.loads(line))
+                self._log_offset = log.tell()
+        except FileNotFoundError:
+            pass
+
+    def _open(self, mtime):
+        self.close()
+        self._file = open(self.path, 'rb')
+        self._mm = mmap.mmap(
+            self._file.fileno(), 0, access=mmap.ACCESS_READ
+        )
+        magic, version, self._terms = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{self.path}: неизвестный формат индекса')
+        self._mtime = mtime
+        # Журнал, записанный до сборки файла, уже в нём.
+        self._log_offset = 0
+        self.added.clear()
+        self.removed.clear()
+        self.deleted.clear()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+        self._mm = self._file = self._mtime = None
+        self._terms = 0
+
+    def _entry(self, index):
+        return ENTRY.unpack_from(self._mm, HEADER.size + index * ENTRY.size)
+
+    def _term(self, index):
+        offset, length, _, _ = self._entry(index)
+        return self._mm[offset:offset + length]
+
+    def _base_postings(self, term):
+        if self._mm is None:
+            return array('I')
+        key = term.encode()
+        low, high = 0, self._terms
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self._terms or self._term(low) != key:
+            return array('I')
+        _, _, offset, count = self._entry(low)
+        postings = array('I')
+        postings.frombytes(self._mm[offset:offset + count * 4])
+        return postings
+
+    def postings(self, term):
+        with self._lock:
+            docs = set(self._base_postings(term))
+            docs |= self.added.get(term, set())
+            docs -= self.removed.get(term, set())
+            docs -= self.deleted
+        return docs
+
+    def _apply(self, operation, doc_id, terms=()):
+        if operation == 'delete':
+            self.deleted.add(doc_id)
+            return
+        if operation == 'add':
+            self.deleted.discard(doc_id)
+        for term in terms:
+            if operation == 'add':
+                self.added[term].add(doc_id)
+                self.removed[term].discard(doc_id)
+            else:
+                self.removed[term].add(doc_id)
+                self.added[term].discard(doc_id)
+
+    def _log(self, *record):
+        """Дописывает изменение в журнал и применяет его у себя."""
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            if os.path.exists(self.path):
+                self._reload()
+            else:
+                # Индекс ещё не собран: пишем пустой, чтобы журналу было
+                # к чему применяться.
+                self.write(self.path, ())
+                self._reload()
+            with open(self.log_path, 'a') as log:
+                log.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._reload()
+            if self._log_offset > settings.SEARCH_INDEX_LOG_MAX_SIZE:
+                self._compact()
+
+    def add(self, doc_id, terms):
+        self._log('add', doc_id, sorted(terms))
+
+    def remove(self, doc_id, terms):
+        self._log('remove', doc_id, sorted(terms))
+
+    def delete(self, doc_id):
+        self._log('delete', doc_id)
+
+    def search(self, query):
+        """Документы по запросу, новые первыми.
+
+        Слова внутри группы объединяются по AND, группы, разделённые
+        словом OR (или ИЛИ), — по OR.
+        """
+        groups, current = [], []
+        for word in re.findall(r'\w+', query.lower()):
+            if word in OR_WORDS:
+                groups.append(current)
+                current = []
+            else:
+                current.append(stem(word))
+        groups.append(current)
+        found = set()
+        for terms in filter(None, groups):
+            postings = sorted(
+                (self.postings(term) for term in set(terms)), key=len
+            )
+            found |= set.intersection(*postings)
+        return sorted(found, reverse=True)
+
+    def terms(self):
+        """Все термы с итоговыми списками документов."""
+        with self._lock:
+            names = {
+                self._term(index).decode() for index in range(self._terms)
+            }
+            names.update(self.added)
+            for term in sorted(names):
+                docs = self.postings(term)
+                if docs:
+                    yield term, docs
+
+    @classmethod
+    def write(cls, path, terms):
+        """Атомарно записывает файл индекса из пар `(терм, документы)`."""
+        entries = sorted(
+            ((term.encode(), _postings(docs)) for term, docs in terms),
+            key=lambda item: item[0],
+        )
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+            term_offset = HEADER.size + ENTRY.size * len(entries)
+            postings_offset = term_offset + sum(
+                len(term) for term, _ in entries
+            )
+            for term, postings in entries:
+                out.write(ENTRY.pack(
+                    term_offset, len(term), postings_offset, len(postings)
+                ))
+                term_offset += len(term)
+                postings_offset += postings.itemsize * len(postings)
+            for term, _ in entries:
+                out.write(term)
+            for _, postings in entries:
+                out.write(postings.tobytes())
+        os.replace(tmp_path, path)
+
+    def _compact(self):
+        # Вызывается под исключительной блокировкой.
+        self.write(self.path, list(self.terms()))
+        reset_log(self.path)
+        self._reload()
+
+    def save(self):
+        """Сливает журнал в файл индекса."""
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            if os.path.exists(self.path):
+                self._reload()
+            self._compact()
+
+
+def reset_log(path):
+    """Очищает журнал после записи нового файла индекса.
+
+    Файл пишется раньше, поэтому процесс, увидевший новый файл,
+    перечитает журнал с начала и не применит изменения дважды.
+    """
+    try:
+        os.remove(f'{path}.log')
+    except FileNotFoundError:
+        pass
+
+
+def _document_terms(post_id):
+    """Термы поста вместе со всеми комментариями к нему."""
+    texts = list(Comment.objects.filter(
+        post_id=post_id).values_list('text', flat=True))
+    texts.extend(Post.objects.filter(
+        pk=post_id).values_list('text', flat=True))
+    return set(tokenize(' '.join(texts)))
+
+
+def build_index(path, batch_size=2000):
+    """Собирает файл индекса по всем постам и комментариям."""
+    terms = defaultdict(set)
+    documents = Post.objects.values_list('id', 'text').order_by('id')
+    comments = Comment.objects.values_list('post_id', 'text').order_by('id')
+    for queryset in (documents, comments):
+        for doc_id, text in queryset.iterator(chunk_size=batch_size):
+            for term in set(tokenize(text)):
+                terms[term].add(doc_id)
+    lock_file = open(f'{path}.lock', 'a')
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        InvertedIndex.write(path, terms.items())
+        reset_log(path)
+    return len(terms)
+
+
+def highlight_terms(text, terms):
+    """Экранирует текст и выделяет слова, основа которых есть в `terms`."""
+    parts = re.split(r'(\w+)', text)
+    words = parts[1::2]
+    first = next(
+        (index for index, word in enumerate(words) if stem(word) in terms), 0
+    )
+    start = max(first - SNIPPET_WORDS // 4, 0)
+    end = start + SNIPPET_WORDS
+    html = ['…'] if start else []
+    for index, part in enumerate(parts[start * 2:end * 2 + 1]):
+        if index % 2 and stem(part) in terms:
+            html.append(f'<mark>{escape(part)}</mark>')
+        else:
+            html.append(escape(part))
+    if end < len(words):
+        html.append('…')
+    return mark_safe(''.join(html))
+
+
+class InvertedSearchResults:
+    def __init__(self, index, query):
+        self.ids = index.search(query)
+        self.terms = set(tokenize(query))
+
+    def count(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        ids = self.ids[index]
+        posts = Post.objects.for_feed().in_bulk(ids)
+        results = []
+        for post_id in ids:
+            post = posts.get(post_id)
+            if post is not None:
+                post.highlighted = highlight_terms(post.text, self.terms)
+                results.append(post)
+        return results
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    """Поиск по собственному инвертированному индексу без FTS5.
+
+    Индекс собирается командой `build_search_index`, сигналы дописывают
+    изменения в общий журнал рядом с файлом индекса.
+    """
+
+    def __init__(self, path=None):
+        self.index = InvertedIndex(path or settings.SEARCH_INDEX_PATH)
+
+    def results(self, query):
+        self.index.refresh()
+        return InvertedSearchResults(self.index, query)
+
+    def filter_queryset(self, queryset, query):
+        self.index.refresh()
+        ids = self.index.search(query)[:settings.SEARCH_MAX_FILTER_IDS]
+        return queryset.filter(pk__in=ids)
+
+    def post_saved(self, post, old_text=None):
+        self.index.add(post.pk, set(tokenize(post.text)))
+        if old_text:
+            stale = set(tokenize(old_text)) - _document_terms(post.pk)
+            self.index.remove(post.pk, stale)
+
+    def post_deleted(self, post):
+        self.index.delete(post.pk)
+
+    def comment_saved(self, comment):
+        self.index.add(comment.post_id, set(tokenize(comment.text)))
+
+    def comment_deleted(self, comment):
+        stale = set(tokenize(comment.text)) - _document_terms(
+            comment.post_id)
+        self.index.remove(comment.post_id, stale)
@@ -0,0 +1,139 @@
+"""Стеммер русского языка по алгоритму Snowball (Портер).
+
+Латинские слова и числа возвращаются без изменений, только в нижнем
+регистре.
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = (
+    ('в', 'вши', 'вшись'),
+    ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'),
+)
+ADJECTIVE = (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем',
+    'им', 'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю',
+    'ая', 'яя', 'ою', 'ею',
+)
+PARTICIPLE = (
+    ('ем', 'нн', 'вш', 'ющ', 'щ'),
+    ('ивш', 'ывш', 'ующ'),
+)
+REFLEXIVE = ('ся', 'сь')
+VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет',
+     'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй',
+     'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют',
+     'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+)
+NOUN = (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и',
+    'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о',
+    'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я',
+)
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+CYRILLIC = re.compile('^[а-я]+$')
+
+
+def _strip(word, endings):
+    """Отрезает самое длинное из окончаний; None, если ни одно не подошло."""
+    for ending in sorted(endings, key=len, reverse=True):
+        if word.endswith(ending):
+            return word[:-len(ending)]
+    return None
+
+
+def _strip_groups(word, groups):
+    """Окончания первой группы должны идти после «а» или «я»."""
+    preceded, free = groups
+    candidates = [
+        (ending, True) for ending in preceded
+    ] + [(ending, False) for ending in free]
+    for ending, needs_vowel in sorted(
+        candidates, key=lambda item: len(item[0]), reverse=True
+    ):
+        if not word.endswith(ending):
+            continue
+        stem = word[:-len(ending)]
+        if needs_vowel and not stem.endswith(('а', 'я')):
+            continue
+        return stem
+    return None
+
+
+def _regions(word):
+    """Начала областей RV и R2."""
+    rv = len(word)
+    for index, char in enumerate(word):
+        if char in VOWELS:
+            rv = index + 1
+            break
+
+    def next_region(start):
+        for index in range(start + 1, len(word)):
+            if word[index] not in VOWELS and word[index - 1] in VOWELS:
+                return index + 1
+        return len(word)
+
+    r1 = next_region(0)
+    return rv, next_region(r1)
+
+
+def _step_one(rv):
+    """Деепричастие, иначе возвратность и прилагательное, глагол или
+    существительное."""
+    stripped = _strip_groups(rv, PERFECTIVE_GERUND)
+    if stripped is not None:
+        return stripped
+    rv = _strip(rv, REFLEXIVE) or rv
+    adjective = _strip(rv, ADJECTIVE)
+    if adjective is not None:
+        return _strip_groups(adjective, PARTICIPLE) or adjective
+    verb = _strip_groups(rv, VERB)
+    if verb is not None:
+        return verb
+    noun = _strip(rv, NOUN)
+    return rv if noun is None else noun
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC.match(word):
+        return word
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    rv = _step_one(rv)
+
+    # Шаг 2.
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательное окончание должно лежать в R2.
+    r2 = max(r2_start - rv_start, 0)
+    for ending in DERIVATIONAL:
+        if rv.endswith(ending) and len(rv) - len(ending) >= r2:
+            rv = rv[:-len(ending)]
+            break
+
+    # Шаг 4.
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        superlative = _strip(rv, SUPERLATIVE)
+        if superlative is not None:
+            rv = superlative
+            if rv.endswith('нн'):
+                rv = rv[:-1]
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def tokenize(text):
+    """Основы всех слов текста в порядке появления."""
+    return [stem(word) for word in re.findall(r'\w+', text.lower())]
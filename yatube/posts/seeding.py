@@ -0,0 +1,134 @@
+"""Генерация большого набора данных для нагрузочных замеров.
+
+Строки каждой пачки зависят только от общего `seed` и номера пачки,
+поэтому пачки можно готовить в нескольких процессах, а результат
+не зависит от их числа. Записывает в БД всегда один процесс: SQLite
+допускает только одного писателя.
+"""
+import bisect
+import itertools
+import random
+from datetime import timedelta
+
+from faker import Faker
+
+# Заполняется в `init`, чтобы не передавать веса с каждой пачкой.
+_state = {}
+
+
+def zipf_cum_weights(size, alpha):
+    """Накопленные веса закона Ципфа: первый элемент самый популярный."""
+    return list(itertools.accumulate(
+        1 / rank ** alpha for rank in range(1, size + 1)
+    ))
+
+
+def vocabulary(seed, size=3000):
+    fake = Faker('ru_RU')
+    fake.seed_instance(seed)
+    return sorted({word.lower() for word in fake.words(size)})
+
+
+def names(seed, size=300):
+    fake = Faker('ru_RU')
+    fake.seed_instance(seed)
+    return (
+        [fake.first_name() for _ in range(size)],
+        [fake.last_name() for _ in range(size)],
+    )
+
+
+def init(seed, users, posts, alpha):
+    """Готовит общее состояние; в процессах вызывается как initializer."""
+    order = list(range(users))
+    random.Random(f'{seed}:authors').shuffle(order)
+    _state.update(
+        seed=seed,
+        words=vocabulary(seed),
+        users=users,
+        posts=posts,
+        author_order=order,
+        user_weights=zipf_cum_weights(users, alpha),
+        post_weights=zipf_cum_weights(posts, alpha) if posts else None,
+    )
+
+
+def _rnd(kind, batch):
+    return random.Random(f'{_state["seed"]}:{kind}:{batch}')
+
+
+def _text(rnd, sentences):
+    words = _state['words']
+    result = []
+    for _ in range(rnd.randint(*sentences)):
+        sentence = rnd.choices(words, k=rnd.randint(4, 14))
+        result.append(' '.join(sentence).capitalize() + '.')
+    return ' '.join(result)
+
+
+def _pick(rnd, cum_weights, order):
+    """Индекс по закону Ципфа; `order` перемешивает, кто популярен."""
+    point = rnd.random() * cum_weights[-1]
+    return order[bisect.bisect(cum_weights, point)]
+
+
+def post_rows(batch, size, groups, seconds):
+    """Строки постов: (индекс автора, индекс группы или None, текст,
+    секунд до конца периода)."""
+    rnd = _rnd('posts', batch)
+    order = _state['author_order']
+    rows = []
+    for _ in range(size):
+        group = None
+        if groups and rnd.random() < 0.7:
+            group = rnd.randrange(groups)
+        rows.append((
+            _pick(rnd, _state['user_weights'], order),
+            group,
+            _text(rnd, (1, 6)),
+            rnd.uniform(0, seconds),
+        ))
+    return rows
+
+
+def comment_rows(batch, size):
+    """Строки комментариев: (индекс поста, индекс автора, текст, доля
+    времени между публикацией поста и концом периода).
+
+    Посты с меньшим индексом комментируют чаще.
+    """
+    rnd = _rnd('comments', batch)
+    users = _state['users']
+    return [
+        (
+            _pick(rnd, _state['post_weights'], range(_state['posts'])),
+            rnd.randrange(users),
+            _text(rnd, (1, 2)),
+            rnd.random(),
+        )
+        for _ in range(size)
+    ]
+
+
+def follow_rows(batch, followers, mean):
+    """Подписки пользователей `followers`: сколько у кого подписок, задаёт
+    распределение Парето, на кого — закон Ципфа."""
+    rnd = _rnd('follows', batch)
+    users = _state['users']
+    order = _state['author_order']
+    rows = []
+    for follower in followers:
+        count = min(users - 1, int(mean * (rnd.paretovariate(2) - 1)) + 1)
+        authors = set()
+        for _ in range(count * 3):
+            author = _pick(rnd, _state['user_weights'], order)
+            if author != follower:
+                authors.add(author)
+            if len(authors) == count:
+                break
+        rows.extend((follower, author) for author in sorted(authors))
+    return rows
+
+
+def moment(until, seconds_before):
+    return until - timedelta(seconds=seconds_before)
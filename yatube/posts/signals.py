@@ -0,0 +1,110 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counters, thumbnails, timeline
+from .cache import ALL_FEEDS, bump_feeds, bump_version, feed_scopes
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .search import get_backend
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_values(sender, instance, **kwargs):
+    if instance.pk is not None:
+        old = Post.objects.filter(pk=instance.pk).values(
+            'group_id', 'text', 'image').first() or {}
+        instance._old_group_id = old.get('group_id')
+        instance._old_text = old.get('text')
+        instance._old_image = old.get('image')
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    scopes = feed_scopes(instance)
+    old_image = getattr(instance, '_old_image', None)
+    if instance.image and instance.image.name != old_image:
+        thumbnails.enqueue(instance)
+    if old_image and old_image != instance.image.name:
+        transaction.on_commit(lambda: thumbnails.release_image(old_image))
+    if created:
+        timeline.fan_out(instance)
+        counters.change_group(instance.group_id, 1)
+        counters.change_user(instance.author_id, posts_count=1)
+    else:
+        bump_version('post', instance.pk)
+        old_group_id = getattr(instance, '_old_group_id', None)
+        if old_group_id != instance.group_id:
+            counters.change_group(old_group_id, -1)
+            counters.change_group(instance.group_id, 1)
+            old_group = Group.objects.filter(pk=old_group_id).first()
+            if old_group:
+                scopes.append(f'group:{old_group.slug}')
+    get_backend().post_saved(instance, getattr(instance, '_old_text', None))
+    bump_feeds(*scopes)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    bump_version('post', instance.pk)
+    counters.change_group(instance.group_id, -1)
+    counters.change_user(instance.author_id, posts_count=-1)
+    get_backend().post_deleted(instance)
+    if instance.image:
+        image = instance.image.name
+        transaction.on_commit(lambda: thumbnails.release_image(image))
+    bump_feeds(*feed_scopes(instance))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, created=False, **kwargs):
+    if created:
+        counters.change_post(instance.post_id, 1)
+    elif kwargs['signal'] is post_delete:
+        counters.change_post(instance.post_id, -1)
+    if kwargs['signal'] is post_delete:
+        get_backend().comment_deleted(instance)
+    else:
+        get_backend().comment_saved(instance)
+    post = Post.objects.filter(pk=instance.post_id).select_related(
+        'author', 'group').first()
+    if post:
+        bump_feeds(*feed_scopes(post))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    bump_version('group', instance.pk)
+    bump_feeds(ALL_FEEDS)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields == {'last_login'}:
+        # Вход пользователя не меняет содержимое его карточек.
+        return
+    if kwargs.get('created'):
+        UserStats.objects.get_or_create(user=instance)
+        return
+    bump_version('user', instance.pk)
+    bump_feeds(ALL_FEEDS)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_changed(sender, instance, created=False, **kwargs):
+    if created:
+        timeline.backfill(instance.user_id, instance.author_id)
+        counters.change_user(instance.author_id, followers_count=1)
+        counters.change_user(instance.user_id, following_count=1)
+    elif kwargs['signal'] is post_delete:
+        timeline.trim(instance.user_id, instance.author_id)
+        counters.change_user(instance.author_id, followers_count=-1)
+        counters.change_user(instance.user_id, following_count=-1)
+    bump_feeds(*(
+        f'profile:{username}' for username in User.objects.filter(
+            pk__in=(instance.user_id, instance.author_id)
+        ).values_list('username', flat=True)
+    ))
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django import template
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts.cache import get_post_card
+from posts.thumbnails import cached_thumbnail
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_card(context, post):
+    """Карточка поста, собранная из кэшированного фрагмента."""
+    group_page = bool(context.get('group'))
+
+    def render():
+        return render_to_string(
+            'posts/includes/card_post.html',
+            {'post': post, 'group': group_page},
+        )
+
+    return mark_safe(get_post_card(post, group_page, render))
+
+
+@register.inclusion_tag('posts/includes/post_image.html')
+def post_image(post):
+    """Картинка поста с `srcset` из записей `PostImageVariant`.
+
+    Пока варианты не готовы, выводится миниатюра sorl, если её уже
+    сделала очередь, иначе исходная картинка: нарезать её в запросе
+    нельзя.
+    """
+    srcsets = {}
+    for variant in post.image_variants.all():
+        srcsets.setdefault(variant.format, []).append(
+            f'{variant.url} {variant.width}w'
+        )
+    fallback = srcsets.get('jpeg')
+    if fallback:
+        src = fallback[-1].rsplit(' ', 1)[0]
+    elif post.image:
+        src = _unprocessed_image_url(post.image)
+    else:
+        src = None
+    return {
+        'webp': ', '.join(srcsets.get('webp', [])),
+        'jpeg': ', '.join(fallback or []),
+        'src': src,
+        'sizes': settings.POST_IMAGE_SIZES,
+    }
+
+
+def _unprocessed_image_url(image):
+    geometry, options = settings.POST_THUMBNAILS[0]
+    thumbnail = cached_thumbnail(image, geometry, options)
+    return thumbnail.url if thumbnail is not None else image.url
@@ -1,12 +1,19 @@
+import hashlib
+import os
 import shutil
 import tempfile
+from io import BytesIO
+from unittest import mock
 
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
 
 from ..models import Post, Group, User, Comment
+from ..thumbnails import release_image, sweep_images
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 SMALL_GIF = (
@@ -82,7 +89,8 @@ class PostFormTests(TestCase):
         post = created_post.pop()
         self.assertEqual(post.text, form_data['text'])
         self.assertEqual(post.group.id, form_data['group'])
-        self.assertEqual(f'posts/{form_data["image"]}', post.image)
+        digest = hashlib.sha256(SMALL_GIF).hexdigest()
+        self.assertEqual(post.image, f'posts/{digest[:2]}/{digest}.gif')
 
     def test_post_edit(self):
         posts_count = Post.objects.count()
@@ -140,3 +148,88 @@ class PostFormTests(TestCase):
         self.assertEqual(self.user, comment.author)
         self.assertEqual(form_data['text'], comment.text)
         self.assertEqual(self.post, comment.post)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageUploadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='photographer')
+        self.client.force_login(self.user)
+
+    def upload(self, size, name='photo.png', image_format='PNG'):
+        data = BytesIO()
+        Image.new('RGB', size).save(data, image_format)
+        return self.client.post(reverse('posts:post_create'), {
+            'text': name,
+            'image': SimpleUploadedFile(
+                name, data.getvalue(), f'image/{image_format.lower()}'),
+        })
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_large_image_is_downscaled(self):
+        self.upload((400, 200))
+        image = Post.objects.get(text='photo.png').image
+        self.assertEqual((image.width, image.height), (100, 50))
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=1000)
+    def test_too_many_pixels(self):
+        response = self.upload((100, 100))
+        self.assertFormError(
+            response, 'form', 'image', 'Картинка слишком большая: 100×100.')
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=10_000,
+                       POST_IMAGE_MAX_PIXELS_UNDRAFTABLE=1000)
+    def test_undraftable_formats_have_lower_pixel_limit(self):
+        for image_format in ('PNG', 'GIF'):
+            with self.subTest(image_format=image_format):
+                response = self.upload(
+                    (50, 50), f'photo.{image_format.lower()}', image_format)
+                self.assertFormError(
+                    response, 'form', 'image',
+                    'Картинка слишком большая: 50×50.')
+        self.assertFalse(Post.objects.exists())
+        self.upload((50, 50), 'photo.jpg', 'JPEG')
+        self.assertTrue(Post.objects.filter(text='photo.jpg').exists())
+
+    @override_settings(POST_IMAGE_MAX_UPLOAD_SIZE=100)
+    def test_upload_size_limit(self):
+        response = self.upload((200, 200))
+        self.assertFormError(
+            response, 'form', 'image', f'Файл больше {filesizeformat(100)}.')
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POST_IMAGE_FORMATS=('JPEG',))
+    def test_format_whitelist(self):
+        response = self.upload((10, 10))
+        self.assertFormError(
+            response, 'form', 'image', 'Формат PNG не поддерживается.')
+
+    @override_settings(IMAGE_RELEASE_GRACE_PERIOD=0)
+    def test_identical_uploads_share_one_file(self):
+        self.upload((30, 30))
+        self.upload((30, 30), 'copy.png')
+        posts = list(Post.objects.order_by('pk'))
+        self.assertEqual(posts[0].image.name, posts[1].image.name)
+        path = posts[0].image.path
+        self.assertEqual(len(os.listdir(os.path.dirname(path))), 1)
+        with mock.patch('posts.signals.transaction.on_commit',
+                        side_effect=lambda callback: callback()):
+            posts[0].delete()
+            self.assertTrue(os.path.exists(path))
+            posts[1].delete()
+            self.assertFalse(os.path.exists(path))
+
+    def test_reused_file_survives_release_until_sweep(self):
+        self.upload((30, 30))
+        post = Post.objects.get()
+        path = post.image.path
+        Post.objects.all().delete()
+        # Та же картинка загружается заново, а пост с ней ещё не записан.
+        self.assertFalse(release_image(post.image.name))
+        self.assertTrue(os.path.exists(path))
+        sweep_images()
+        self.assertTrue(os.path.exists(path))
+        with override_settings(IMAGE_RELEASE_GRACE_PERIOD=0):
+            self.assertGreater(sweep_images(), 0)
+        self.assertFalse(os.path.exists(path))
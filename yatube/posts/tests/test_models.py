@@ -1,6 +1,17 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.db.models import F
 from django.test import TestCase
+from django.utils import timezone
 
-from ..models import Group, Post, User
+from ..management.commands import explain_posts
+from ..management.commands.seed_yatube import Command as SeedCommand
+from ..models import (Comment, Follow, Group, Post, TimelineEntry, User,
+                      UserStats)
 
 
 class PostModelTest(TestCase):
@@ -51,3 +62,128 @@ class PostModelTest(TestCase):
             with self.subTest(value=value):
                 self.assertEqual(
                     post._meta.get_field(value).help_text, expected)
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='counted')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(
+            title='Группа', slug='counted', description='Описание')
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_counters_follow_writes(self):
+        post = Post.objects.create(
+            author=self.author, text='Пост', group=self.group)
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий')
+        Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.reader).following_count, 1)
+        comment.delete()
+        post.group = None
+        post.save()
+        Follow.objects.all().delete()
+        post.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+        self.assertEqual(self.stats(self.reader).following_count, 0)
+
+    def test_recount_counters_repairs_drift(self):
+        Post.objects.bulk_create(
+            [Post(author=self.author, text='Пост', group=self.group)] * 3)
+        UserStats.objects.filter(user=self.reader).delete()
+        call_command('recount_counters', stdout=StringIO())
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 3)
+        self.assertEqual(self.stats(self.author).posts_count, 3)
+        self.assertEqual(self.stats(self.reader).posts_count, 0)
+
+
+class SeedTest(TestCase):
+    def seed(self, prefix):
+        call_command(
+            'seed_yatube', users=20, groups=3, posts=60, comments=40,
+            follows_per_user=3, batch_size=25, workers=0, prefix=prefix,
+            stdout=StringIO(),
+        )
+        posts = Post.objects.filter(
+            author__username__startswith=prefix).order_by('pk')
+        return [
+            (post.author.username[len(prefix):], post.text,
+             post.comments_count)
+            for post in posts
+        ]
+
+    def test_seed_is_deterministic_and_counted(self):
+        first = self.seed('a')
+        self.assertEqual(len(first), 60)
+        self.assertEqual(first, self.seed('b'))
+        self.assertEqual(Comment.objects.count(), 80)
+        self.assertFalse(Follow.objects.filter(user=F('author')).exists())
+        stats = UserStats.objects.get(user__username='a0')
+        self.assertEqual(stats.posts_count, Post.objects.filter(
+            author__username='a0').count())
+        self.assertTrue(TimelineEntry.objects.exists())
+
+    def test_fts_is_reinstalled_after_failure(self):
+        with mock.patch.object(
+            SeedCommand, 'seed_posts', side_effect=RuntimeError
+        ), mock.patch(
+            'posts.management.commands.seed_yatube.install_fts'
+        ) as install, self.assertRaises(RuntimeError):
+            self.seed('c')
+        install.assert_called_once_with()
+
+
+class IndexesTest(TestCase):
+    def test_follow_is_unique(self):
+        user = User.objects.create_user(username='follower')
+        author = User.objects.create_user(username='followed')
+        Follow.objects.create(user=user, author=author)
+        with self.assertRaises(IntegrityError):
+            Follow.objects.create(user=user, author=author)
+
+    def test_view_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_posts', stdout=out)
+        self.assertIn('Полных проходов нет', out.getvalue())
+        for name in ('post_detail: ответы', 'search', 'api: index',
+                     'follow_index: pull', 'follow_index: старые посты'):
+            with self.subTest(name=name):
+                self.assertIn(f'{name}\n', out.getvalue())
+
+    def test_index_scan_of_posts_is_flagged(self):
+        for detail in ('SCAN posts_post',
+                       'SCAN posts_post USING INDEX post_pub_date_idx',
+                       'SCAN posts_timelineentry USING COVERING INDEX '
+                       'timeline_user_pub_date_idx',
+                       'SCAN auth_user',
+                       'USE TEMP B-TREE FOR ORDER BY'):
+            with self.subTest(detail=detail):
+                self.assertTrue(explain_posts.flagged('index', detail))
+        for detail in ('SEARCH posts_post USING INDEX post_pub_date_idx '
+                       '(pub_date<?)',
+                       'SCAN auth_user USING COVERING INDEX '
+                       'sqlite_autoindex_auth_user_1'):
+            with self.subTest(detail=detail):
+                self.assertFalse(explain_posts.flagged('index', detail))
+
+    def test_plans_are_probed_deep_in_the_table(self):
+        author = User.objects.create_user(username='author')
+        oldest = Post.objects.create(author=author, text='Старый')
+        Post.objects.create(author=author, text='Новый')
+        Post.objects.filter(pk=oldest.pk).update(
+            pub_date=timezone.now() - timedelta(days=30))
+        oldest.refresh_from_db()
+        self.assertEqual(
+            explain_posts.deep_position(), (oldest.pub_date, oldest.pk))
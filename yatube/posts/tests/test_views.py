@@ -1,16 +1,42 @@
+import os
+import random
 import shutil
 import tempfile
+import threading
+import time
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
 from django import forms
+from django.apps import apps
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.core.paginator import Page
+from django.db import (DatabaseError, IntegrityError, OperationalError,
+                       connection)
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from posts import loadtest
+from posts.management.commands.loadtest import Command as LoadtestCommand
+from posts.management.commands.loadtest import parse_mix
+from posts import writebehind
 from posts.forms import PostForm, CommentForm
-from posts.models import Comment, Follow, Group, Post, User
+from posts.models import (
+    Comment, Follow, Group, Post, PostImageVariant, TimelineEntry, User
+)
+from posts.search import get_backend
+from posts.search.inverted import InvertedIndex
+from posts.search.stemmer import stem
+from posts.thumbnails import ThumbnailQueue, generate, process
+from posts.timeline import release_all
+from posts.utils import CursorPaginator, encode_cursor
+from yatube.wsgi import application
 
 User = get_user_model()
 PAGE_SIZE_2 = 3
@@ -163,14 +189,62 @@ class PostViewsTest(TestCase):
         )
         response = self.client.get(reverse('posts:index'))
         posts = response.content
-        post.delete()
-        response_after_del_post = self.client.get(reverse('posts:index'))
-        self.assertEqual(posts, response_after_del_post.content)
+        Post.objects.filter(pk=post.pk).update(text='Изменён в обход')
+        response_after_update = self.client.get(reverse('posts:index'))
+        self.assertEqual(posts, response_after_update.content)
         cache.clear()
         response_after_clear_cash = self.client.get(reverse('posts:index'))
         self.assertNotEqual(
-            response_after_clear_cash.content, response_after_del_post.content
+            response_after_clear_cash.content, response_after_update.content
+        )
+
+    def test_cache_invalidated_by_writes(self):
+        """Новый пост и комментарий сразу меняют поколение лент."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user.username}),
         )
+        for url in urls:
+            self.client.get(url)
+        post = Post.objects.create(
+            author=self.user, text='Свежий пост', group=self.group)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'Свежий пост')
+        post.delete()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertNotContains(self.client.get(url), 'Свежий пост')
+
+    @override_settings(FEED_CACHE_TIMEOUT=0)
+    def test_stale_page_served_while_refreshing(self):
+        """Пока пересчёт занят другим запросом, отдаётся старая копия."""
+        url = reverse('posts:index')
+        first = self.client.get(url).content
+        Post.objects.filter(pk=self.post.pk).update(
+            text='Новый текст', updated=timezone.now())
+        with mock.patch('posts.cache.acquire_lock', return_value=False):
+            self.assertEqual(self.client.get(url).content, first)
+        self.assertContains(self.client.get(url), 'Новый текст')
+
+    def test_waiter_stops_when_lock_is_released(self):
+        """Если владелец блокировки ничего не сохранил, запрос не ждёт
+        до истечения блокировки, а считает ответ сам."""
+        url = reverse('posts:profile', kwargs={'username': 'nobody'})
+        with mock.patch('posts.cache.acquire_lock', return_value=False), \
+                mock.patch('posts.cache.time.sleep') as sleep:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+        sleep.assert_called_once_with(settings.VIEW_CACHE_POLL_INTERVAL)
+
+    @override_settings(VIEW_CACHE_LOCK_TIMEOUT=0)
+    def test_foreign_lock_is_not_released(self):
+        """Запрос, не взявший блокировку, не снимает чужую."""
+        with mock.patch('posts.cache.acquire_lock', return_value=False), \
+                mock.patch('posts.cache.release_lock') as release:
+            self.client.get(reverse('posts:index'))
+        release.assert_not_called()
 
 
 class FollowViewsTest(TestCase):
@@ -282,3 +356,962 @@ class PaginatorTest(TestCase):
                     ),
                     posts_on_second_page,
                 )
+
+    def test_cursor_paginator(self):
+        """Курсорная пагинация проходит ленту вперёд и назад."""
+        url = reverse('posts:index')
+        first_page = self.authorized.get(url).context['page_obj']
+        self.assertTrue(first_page.cursor_mode)
+        self.assertIsNone(first_page.previous_cursor)
+        self.assertEqual(len(first_page), settings.PAGE_SIZE)
+        second_page = self.authorized.get(
+            url, {'cursor': first_page.next_cursor}).context['page_obj']
+        self.assertEqual(len(second_page), PAGE_SIZE_2)
+        self.assertIsNone(second_page.next_cursor)
+        self.assertFalse(set(first_page) & set(second_page))
+        back_page = self.authorized.get(
+            url, {'cursor': second_page.previous_cursor}).context['page_obj']
+        self.assertEqual(list(back_page), list(first_page))
+
+    def test_cursor_page_is_index_range(self):
+        """Страница после курсора читается диапазоном индекса, а не
+        проходом по нему с начала."""
+        post = Post.objects.order_by('pub_date', 'id').first()
+        paginator = CursorPaginator(Post.objects.for_feed(), PAGE_SIZE_2)
+        for backwards in (False, True):
+            with self.subTest(backwards=backwards):
+                sql, params = paginator.page_queryset(
+                    paginator.position(post), backwards, PAGE_SIZE_2 + 1
+                ).query.sql_with_params()
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                    plan = [row[-1] for row in cursor.fetchall()]
+                self.assertFalse([
+                    step for step in plan
+                    if step.startswith('SCAN') or 'TEMP B-TREE' in step
+                ], plan)
+
+    def test_broken_cursor_shows_first_page(self):
+        response = self.authorized.get(
+            reverse('posts:index'), {'cursor': 'broken'})
+        self.assertEqual(
+            len(response.context['page_obj']), settings.PAGE_SIZE)
+
+    def test_out_of_range_cursor_shows_first_page(self):
+        now = timezone.now().isoformat()
+        for values in ([now, 2 ** 64], [now, -2 ** 70],
+                       ['9999-12-31T23:59:59-10:00', 1],
+                       ['0001-01-01T00:00:00+10:00', 1],
+                       ['2021-01-01T00:00:00', 1]):
+            with self.subTest(values=values):
+                response = self.authorized.get(
+                    reverse('posts:index'),
+                    {'cursor': encode_cursor(values)},
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    len(response.context['page_obj']), settings.PAGE_SIZE)
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='writer')
+        self.client_reader = Client()
+        self.client_reader.force_login(self.reader)
+
+    def feed(self):
+        return list(self.client_reader.get(
+            reverse('posts:follow_index')).context['page_obj'])
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        old_post = Post.objects.create(author=self.author, text='старый')
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(author=self.author, text='новый')
+        self.assertEqual(self.feed(), [new_post, old_post])
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        self.assertEqual(self.feed(), [])
+
+    def test_rebuild_timelines_command(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.bulk_create(
+            [Post(author=self.author, text=f'Пост {i}') for i in range(3)])
+        self.assertFalse(TimelineEntry.objects.exists())
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(TimelineEntry.objects.count(), 3)
+        self.assertEqual(len(self.feed()), 3)
+
+    def test_migration_fills_timelines_of_existing_follows(self):
+        migration = import_module('posts.migrations.0012_timelineentry')
+        posts = Post.objects.bulk_create(
+            [Post(author=self.author, text=f'Пост {i}') for i in range(3)])
+        Follow.objects.bulk_create(
+            [Follow(user=self.reader, author=self.author)])
+        self.assertFalse(TimelineEntry.objects.exists())
+        migration.fill_timelines(apps, connection.schema_editor())
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(
+                user=self.reader).values_list('post', flat=True)),
+            {post.pk for post in Post.objects.filter(author=self.author)},
+        )
+        self.assertEqual(len(self.feed()), len(posts))
+
+    @override_settings(TIMELINE_DEPTH=3, PAGE_SIZE=2)
+    def test_timeline_is_capped_and_older_posts_are_pulled(self):
+        other = User.objects.create_user(username='other')
+        for i in range(4):
+            Post.objects.create(author=self.author, text=f'Автор {i}')
+            Post.objects.create(author=other, text=f'Другой {i}')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=other)
+        self.assertEqual(TimelineEntry.objects.count(), 3)
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(TimelineEntry.objects.count(), 3)
+        Post.objects.create(author=other, text='Свежий')
+        self.assertEqual(TimelineEntry.objects.count(), 4)
+        call_command('rebuild_timelines', maintain=True, stdout=StringIO())
+        self.assertEqual(TimelineEntry.objects.count(), 3)
+        expected = list(Post.objects.filter(
+            author__following__user=self.reader).order_by('-pub_date', '-id'))
+        url = reverse('posts:follow_index')
+        pages, cursor = [], ''
+        while cursor is not None:
+            page_obj = self.client_reader.get(
+                url, {'cursor': cursor}).context['page_obj']
+            pages.append(page_obj)
+            cursor = page_obj.next_cursor
+        self.assertEqual([post for page in pages for post in page], expected)
+        back = self.client_reader.get(
+            url, {'cursor': pages[-1].previous_cursor}).context['page_obj']
+        self.assertEqual(list(back), list(pages[-2]))
+        legacy = self.client_reader.get(url, {'page': 3}).context['page_obj']
+        self.assertEqual(list(legacy), expected[4:6])
+
+    def test_benchmark_feed_uses_both_modes(self):
+        # check_mode() прерывает команду, если режим не включился.
+        out = StringIO()
+        call_command('benchmark_feed', followers=[5], repeat=1, stdout=out)
+        self.assertIn('push', out.getvalue())
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=2)
+    def test_demoted_celebrity_posts_stay_in_feed(self):
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=fan, author=self.author)
+        Follow.objects.create(user=self.reader, author=self.author)
+        cache.clear()
+        post = Post.objects.create(author=self.author, text='while celebrity')
+        self.assertFalse(TimelineEntry.objects.exists())
+        # Отписка не раскладывает посты в запросе: до обслуживания
+        # они подтягиваются при чтении.
+        Follow.objects.filter(user=fan).delete()
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed(), [post])
+        call_command('rebuild_timelines', maintain=True, stdout=StringIO())
+        self.assertEqual(self.feed(), [post])
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list('post', flat=True)),
+            [post.pk],
+        )
+        self.author.stats.refresh_from_db()
+        self.assertFalse(self.author.stats.timeline_pulled)
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=3,
+                       FEED_CELEBRITY_RELEASE_THRESHOLD=2)
+    def test_celebrity_release_has_hysteresis(self):
+        fans = [
+            User.objects.create_user(username=f'fan{i}') for i in range(3)
+        ]
+        for fan in fans:
+            Follow.objects.create(user=fan, author=self.author)
+        cache.clear()
+        Post.objects.create(author=self.author, text='Пост')
+        Follow.objects.filter(user=fans[0]).delete()
+        self.assertEqual(release_all(), 0)
+        Follow.objects.filter(user=fans[1]).delete()
+        self.assertEqual(release_all(), 1)
+        self.assertEqual(TimelineEntry.objects.get().user, fans[2])
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=2, PAGE_SIZE=2)
+    def test_hybrid_feed_matches_pull_ordering(self):
+        celebrity = User.objects.create_user(username='celebrity')
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=fan, author=celebrity)
+        Follow.objects.create(user=self.reader, author=celebrity)
+        Follow.objects.create(user=self.reader, author=self.author)
+        cache.clear()
+        for i in range(3):
+            Post.objects.create(author=celebrity, text=f'Звезда {i}')
+            Post.objects.create(author=self.author, text=f'Автор {i}')
+        self.assertFalse(TimelineEntry.objects.filter(
+            post__author=celebrity).exists())
+        expected = list(Post.objects.filter(
+            author__following__user=self.reader).order_by('-pub_date', '-id'))
+        url = reverse('posts:follow_index')
+        feed, cursor = [], ''
+        while cursor is not None:
+            page_obj = self.client_reader.get(
+                url, {'cursor': cursor}).context['page_obj']
+            feed.extend(page_obj)
+            cursor = page_obj.next_cursor
+        self.assertEqual(feed, expected)
+        legacy = self.client_reader.get(url, {'page': 2}).context['page_obj']
+        self.assertEqual(list(legacy), expected[2:4])
+
+
+class PostCardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='card_author')
+        self.group = Group.objects.create(
+            title='Группа', slug='card_group', description='Описание')
+        self.post = Post.objects.create(
+            author=self.user, text='Карточка', group=self.group)
+
+    def render_card(self):
+        return self.client.get(reverse(
+            'posts:profile', kwargs={'username': self.user.username}
+        )).content.decode()
+
+    def test_card_is_served_from_cache(self):
+        self.render_card()
+        Post.objects.filter(pk=self.post.pk).update(text='В обход сигналов')
+        self.assertIn('Карточка', self.render_card())
+
+    def test_card_invalidated_by_related_models(self):
+        self.render_card()
+        self.group.slug = 'renamed_group'
+        self.group.save()
+        self.assertIn('renamed_group', self.render_card())
+        self.user.first_name = 'Новое имя'
+        self.user.save()
+        self.assertIn('Новое имя', self.render_card())
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='searcher')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Котики <b>гуляют</b> по крышам')
+        Post.objects.create(author=cls.user, text='Собаки спят')
+
+    def test_search_ranks_and_highlights(self):
+        response = self.client.get(reverse('posts:search'), {'q': 'котик'})
+        page_obj = response.context['page_obj']
+        self.assertEqual(list(page_obj), [self.post])
+        self.assertContains(response, '<mark>Котики</mark>')
+        self.assertContains(response, '&lt;b&gt;')
+
+    def test_search_index_follows_edits(self):
+        self.post.text = 'Теперь про попугаев'
+        self.post.save()
+        response = self.client.get(reverse('posts:search'), {'q': 'котики'})
+        self.assertEqual(len(response.context['page_obj']), 0)
+        response = self.client.get(reverse('posts:search'), {'q': 'попуга'})
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass')
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'собаки'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+@override_settings(
+    POSTS_SEARCH_BACKEND='inverted',
+    SEARCH_INDEX_PATH=f'{TEMP_MEDIA_ROOT}/search.idx',
+)
+class InvertedSearchTest(TestCase):
+    def setUp(self):
+        os.makedirs(TEMP_MEDIA_ROOT, exist_ok=True)
+        self.addCleanup(shutil.rmtree, TEMP_MEDIA_ROOT, True)
+        get_backend.cache_clear()
+        self.addCleanup(get_backend.cache_clear)
+        self.user = User.objects.create_user(username='searcher')
+        self.post = Post.objects.create(
+            author=self.user, text='Котики <b>гуляют</b> по крышам')
+        self.other = Post.objects.create(author=self.user, text='Собаки спят')
+        call_command('build_search_index', stdout=StringIO())
+        get_backend.cache_clear()
+
+    def search(self, query):
+        response = self.client.get(reverse('posts:search'), {'q': query})
+        return list(response.context['page_obj'])
+
+    def test_stemmer(self):
+        self.assertEqual(stem('котики'), stem('котиков'))
+        self.assertEqual(stem('гуляющие'), 'гуля')
+
+    def test_search_from_index_file(self):
+        response = self.client.get(reverse('posts:search'), {'q': 'котика'})
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+        self.assertContains(response, '<mark>Котики</mark>')
+        self.assertContains(response, '&lt;b&gt;')
+        self.assertEqual(self.search('котики собаки'), [])
+        self.assertEqual(
+            self.search('котики или собаки'), [self.other, self.post])
+
+    def test_index_follows_writes(self):
+        self.post.text = 'Теперь про попугаев'
+        self.post.save()
+        Comment.objects.create(
+            post=self.other, author=self.user, text='Котики тоже спят')
+        self.assertEqual(self.search('попугай'), [self.post])
+        self.assertEqual(self.search('котики'), [self.other])
+        self.other.delete()
+        self.assertEqual(self.search('собаки'), [])
+
+    def test_changes_are_shared_and_persisted(self):
+        path = settings.SEARCH_INDEX_PATH
+        first, second = InvertedIndex(path), InvertedIndex(path)
+        first.add(self.other.pk, {stem('попугаи')})
+        first.delete(self.post.pk)
+        second.refresh()
+        self.assertEqual(second.search('попугай'), [self.other.pk])
+        self.assertEqual(second.search('котики'), [])
+        restarted = InvertedIndex(path)
+        self.assertEqual(restarted.search('попугай'), [self.other.pk])
+
+    def test_log_is_compacted(self):
+        path = settings.SEARCH_INDEX_PATH
+        index = InvertedIndex(path)
+        with override_settings(SEARCH_INDEX_LOG_MAX_SIZE=100):
+            for number in range(5):
+                index.add(self.other.pk, {f'слово{number}'})
+        self.assertLess(os.path.getsize(f'{path}.log'), 100)
+        restarted = InvertedIndex(path)
+        self.assertEqual(restarted.search('слово0'), [self.other.pk])
+        self.assertEqual(restarted.search('слово4'), [self.other.pk])
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    THUMBNAIL_QUEUE_DIR=f'{TEMP_MEDIA_ROOT}/queue',
+)
+class ThumbnailQueueTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='painter')
+        self.client.force_login(self.user)
+        self.queue = ThumbnailQueue()
+        self.addCleanup(shutil.rmtree, TEMP_MEDIA_ROOT, True)
+
+    def create_post(self):
+        image = SimpleUploadedFile(
+            name='small.gif',
+            content=(
+                b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21'
+                b'\xf9\x04\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00'
+                b'\x01\x00\x00\x02\x02\x4c\x01\x00\x3b'
+            ),
+            content_type='image/gif',
+        )
+        with mock.patch('posts.thumbnails.transaction.on_commit',
+                        side_effect=lambda callback: callback()):
+            self.client.post(
+                reverse('posts:post_create'),
+                {'text': 'С картинкой', 'image': image},
+            )
+        return Post.objects.get(text='С картинкой')
+
+    def test_unprocessed_image_is_not_resized_in_request(self):
+        post = self.create_post()
+        with mock.patch(
+            'sorl.thumbnail.base.ThumbnailBackend._create_thumbnail'
+        ) as create:
+            response = self.client.get(
+                reverse('posts:post_detail', args=[post.pk]))
+        create.assert_not_called()
+        self.assertContains(response, f'src="{post.image.url}"')
+
+    def test_upload_is_queued_and_processed(self):
+        post = self.create_post()
+        names = self.queue.pending()
+        self.assertEqual(len(names), 1)
+        self.assertTrue(process(self.queue, names[0]))
+        self.assertEqual(self.queue.pending(), [])
+        variants = post.image_variants.all()
+        self.assertEqual(
+            [(variant.format, variant.width) for variant in variants],
+            [('jpeg', 480)],
+        )
+        with mock.patch(
+            'sorl.thumbnail.base.ThumbnailBackend._create_thumbnail'
+        ) as create, mock.patch(
+            'django.core.files.storage.FileSystemStorage.exists'
+        ) as exists:
+            response = self.client.get(reverse('posts:index'))
+            self.assertContains(
+                response, f'srcset="{variants[0].url} 480w"')
+            response = self.client.get(
+                reverse('posts:post_detail', args=[post.pk]))
+            self.assertContains(response, '<picture>')
+        create.assert_not_called()
+        exists.assert_not_called()
+
+    def test_failed_job_is_retried(self):
+        post = self.create_post()
+        name = self.queue.pending()[0]
+        with override_settings(THUMBNAIL_QUEUE_MAX_ATTEMPTS=2), mock.patch(
+            'posts.thumbnails.get_thumbnail', side_effect=OSError
+        ), self.assertLogs('posts.thumbnails', 'ERROR'):
+            self.assertFalse(process(self.queue, name))
+            self.assertEqual(self.queue.pending(), [name])
+            self.assertFalse(process(self.queue, name))
+        self.assertEqual(self.queue.pending(), [])
+        self.assertEqual(self.queue.recover(), 0)
+        self.assertEqual(generate(post.pk, 'posts/other.gif'), 0)
+
+    def test_only_expired_leases_are_recovered(self):
+        self.create_post()
+        name = self.queue.pending()[0]
+        self.assertIsNotNone(self.queue.claim(name))
+        self.assertEqual(self.queue.recover(), 0)
+        self.assertEqual(self.queue.pending(), [])
+        expired = time.time() - settings.THUMBNAIL_QUEUE_LEASE_TIMEOUT - 1
+        os.utime(f'{self.queue.directory}/processing/{name}',
+                 (expired, expired))
+        self.assertEqual(self.queue.recover(), 1)
+        self.assertEqual(self.queue.pending(), [name])
+
+    def test_warm_thumbnails_skips_cached_and_resumes(self):
+        post = self.create_post()
+        checkpoint = f'{TEMP_MEDIA_ROOT}/warm.checkpoint'
+        out = StringIO()
+        call_command('warm_thumbnails', workers=0, checkpoint=checkpoint,
+                     stdout=out)
+        self.assertIn('Готово: 1, уже были в кэше: 0', out.getvalue())
+        self.assertTrue(post.image_variants.exists())
+        with open(checkpoint) as saved:
+            self.assertEqual(saved.read(), str(post.pk))
+        out = StringIO()
+        call_command('warm_thumbnails', workers=0, checkpoint=checkpoint,
+                     stdout=out)
+        self.assertIn('Готово: 0, уже были в кэше: 0', out.getvalue())
+        out = StringIO()
+        call_command('warm_thumbnails', workers=0, checkpoint=checkpoint,
+                     reset=True, stdout=out)
+        self.assertIn('Готово: 0, уже были в кэше: 1', out.getvalue())
+
+
+class QueryCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='writer', first_name='Лев', last_name='Толстой')
+        cls.reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.group = Group.objects.create(
+            title='Группа', slug='queries', description='Описание')
+        for index in range(12):
+            post = Post.objects.create(
+                text=f'Пост номер {index}', author=cls.author,
+                group=cls.group, image=f'posts/{index}.jpg')
+            PostImageVariant.objects.create(
+                post=post, image=f'posts/{index}-480.jpg', format='jpeg',
+                width=480, height=170, size=1000)
+            Comment.objects.create(
+                post=post, author=cls.reader, text='Комментарий')
+
+    def count_queries(self, url, page_size):
+        cache.clear()
+        with override_settings(PAGE_SIZE=page_size), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['page_obj']), page_size)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.client.force_login(self.reader)
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:follow_index'),
+            reverse('posts:search') + '?q=пост',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.count_queries(url, 2), self.count_queries(url, 10)
+                )
+
+    def test_post_detail_query_count(self):
+        post = Post.objects.first()
+        url = reverse('posts:post_detail', args=[post.pk])
+        # Состояние поста для ETag, сам пост, варианты картинки,
+        # корневые комментарии и ответы на них.
+        with self.assertNumQueries(5):
+            self.client.get(url)
+
+    def test_loadtest_command_reports_every_endpoint(self):
+        names = ('index', 'group_list', 'profile', 'post_detail',
+                 'follow_index', 'add_comment')
+        out = StringIO()
+        call_command(
+            'loadtest', requests=60, threads=1, duration=60, users=1,
+            mix=parse_mix(','.join(names)), stdout=out,
+        )
+        rows = {
+            line.split()[0]: line.split()
+            for line in out.getvalue().splitlines()[2:8]
+        }
+        self.assertEqual(set(rows), set(names))
+        for name, row in rows.items():
+            with self.subTest(name=name):
+                self.assertGreater(int(row[1]), 0)
+                self.assertGreater(float(row[7]), 0)
+                self.assertEqual(row[8], '0')
+        self.assertEqual(Comment.objects.filter(
+            text__startswith='Нагрузочный').count(), int(rows[
+                'add_comment'][1]))
+
+    def test_loadtest_follows_cursor_links_from_index(self):
+        plan = loadtest.Plan({'index': 1}, 0, [], [], [], [], seed=0)
+        transport = loadtest.InProcessTransport(application)
+        paths = []
+        request = transport.request
+
+        def recording(method, path, headers, body=b''):
+            paths.append(path)
+            return request(method, path, headers, body)
+
+        transport.request = recording
+        loadtest.drive(
+            plan, transport, time.monotonic() + 60, 20, random.Random(0))
+        self.assertNotIn('page=', ''.join(paths))
+        self.assertTrue(any('?cursor=' in path for path in paths))
+
+    def test_loadtest_report_has_no_timings_for_failed_endpoint(self):
+        stats = loadtest.Stats()
+        stats.fail('index')
+        stats.fail('index')
+        out = StringIO()
+        LoadtestCommand(stdout=out).report(stats, 1.0)
+        row = out.getvalue().splitlines()[1].split()
+        self.assertEqual(row[:3], ['index', '0', '0.0'])
+        self.assertEqual(row[3:7], ['—'] * 4)
+        self.assertEqual(row[-1], '2')
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='api_author', first_name='Анна')
+        cls.group = Group.objects.create(
+            title='Группа', slug='api', description='Описание')
+        for index in range(settings.PAGE_SIZE + 3):
+            Post.objects.create(
+                author=cls.author, text=f'Пост {index}', group=cls.group)
+        cls.post = Post.objects.first()
+        Comment.objects.create(
+            post=cls.post, author=cls.author, text='Комментарий')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_feeds_paginate_by_cursor(self):
+        urls = [
+            reverse('api:index'),
+            reverse('api:group_list', args=[self.group.slug]),
+            reverse('api:profile', args=[self.author.username]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                first = self.client.get(url).json()
+                self.assertEqual(len(first['results']), settings.PAGE_SIZE)
+                self.assertEqual(first['results'][0]['id'], self.post.pk)
+                self.assertEqual(
+                    first['results'][0]['author']['first_name'], 'Анна')
+                self.assertEqual(first['results'][0]['group']['slug'], 'api')
+                second = self.client.get(first['next']).json()
+                self.assertEqual(len(second['results']), 3)
+                self.assertIsNone(second['next'])
+
+    def test_missing_owner_is_404(self):
+        for url in (reverse('api:group_list', args=['missing']),
+                    reverse('api:profile', args=['missing'])):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_post_detail_includes_comments(self):
+        data = self.client.get(
+            reverse('api:post_detail', args=[self.post.pk])).json()
+        self.assertEqual(data['text'], self.post.text)
+        self.assertEqual(
+            data['comments']['results'][0]['text'], 'Комментарий')
+
+    @override_settings(COMMENTS_PAGE_SIZE=1)
+    def test_post_detail_comments_are_paginated(self):
+        Comment.objects.create(
+            post=self.post, author=self.post.author, text='Новый')
+        url = reverse('api:post_detail', args=[self.post.pk])
+        first = self.client.get(url).json()['comments']
+        self.assertEqual([c['text'] for c in first['results']], ['Новый'])
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()['comments']
+        self.assertEqual(
+            [c['text'] for c in second['results']], ['Комментарий'])
+        self.assertIsNone(second['next'])
+        self.assertIsNotNone(second['previous'])
+
+    def test_conditional_get(self):
+        urls = [
+            reverse('api:index'),
+            reverse('api:group_list', args=[self.group.slug]),
+            reverse('api:post_detail', args=[self.post.pk]),
+        ]
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        for url, etag in etags.items():
+            with self.subTest(url=url), \
+                    CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(len(queries), 1)
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Ещё один')
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='conditional')
+        cls.reader = User.objects.create_user(username='conditional_reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='conditional', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.author, text='Пост', group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.urls = [
+            reverse('posts:post_detail', args=[self.post.pk]),
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+        ]
+
+    def assert_not_modified(self, client, url, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertLessEqual(len(queries), 1)
+
+    def test_unchanged_page_is_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                self.assert_not_modified(self.client, url, etag)
+
+    def test_post_detail_last_modified(self):
+        url = self.urls[0]
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        Post.objects.filter(pk=self.post.pk).update(
+            updated=timezone.now() + timezone.timedelta(minutes=1))
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_post_detail_last_modified_only_for_plain_anonymous(self):
+        url = self.urls[0]
+        reader = Client()
+        reader.force_login(self.reader)
+        self.assertFalse(reader.get(url).has_header('Last-Modified'))
+        self.assertFalse(self.client.get(
+            url, {'reply': 1}).has_header('Last-Modified'))
+
+    def test_cached_feed_skips_etag_query(self):
+        for url in self.urls[1:]:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.client.get(url)['ETag'], etag)
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_content_and_viewer(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        reader = Client()
+        reader.force_login(self.reader)
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                self.assertNotEqual(reader.get(url)['ETag'], etag)
+        Follow.objects.create(user=self.reader, author=self.author)
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий')
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+
+@override_settings(COMMENTS_PAGE_SIZE=2, COMMENT_MAX_DEPTH=2)
+class CommentThreadTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='threads')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.author)
+
+    def comment(self, text, parent=None):
+        self.client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': text, 'parent': parent.pk if parent else ''},
+        )
+        return Comment.objects.get(text=text)
+
+    def test_replies_follow_their_root(self):
+        first = self.comment('первый')
+        second = self.comment('второй')
+        reply = self.comment('ответ', first)
+        nested = self.comment('ответ на ответ', reply)
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk]))
+        comments = response.context['comments']
+        self.assertEqual(comments, [second, first, reply, nested])
+        self.assertEqual([c.depth for c in comments], [0, 0, 1, 2])
+
+    def test_non_ascii_digits_are_not_ids(self):
+        root = self.comment('корень')
+        for value in ('²', '١', str(2 ** 64)):
+            with self.subTest(value=value):
+                response = self.client.get(
+                    reverse('posts:post_detail', args=[self.post.pk]),
+                    {'reply': value},
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertIsNone(response.context['reply_to'])
+                response = self.client.post(
+                    reverse('posts:add_comment', args=[self.post.pk]),
+                    {'text': 'ответ', 'parent': value},
+                )
+                self.assertNotEqual(response.status_code, 500)
+                self.assertFalse(Comment.objects.filter(parent=root).exists())
+
+    def test_too_deep_reply_is_attached_to_last_level(self):
+        root = self.comment('корень')
+        reply = self.comment('ответ', root)
+        nested = self.comment('ответ на ответ', reply)
+        deepest = self.comment('ещё глубже', nested)
+        self.assertEqual(deepest.parent, reply)
+        self.assertEqual(deepest.depth, 2)
+
+    def test_subtree_is_one_range_query(self):
+        root = self.comment('корень')
+        reply = self.comment('ответ', root)
+        self.comment('ответ на ответ', reply)
+        self.comment('другая ветка')
+        with self.assertNumQueries(1):
+            texts = [c.text for c in Comment.objects.subtrees([root])]
+        self.assertEqual(texts, ['ответ', 'ответ на ответ'])
+
+    def test_older_comments_fragment(self):
+        for index in range(5):
+            self.comment(f'комментарий {index}')
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk]))
+        self.assertEqual(
+            [c.text for c in response.context['comments']],
+            ['комментарий 4', 'комментарий 3'],
+        )
+        url = reverse('posts:post_comments', args=[self.post.pk])
+        texts = []
+        cursor = response.context['next_cursor']
+        while cursor:
+            fragment = self.client.get(url, {'cursor': cursor})
+            self.assertNotContains(fragment, '<html')
+            texts += [c.text for c in fragment.context['comments']]
+            cursor = fragment.context['next_cursor']
+        self.assertEqual(
+            texts, ['комментарий 2', 'комментарий 1', 'комментарий 0'])
+
+
+@override_settings(WRITE_BEHIND=True)
+class WriteBehindTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='writer')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.buffer = writebehind.WriteBuffer()
+        patcher = mock.patch.object(writebehind, 'buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer.start = mock.Mock()
+        self.client.force_login(self.reader)
+
+    def test_comment_is_visible_to_author_before_flush(self):
+        self.client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'в очереди'},
+        )
+        self.assertFalse(Comment.objects.exists())
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        self.assertContains(self.client.get(url), 'Публикуется')
+        self.assertNotContains(Client().get(url), 'в очереди')
+        self.assertEqual(self.buffer.flush(), 1)
+        comment = Comment.objects.get()
+        self.assertEqual(comment.path, f'{comment.pk:010}')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        response = self.client.get(url)
+        self.assertNotContains(response, 'Публикуется')
+        self.assertEqual(response.context['comments'], [comment])
+
+    def test_replies_get_paths_after_flush(self):
+        root = Comment.objects.create(
+            post=self.post, author=self.author, text='корень')
+        self.client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'ответ', 'parent': root.pk},
+        )
+        self.buffer.flush()
+        reply = Comment.objects.get(text='ответ')
+        self.assertEqual(reply.parent, root)
+        self.assertEqual(reply.path, f'{root.pk:010}{reply.pk:010}')
+
+    def test_follow_is_batched(self):
+        Post.objects.create(author=self.author, text='Старый пост')
+        url = reverse('posts:profile', args=[self.author.username])
+        self.client.get(url)
+        self.client.get(
+            reverse('posts:profile_follow', args=[self.author.username]))
+        self.assertFalse(Follow.objects.exists())
+        self.assertTrue(self.client.get(url).context['following'])
+        self.buffer.flush()
+        self.assertTrue(Follow.objects.filter(
+            user=self.reader, author=self.author).exists())
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.followers_count, 1)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 2)
+
+    def test_unfollow_cancels_pending_follow(self):
+        self.client.get(
+            reverse('posts:profile_follow', args=[self.author.username]))
+        self.client.get(
+            reverse('posts:profile_unfollow', args=[self.author.username]))
+        url = reverse('posts:profile', args=[self.author.username])
+        self.assertFalse(self.client.get(url).context['following'])
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertFalse(Follow.objects.exists())
+
+    def test_comment_queued_during_flush_stays_visible(self):
+        save_batch = writebehind.save_batch
+
+        def save_and_comment(comments, follows):
+            self.buffer.add_comment(
+                Comment(post=self.post, author=self.reader, text='второй'))
+            return save_batch(comments, follows)
+
+        self.buffer.add_comment(
+            Comment(post=self.post, author=self.reader, text='первый'))
+        with override_settings(WRITE_BEHIND=True), \
+                mock.patch('posts.writebehind.save_batch', save_and_comment):
+            self.buffer.flush()
+            pending = writebehind.pending_comments(self.reader, self.post.pk)
+        self.assertEqual([c.text for c in pending], ['второй'])
+
+    def test_unfollow_during_flush_cancels_saved_follow(self):
+        save_batch = writebehind.save_batch
+
+        def save_and_unfollow(comments, follows):
+            saved = save_batch(comments, follows)
+            self.buffer.discard_follow(self.reader.pk, self.author)
+            return saved
+
+        self.buffer.add_follow(self.reader.pk, self.author)
+        with mock.patch('posts.writebehind.save_batch', save_and_unfollow):
+            self.buffer.flush()
+        self.assertFalse(Follow.objects.exists())
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.followers_count, 0)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_locked_database_keeps_batch_queued(self):
+        self.client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'повтор'},
+        )
+        with mock.patch('posts.writebehind.save_comments',
+                        side_effect=OperationalError('database is locked')), \
+                self.assertLogs('posts.writebehind', 'WARNING'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertTrue(Comment.objects.filter(text='повтор').exists())
+
+    def test_comment_of_deleted_author_is_dropped(self):
+        ghost = User.objects.create_user(username='ghost')
+        self.buffer.add_comment(
+            Comment(post=self.post, author=ghost, text='призрак'))
+        self.buffer.add_comment(
+            Comment(post=self.post, author=self.reader, text='живой'))
+        ghost.delete()
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(
+            list(Comment.objects.values_list('text', flat=True)), ['живой'])
+
+    def test_failed_batch_is_saved_one_by_one(self):
+        save_comments = writebehind.save_comments
+
+        def broken(comments):
+            if any(comment.text == 'плохой' for comment in comments):
+                raise IntegrityError('FOREIGN KEY constraint failed')
+            return save_comments(comments)
+
+        for text in ('хороший', 'плохой', 'ещё хороший'):
+            self.buffer.add_comment(
+                Comment(post=self.post, author=self.reader, text=text))
+        with mock.patch('posts.writebehind.save_comments', broken), \
+                self.assertLogs('posts.writebehind', 'WARNING'):
+            self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(
+            set(Comment.objects.values_list('text', flat=True)),
+            {'хороший', 'ещё хороший'},
+        )
+
+    @override_settings(WRITE_BEHIND_FLUSH_INTERVAL=0)
+    def test_flusher_survives_errors(self):
+        buffer = writebehind.WriteBuffer()
+        buffer.thread = threading.current_thread()
+        calls = []
+
+        def flush():
+            calls.append(1)
+            if len(calls) == 1:
+                raise DatabaseError('сбой')
+            buffer.thread = None
+
+        buffer.flush = flush
+        with mock.patch('posts.writebehind.connection'), \
+                self.assertLogs('posts.writebehind', 'ERROR'):
+            buffer.run()
+        self.assertEqual(len(calls), 2)
+
+    def test_dead_flusher_is_restarted(self):
+        buffer = writebehind.WriteBuffer()
+        buffer.run = mock.Mock()
+        with mock.patch('posts.writebehind.atexit'):
+            buffer.start()
+            first = buffer.thread
+            first.join()
+            buffer.start()
+        self.assertIsNot(buffer.thread, first)
+        self.assertEqual(buffer.run.call_count, 2)
@@ -0,0 +1,303 @@
+"""Фоновая подготовка миниатюр картинок постов.
+
+Задания лежат в каталоге `THUMBNAIL_QUEUE_DIR` по одному JSON-файлу и
+переходят между подкаталогами `pending`, `processing` и `failed`
+атомарным `os.replace`, поэтому очередь переживает перезапуск, а
+несколько обработчиков не возьмут одно задание дважды.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from PIL import features
+from sorl.thumbnail import default, delete, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from .cache import bump_feeds, feed_scopes
+from .models import Post, PostImageVariant
+
+logger = logging.getLogger(__name__)
+
+PENDING, PROCESSING, FAILED = 'pending', 'processing', 'failed'
+
+
+class ThumbnailQueue:
+    def __init__(self, directory=None):
+        self.directory = directory or settings.THUMBNAIL_QUEUE_DIR
+        for state in (PENDING, PROCESSING, FAILED):
+            os.makedirs(self._path(state), exist_ok=True)
+
+    def _path(self, state, name=''):
+        return os.path.join(self.directory, state, name)
+
+    def _write(self, state, name, job):
+        tmp_path = self._path(state, f'.{name}.tmp')
+        with open(tmp_path, 'w') as out:
+            json.dump(job, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, self._path(state, name))
+
+    def put(self, post_id, image):
+        name = f'{time.time_ns()}-{uuid.uuid4().hex}.json'
+        self._write(
+            PENDING, name, {'post_id': post_id, 'image': image, 'attempts': 0}
+        )
+        return name
+
+    def pending(self):
+        return sorted(
+            name for name in os.listdir(self._path(PENDING))
+            if name.endswith('.json')
+        )
+
+    def claim(self, name):
+        """Забирает задание; None, если его уже взял другой обработчик."""
+        try:
+            os.replace(self._path(PENDING, name), self._path(PROCESSING, name))
+        except FileNotFoundError:
+            return None
+        # Время изменения в `processing` — начало аренды задания.
+        os.utime(self._path(PROCESSING, name))
+        with open(self._path(PROCESSING, name)) as job_file:
+            return json.load(job_file)
+
+    def done(self, name):
+        os.remove(self._path(PROCESSING, name))
+
+    def retry(self, name, job):
+        """Возвращает задание в очередь или откладывает в `failed`."""
+        job['attempts'] += 1
+        state = PENDING
+        if job['attempts'] >= settings.THUMBNAIL_QUEUE_MAX_ATTEMPTS:
+            state = FAILED
+        self._write(state, name, job)
+        os.remove(self._path(PROCESSING, name))
+
+    def recover(self, timeout=None):
+        """Возвращает в очередь задания, брошенные упавшим обработчиком.
+
+        Задание считается брошенным, если его взяли больше `timeout`
+        секунд назад (по умолчанию `THUMBNAIL_QUEUE_LEASE_TIMEOUT`):
+        более свежие ещё обрабатывают другие процессы.
+        """
+        if timeout is None:
+            timeout = settings.THUMBNAIL_QUEUE_LEASE_TIMEOUT
+        deadline = time.time() - timeout
+        recovered = 0
+        for name in os.listdir(self._path(PROCESSING)):
+            path = self._path(PROCESSING, name)
+            try:
+                if os.stat(path).st_mtime > deadline:
+                    continue
+                os.replace(path, self._path(PENDING, name))
+            except FileNotFoundError:
+                continue
+            recovered += 1
+        return recovered
+
+
+def variant_formats():
+    """Форматы вариантов: WebP, если Pillow его умеет, и запасной JPEG."""
+    if features.check('webp'):
+        return ('WEBP', 'JPEG')
+    return ('JPEG',)
+
+
+def build_variants(post):
+    """Нарезает картинку по ширинам `POST_IMAGE_WIDTHS` во всех форматах.
+
+    Ширины больше исходной пропускаются, кроме самой маленькой.
+    """
+    width, height = settings.POST_IMAGE_ASPECT
+    widths = sorted(settings.POST_IMAGE_WIDTHS)
+    widths = [widths[0]] + [
+        size for size in widths[1:] if size <= post.image.width
+    ]
+    variants = []
+    for image_format in variant_formats():
+        for size in widths:
+            thumbnail = get_thumbnail(
+                post.image, f'{size}x{round(size * height / width)}',
+                crop='center', upscale=True, format=image_format,
+            )
+            variants.append(PostImageVariant(
+                post=post,
+                image=thumbnail.name,
+                format=image_format.lower(),
+                width=thumbnail.width,
+                height=thumbnail.height,
+                size=thumbnail.storage.size(thumbnail.name),
+            ))
+    return variants
+
+
+def copy_variants(post):
+    """Варианты другого поста с тем же файлом картинки, если они есть.
+
+    Одинаковые загрузки хранятся одним файлом, так что нарезать его
+    второй раз незачем.
+    """
+    donor = Post.objects.filter(
+        image=post.image.name, image_variants__isnull=False
+    ).exclude(pk=post.pk).values_list('pk', flat=True).first()
+    if donor is None:
+        return []
+    return [
+        PostImageVariant(
+            post=post,
+            image=variant.image,
+            format=variant.format,
+            width=variant.width,
+            height=variant.height,
+            size=variant.size,
+        )
+        for variant in PostImageVariant.objects.filter(post_id=donor)
+    ]
+
+
+def generate(post_id, image):
+    """Готовит миниатюры из шаблонов и варианты картинки для `srcset`.
+
+    Пост могли удалить или сменить ему картинку, пока задание ждало в
+    очереди, — тогда делать нечего. В конце меняется `updated`, чтобы
+    кэш карточки пересобрался уже с вариантами.
+    """
+    post = Post.objects.filter(pk=post_id, image=image).select_related(
+        'author', 'group').first()
+    if post is None:
+        return 0
+    for geometry, options in settings.POST_THUMBNAILS:
+        get_thumbnail(post.image, geometry, **options)
+    variants = copy_variants(post) or build_variants(post)
+    with transaction.atomic():
+        PostImageVariant.objects.filter(post=post).delete()
+        PostImageVariant.objects.bulk_create(variants)
+        Post.objects.filter(pk=post.pk).update(updated=timezone.now())
+    bump_feeds(*feed_scopes(post))
+    return len(settings.POST_THUMBNAILS) + len(variants)
+
+
+def cached_thumbnail(image, geometry, options):
+    """Готовая миниатюра из хранилища ключей sorl или None, не создавая её.
+
+    Параметры дополняются по умолчанию так же, как в
+    `ThumbnailBackend.get_thumbnail`, иначе имя файла не совпадёт.
+    """
+    backend = default.backend
+    source = ImageFile(image)
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return default.kvstore.get(ImageFile(name, default.storage))
+
+
+def thumbnail_cached(image, geometry, options):
+    return cached_thumbnail(image, geometry, options) is not None
+
+
+def warm_batch(post_ids):
+    """Готовит миниатюры постов пачки; возвращает (сделано, пропущено).
+
+    Пост пропускается, если у него есть варианты картинки и все размеры
+    из шаблонов уже лежат в хранилище sorl.
+    """
+    posts = Post.objects.filter(pk__in=post_ids).exclude(image='').annotate(
+        variants=Count('image_variants')).order_by('pk')
+    generated = skipped = 0
+    for post in posts:
+        if post.variants and all(
+            thumbnail_cached(post.image, geometry, options)
+            for geometry, options in settings.POST_THUMBNAILS
+        ):
+            skipped += 1
+            continue
+        try:
+            generate(post.pk, post.image.name)
+        except Exception:
+            logger.exception('Не удалось подготовить миниатюры поста %s',
+                             post.pk)
+            continue
+        generated += 1
+    return generated, skipped
+
+
+def process(queue, name):
+    job = queue.claim(name)
+    if job is None:
+        return False
+    try:
+        generate(job['post_id'], job['image'])
+    except Exception:
+        logger.exception('Не удалось подготовить миниатюры: %s', job)
+        queue.retry(name, job)
+        return False
+    queue.done(name)
+    return True
+
+
+def release_image(name):
+    """Удаляет файл картинки с миниатюрами, когда на него не ссылается
+    ни один пост и его недавно не загружали повторно."""
+    if not name:
+        return False
+    storage = Post._meta.get_field('image').storage
+    with storage.lock():
+        if Post.objects.filter(image=name).exists():
+            return False
+        try:
+            if storage.recently_used(name):
+                return False
+            delete(ImageFile(name, storage))
+        except (OSError, SuspiciousFileOperation):
+            logger.warning(
+                'Не удалось удалить картинку %s', name, exc_info=True)
+            return False
+    return True
+
+
+def sweep_images():
+    """Удаляет картинки, на которые не ссылается ни один пост;
+    возвращает число удалённых файлов.
+
+    Просматриваются только каталоги хэшей `ContentAddressedStorage`.
+    """
+    field = Post._meta.get_field('image')
+    storage, upload_to = field.storage, field.upload_to
+    if not storage.exists(upload_to):
+        return 0
+    released = 0
+    for directory in storage.listdir(upload_to)[0]:
+        names = [
+            os.path.join(upload_to, directory, filename)
+            for filename in storage.listdir(
+                os.path.join(upload_to, directory))[1]
+        ]
+        used = set(Post.objects.filter(
+            image__in=names).values_list('image', flat=True))
+        released += sum(
+            release_image(name) for name in names if name not in used
+        )
+    return released
+
+
+def enqueue(post):
+    """Ставит картинку поста в очередь после фиксации транзакции."""
+    post_id, image = post.pk, post.image.name
+    transaction.on_commit(lambda: ThumbnailQueue().put(post_id, image))
@@ -0,0 +1,339 @@
+import heapq
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page
+from django.db import connection, transaction
+from django.db.models import (DateTimeField, F, OuterRef, Q, Subquery, Value,
+                              Window)
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+
+from .models import Follow, Post, TimelineEntry, UserStats, feed_fields
+from .utils import CURSOR_ORDERING, CursorPaginator, keyset_filter
+
+
+def celebrities_key():
+    return f'feed:celebrities:{settings.FEED_CELEBRITY_THRESHOLD}'
+
+
+def celebrity_stats():
+    """Запрос авторов, чьи посты подтягиваются при чтении."""
+    return UserStats.objects.filter(
+        Q(followers_count__gte=settings.FEED_CELEBRITY_THRESHOLD)
+        | Q(timeline_pulled=True)
+    ).values_list('user_id', flat=True)
+
+
+def celebrity_ids():
+    """Авторы, чьи посты подтягиваются при чтении, а не лежат в лентах.
+
+    Это авторы с числом подписчиков не меньше `FEED_CELEBRITY_THRESHOLD`
+    и те, кто опустился ниже порога, но чьи посты ещё не разложены
+    по лентам подписчиков (см. `release`). Множество кэшируется.
+    """
+    return cache.get_or_set(
+        celebrities_key(),
+        lambda: frozenset(celebrity_stats()),
+        settings.FEED_CELEBRITY_CACHE_TIMEOUT,
+    )
+
+
+def _mark_pulled(author_id):
+    UserStats.objects.filter(
+        pk=author_id, timeline_pulled=False
+    ).update(timeline_pulled=True)
+
+
+def _insert(entries):
+    TimelineEntry.objects.bulk_create(
+        entries,
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def _ranked(queryset, user, pub_date, post):
+    """Нумерует строки в пределах пользователя, новые посты первыми."""
+    return queryset.annotate(place=Window(
+        RowNumber(),
+        partition_by=[F(user)],
+        order_by=[F(pub_date).desc(), F(post).desc()],
+    ))
+
+
+def _latest_posts(follows):
+    """Посты авторов подписок не старше их `TIMELINE_DEPTH`-го поста:
+    в новейшие посты ленты более старые всё равно не попадут, а граница
+    позволяет читать посты автора диапазоном индекса."""
+    oldest = Post.objects.filter(
+        author_id=OuterRef('author_id')
+    ).order_by(*CURSOR_ORDERING).values('pub_date')[
+        settings.TIMELINE_DEPTH - 1:settings.TIMELINE_DEPTH
+    ]
+    return follows.filter(author__posts__pub_date__gte=Coalesce(
+        Subquery(oldest),
+        Value(datetime.min.replace(tzinfo=timezone.utc),
+              output_field=DateTimeField()),
+    ))
+
+
+def _insert_latest(follows):
+    """Одним INSERT … SELECT раскладывает по лентам подписчиков из
+    `follows` не больше `TIMELINE_DEPTH` новейших постов их авторов."""
+    rows = _ranked(
+        _latest_posts(follows).annotate(
+            entry_post=F('author__posts__id'),
+            entry_date=F('author__posts__pub_date'),
+        ),
+        'user_id', 'entry_date', 'entry_post',
+    ).values('user_id', 'entry_post', 'entry_date', 'place')
+    sql, params = rows.query.sql_with_params()
+    ops = connection.ops
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '{} {} (user_id, post_id, pub_date) SELECT user_id, entry_post, '
+            'entry_date FROM ({}) AS ranked WHERE place <= %s {}'.format(
+                ops.insert_statement(ignore_conflicts=True),
+                ops.quote_name(TimelineEntry._meta.db_table),
+                sql,
+                ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+            ),
+            (*params, settings.TIMELINE_DEPTH),
+        )
+
+
+def cap(user_ids):
+    """Оставляет в лентах пользователей по `TIMELINE_DEPTH` новейших
+    записей; более старые посты читаются из `Post` (см.
+    `HybridFeedPaginator`). `user_ids` — список или подзапрос."""
+    rows = _ranked(
+        TimelineEntry.objects.filter(user_id__in=user_ids),
+        'user_id', 'pub_date', 'post_id',
+    ).values('id', 'place')
+    sql, params = rows.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE id IN (SELECT id FROM ({}) AS ranked '
+            'WHERE place > %s)'.format(
+                connection.ops.quote_name(TimelineEntry._meta.db_table), sql,
+            ),
+            (*params, settings.TIMELINE_DEPTH),
+        )
+
+
+def fan_out(post):
+    """Раскладывает новый пост в ленты всех подписчиков автора."""
+    if post.author_id in celebrity_ids():
+        _mark_pulled(post.author_id)
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True).iterator()
+    _insert(
+        TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+        for user_id in followers
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту пользователя новейшие посты автора.
+
+    Лента остаётся набором новейших постов всех подписок: и прежние
+    записи, и добавленные полны до своего `TIMELINE_DEPTH`-го поста,
+    поэтому после обрезки до той же глубины пропусков в ней нет.
+    """
+    if author_id in celebrity_ids():
+        _mark_pulled(author_id)
+        return
+    _insert_latest(Follow.objects.filter(user_id=user_id, author_id=author_id))
+    cap([user_id])
+
+
+def trim(user_id, author_id):
+    """Убирает из ленты пользователя посты автора после отписки."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def rebuild(user_ids):
+    """Пересобирает ленты указанных пользователей с нуля."""
+    celebrities = celebrity_ids()
+    follows = Follow.objects.filter(user_id__in=user_ids)
+    with transaction.atomic():
+        TimelineEntry.objects.filter(user_id__in=user_ids).delete()
+        UserStats.objects.filter(
+            user_id__in=follows.filter(
+                author_id__in=celebrities).values('author_id'),
+            timeline_pulled=False,
+        ).update(timeline_pulled=True)
+        _insert_latest(follows.exclude(author_id__in=celebrities))
+
+
+def release_threshold():
+    """Нижняя граница гистерезиса: автор, ставший знаменитостью,
+    возвращается в раскладку, только опустившись ниже неё, иначе автор
+    у порога раскладывался бы заново на каждую подписку и отписку."""
+    return min(
+        settings.FEED_CELEBRITY_RELEASE_THRESHOLD,
+        settings.FEED_CELEBRITY_THRESHOLD,
+    )
+
+
+def release(author_ids):
+    """Раскладывает по лентам подписчиков посты авторов, опустившихся
+    ниже `release_threshold()`; возвращает число таких авторов.
+
+    Вызывается не из запросов, а периодически через
+    `rebuild_timelines --maintain`: до того посты автора подтягиваются
+    при чтении. Раскладка и снятие отметки идут в одной транзакции, так
+    что пост, опубликованный в это время, не потеряется.
+    """
+    demoted = list(UserStats.objects.filter(
+        user_id__in=author_ids,
+        timeline_pulled=True,
+        followers_count__lt=release_threshold(),
+    ).values_list('user_id', flat=True))
+    for author_id in demoted:
+        follows = Follow.objects.filter(author_id=author_id)
+        with transaction.atomic():
+            _insert_latest(follows)
+            cap(follows.values('user_id'))
+            UserStats.objects.filter(pk=author_id).update(
+                timeline_pulled=False)
+    if demoted:
+        cache.delete(celebrities_key())
+    return len(demoted)
+
+
+def release_all():
+    return release(UserStats.objects.filter(
+        timeline_pulled=True).values_list('user_id', flat=True))
+
+
+class TimelinePaginator(CursorPaginator):
+    """Курсорный пагинатор по записям ленты, отдающий сами посты."""
+
+    def __init__(self, object_list, per_page, **kwargs):
+        super().__init__(
+            object_list, per_page, ordering=('-pub_date', '-post_id'), **kwargs
+        )
+
+    def position(self, post):
+        return post.pub_date, post.pk
+
+    def fetch(self, position, backwards, limit):
+        entries = super().fetch(position, backwards, limit)
+        return [entry.post for entry in entries]
+
+    def _get_page(self, object_list, number, paginator):
+        return super()._get_page(
+            [entry.post for entry in object_list], number, paginator
+        )
+
+
+class HybridFeedPaginator(TimelinePaginator):
+    """Лента подписок: материализованная часть плюс посты знаменитостей.
+
+    Посты обычных авторов читаются из `TimelineEntry`, посты авторов
+    с большим числом подписчиков выбираются отдельным диапазонным
+    запросом на каждого и сливаются k-путевым слиянием по ключу
+    `(pub_date, id)`. Порядок совпадает с
+    `Post.objects.filter(author__following__user=user)`.
+
+    В ленте лежат только новейшие посты (см. `cap`): всё, что старше
+    самой старой записи, выбирается из постов подписок напрямую.
+    """
+
+    def __init__(self, object_list, per_page, user, **kwargs):
+        self.user = user
+        self.pulled_authors = sorted(
+            Follow.objects.filter(
+                user=user, author_id__in=celebrity_ids()
+            ).values_list('author_id', flat=True)
+        )
+        if self.pulled_authors:
+            object_list = object_list.exclude(
+                post__author_id__in=self.pulled_authors
+            )
+        super().__init__(object_list, per_page, **kwargs)
+
+    @property
+    def count(self):
+        if '_count' not in self.__dict__:
+            self._count = Post.objects.filter(
+                author__following__user=self.user).count()
+        return self._count
+
+    @property
+    def horizon(self):
+        """Ключ самой старой записи ленты; ниже него лента неполна."""
+        if '_horizon' not in self.__dict__:
+            self._horizon = self.object_list.reverse().values_list(
+                'pub_date', 'post_id').first()
+        return self._horizon
+
+    def pull_queryset(self, author_id, position, backwards, limit):
+        """Запрос постов знаменитости после позиции."""
+        return self._after(
+            Post.objects.filter(author_id=author_id),
+            position, backwards, limit,
+        )
+
+    def older_queryset(self, position, backwards, limit):
+        """Запрос постов обычных авторов старше записей ленты."""
+        posts = Post.objects.filter(
+            author__following__user=self.user
+        ).exclude(author_id__in=self.pulled_authors)
+        if self.horizon is not None:
+            posts = posts.filter(keyset_filter(CURSOR_ORDERING, self.horizon))
+        return self._after(posts, position, backwards, limit)
+
+    def _needs_older(self, position, backwards, found, limit):
+        if not backwards:
+            return found < limit
+        return position is not None and (
+            self.horizon is None or position < self.horizon
+        )
+
+    def _after(self, posts, position, backwards, limit):
+        posts = posts.for_feed().order_by(*CURSOR_ORDERING)
+        if backwards:
+            posts = posts.reverse()
+        if position is not None:
+            posts = posts.filter(
+                keyset_filter(CURSOR_ORDERING, position, backwards)
+            )
+        return posts[:limit]
+
+    def fetch(self, position, backwards, limit):
+        streams = [super().fetch(position, backwards, limit)]
+        if self._needs_older(position, backwards, len(streams[0]), limit):
+            streams.append(list(
+                self.older_queryset(position, backwards, limit)
+            ))
+        for author_id in self.pulled_authors:
+            streams.append(list(
+                self.pull_queryset(author_id, position, backwards, limit)
+            ))
+        merged = heapq.merge(
+            *streams, key=self.position, reverse=not backwards
+        )
+        return [post for post, _ in zip(merged, range(limit))]
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        posts = self.fetch(None, False, bottom + self.per_page)
+        return Page(posts[bottom:], number, self)
+
+
+def follow_feed(user):
+    """Записи ленты подписок пользователя для `TimelinePaginator`."""
+    return TimelineEntry.objects.filter(user=user).select_related(
+        'post__author', 'post__group'
+    ).only(
+        'pub_date', 'post', *feed_fields('post__')
+    ).prefetch_related('post__image_variants')
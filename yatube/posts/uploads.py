@@ -0,0 +1,105 @@
+"""Приём картинок постов без загрузки файла целиком в память."""
+import warnings
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+# Форматы, которые Pillow умеет декодировать сразу в уменьшенном масштабе.
+DRAFTABLE_FORMATS = ('JPEG',)
+
+
+class StreamingUploadHandler(TemporaryFileUploadHandler):
+    """Пишет загрузку во временный файл по частям.
+
+    После `POST_IMAGE_MAX_UPLOAD_SIZE` байт данные больше не пишутся, но
+    размер считается до конца, чтобы `PostForm` отклонила файл с понятной
+    ошибкой, а не разбирала обрезанную картинку.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received <= settings.POST_IMAGE_MAX_UPLOAD_SIZE:
+            self.file.write(raw_data)
+
+
+def _open(upload):
+    """Открывает картинку, читая только заголовок."""
+    if hasattr(upload, 'temporary_file_path'):
+        return Image.open(upload.temporary_file_path())
+    upload.seek(0)
+    return Image.open(upload)
+
+
+def check_size(upload):
+    limit = settings.POST_IMAGE_MAX_UPLOAD_SIZE
+    if upload.size > limit:
+        raise ValidationError(
+            'Файл больше %(limit)s.', code='file_too_large',
+            params={'limit': filesizeformat(limit)},
+        )
+
+
+def max_pixels(image_format):
+    if image_format in DRAFTABLE_FORMATS:
+        return settings.POST_IMAGE_MAX_PIXELS
+    return min(settings.POST_IMAGE_MAX_PIXELS,
+               settings.POST_IMAGE_MAX_PIXELS_UNDRAFTABLE)
+
+
+def validate_image(upload):
+    """Проверяет размер файла, формат и число пикселей по заголовку."""
+    if not isinstance(upload, UploadedFile):
+        return
+    check_size(upload)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            with _open(upload) as image:
+                image_format, (width, height) = image.format, image.size
+    except (OSError, Image.DecompressionBombWarning,
+            Image.DecompressionBombError):
+        raise ValidationError(
+            'Не удалось прочитать картинку.', code='invalid_image')
+    finally:
+        upload.seek(0)
+    if image_format not in settings.POST_IMAGE_FORMATS:
+        raise ValidationError(
+            'Формат %(format)s не поддерживается.', code='invalid_format',
+            params={'format': image_format},
+        )
+    if width * height > max_pixels(image_format):
+        raise ValidationError(
+            'Картинка слишком большая: %(width)d×%(height)d.',
+            code='too_many_pixels',
+            params={'width': width, 'height': height},
+        )
+
+
+def downscale(upload):
+    """Уменьшает картинку до `POST_IMAGE_MAX_SIDE` по большей стороне.
+
+    `thumbnail()` сам включает `draft()`, поэтому JPEG декодируется сразу
+    в уменьшенном масштабе; остальные форматы раскрываются целиком, их
+    размер ограничен `POST_IMAGE_MAX_PIXELS_UNDRAFTABLE`. Результат
+    пишется поверх загруженного файла, чтобы его, как и раньше, закрыл
+    и удалил обработчик запроса.
+    """
+    max_side = settings.POST_IMAGE_MAX_SIDE
+    with _open(upload) as image:
+        if max(image.size) > max_side:
+            image_format = image.format
+            image.thumbnail((max_side, max_side))
+            upload.file.seek(0)
+            upload.file.truncate()
+            image.save(upload.file, image_format)
+            upload.size = upload.file.tell()
+    upload.seek(0)
+    return upload
@@ -1,10 +1,160 @@
+import base64
+import binascii
+import json
+
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
+CURSOR_ORDERING = ('-pub_date', '-id')
+# Целые вне 64-битного диапазона не передать в базу.
+CURSOR_INT_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+def encode_cursor(values, reverse=False):
+    """Упаковывает позицию ключа в непрозрачный токен для `?cursor=`."""
+    payload = {
+        'v': [
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in values
+        ],
+        'r': int(reverse),
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def parse_id(value):
+    """Целый id из параметра запроса или None. `isdigit()` пропускает
+    и не-ASCII цифры вроде «²», на которых падает `int()`."""
+    if not (value.isascii() and value.isdigit()):
+        return None
+    value = int(value)
+    return value if value in CURSOR_INT_RANGE else None
+
+
+def decode_cursor(token, size):
+    """Распаковывает токен; для битого токена или значений, которые
+    нельзя передать в базу, возвращает None."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw.decode())
+        values = payload['v']
+        if len(values) != size:
+            return None
+        position = []
+        for value in values:
+            if isinstance(value, str):
+                value = parse_datetime(value)
+                if value is None or timezone.is_naive(value):
+                    return None
+                # Дата у границы календаря не переводится в UTC.
+                value = value.astimezone(timezone.utc)
+            elif not isinstance(value, int) or value not in CURSOR_INT_RANGE:
+                return None
+            position.append(value)
+        return tuple(position), bool(payload.get('r'))
+    except (binascii.Error, ValueError, KeyError, TypeError, OverflowError):
+        return None
+
+
+def keyset_filter(ordering, position, backwards=False):
+    """Условие «строго после позиции» для составного ключа.
+
+    Одно `OR` по шагам ключа SQLite не умеет вести по индексу, поэтому
+    к нему добавлена избыточная граница по первому полю: с ней страница
+    читается диапазоном, а не проходом индекса с начала.
+    """
+    fields = [field.lstrip('-') for field in ordering]
+    condition = Q()
+    for index, field in enumerate(ordering):
+        descending = field.startswith('-')
+        if backwards:
+            descending = not descending
+        lookup = '__lt' if descending else '__gt'
+        step = Q(**{fields[index] + lookup: position[index]})
+        for prev_index in range(index):
+            step &= Q(**{fields[prev_index]: position[prev_index]})
+        condition |= step
+    first_descending = ordering[0].startswith('-') != backwards
+    lookup = '__lte' if first_descending else '__gte'
+    return Q(**{fields[0] + lookup: position[0]}) & condition
 
-def paginations(request, post_list):
-    paginator = Paginator(post_list, settings.PAGE_SIZE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
 
-    return page_obj
+class CursorPaginator(Paginator):
+    """Пагинатор по ключу (keyset) вместо OFFSET.
+
+    Страница выбирается одним диапазонным запросом по упорядоченным
+    полям `ordering`, общее число объектов не считается. Классические
+    методы `Paginator` продолжают работать для ссылок `?page=`.
+    """
+
+    def __init__(self, object_list, per_page, ordering=CURSOR_ORDERING,
+                 **kwargs):
+        self.ordering = tuple(ordering)
+        self.fields = tuple(field.lstrip('-') for field in self.ordering)
+        super().__init__(object_list.order_by(*self.ordering), per_page,
+                         **kwargs)
+
+    def position(self, obj):
+        """Значения ключевых полей объекта или строки `values()`."""
+        if isinstance(obj, dict):
+            return tuple(obj[field] for field in self.fields)
+        return tuple(getattr(obj, field) for field in self.fields)
+
+    def keyset_filter(self, position, backwards=False):
+        return keyset_filter(self.ordering, position, backwards)
+
+    def page_queryset(self, position, backwards, limit):
+        """Запрос до `limit` объектов после позиции в порядке обхода."""
+        queryset = self.object_list
+        if backwards:
+            queryset = queryset.reverse()
+        if position is not None:
+            queryset = queryset.filter(
+                self.keyset_filter(position, backwards)
+            )
+        return queryset[:limit]
+
+    def fetch(self, position, backwards, limit):
+        return list(self.page_queryset(position, backwards, limit))
+
+    def cursor_page(self, cursor=None):
+        """Возвращает страницу, начинающуюся после токена `cursor`."""
+        decoded = decode_cursor(cursor, len(self.fields))
+        position, backwards = decoded if decoded else (None, False)
+        rows = self.fetch(position, backwards, self.per_page + 1)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+        page = Page(rows, 1, self)
+        page.cursor_mode = True
+        page.next_cursor = None
+        page.previous_cursor = None
+        if rows and has_next:
+            page.next_cursor = encode_cursor(self.position(rows[-1]))
+        if rows and has_previous:
+            page.previous_cursor = encode_cursor(
+                self.position(rows[0]), reverse=True
+            )
+        return page
+
+
+def paginations(request, post_list, paginator_class=CursorPaginator,
+                **kwargs):
+    paginator = paginator_class(post_list, settings.PAGE_SIZE, **kwargs)
+    page_number = request.GET.get('page')
+    if page_number is not None:
+        # Совместимость со старыми ссылками вида `?page=N`.
+        page_obj = paginator.get_page(page_number)
+        page_obj.cursor_mode = False
+        return page_obj
+    return paginator.cursor_page(request.GET.get('cursor'))
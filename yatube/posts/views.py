@@ -1,16 +1,28 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.http import Http404
 from django.shortcuts import get_object_or_404, render
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
 from django.shortcuts import redirect
+from django.views.decorators.http import condition
 
+from . import writebehind
+from .cache import cache_feed
+from .comments import comment_thread
+from .conditional import (feed_etag, post_etag, post_last_modified,
+                          post_state, viewer)
 from .forms import PostForm, CommentForm
 from .models import Group, Post, User, Follow
-from .utils import paginations
+from .search import get_backend
+from .timeline import HybridFeedPaginator, follow_feed
+from .utils import paginations, parse_id
 
 
-@cache_page(60 * 20)
+@cache_feed(lambda request: 'index')
 def index(request):
-    post_list = Post.objects.select_related('group', 'author')
+    post_list = Post.objects.for_feed()
     page_obj = paginations(request, post_list)
     template = 'posts/index.html'
     context = {
@@ -19,9 +31,44 @@ def index(request):
     return render(request, template, context)
 
 
+def _group_etag(request, slug):
+    return feed_etag(
+        Post.objects.filter(group__slug=slug), f'group:{slug}',
+        request.get_full_path(), viewer(request),
+    )
+
+
+def _profile_etag(request, username):
+    return feed_etag(
+        Post.objects.filter(author__username=username),
+        f'profile:{username}',
+        request.get_full_path(),
+        viewer(request),
+    )
+
+
+def _post_etag(request, post_id):
+    pending = writebehind.pending_comments(request.user, post_id)
+    return post_etag(
+        post_id, post_state(request, post_id),
+        request.get_full_path(), viewer(request),
+        [comment.text for comment in pending],
+    )
+
+
+def _post_last_modified(request, post_id):
+    # Время правки не учитывает пользователя, `?reply=` и ещё не
+    # записанные комментарии, поэтому для таких ответов есть только ETag.
+    if request.user.is_authenticated or request.GET:
+        return None
+    return post_last_modified(post_state(request, post_id))
+
+
+@cache_feed(lambda request, slug: f'group:{slug}')
+@condition(etag_func=_group_etag)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.select_related('author')
+    post_list = group.posts.for_feed()
     template = 'posts/group_list.html'
     page_obj = paginations(request, post_list)
     context = {
@@ -31,15 +78,18 @@ def group_posts(request, slug):
     return render(request, template, context)
 
 
+@cache_feed(lambda request, username: f'profile:{username}')
+@condition(etag_func=_profile_etag)
 def profile(request, username):
     template = 'posts/profile.html'
     user_author = get_object_or_404(User, username=username)
-    post_list = user_author.posts.all()
+    post_list = user_author.posts.for_feed()
     page_obj = paginations(request, post_list)
     following = False
     if request.user.is_authenticated:
         following = Follow.objects.filter(
-            user=request.user, author=user_author).exists()
+            user=request.user, author=user_author
+        ).exists() or writebehind.follow_pending(request.user, user_author.pk)
     context = {
         'user_author': user_author,
         'page_obj': page_obj,
@@ -48,19 +98,58 @@ def profile(request, username):
     return render(request, template, context)
 
 
+def search(request):
+    template = 'posts/search.html'
+    query = request.GET.get('q', '').strip()
+    paginator = Paginator(
+        get_backend().results(query), settings.PAGE_SIZE
+    )
+    page_obj = paginator.get_page(request.GET.get('page'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, template, context)
+
+
+def _reply_to(request):
+    return parse_id(request.GET.get('reply', ''))
+
+
+@condition(etag_func=_post_etag, last_modified_func=_post_last_modified)
 def post_detail(request, post_id):
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(Post.objects.for_detail(), pk=post_id)
     form = CommentForm()
-    comments = post.comments.select_related('author')
+    comments, page = comment_thread(post.pk)
     context = {
         'post': post,
         'form': form,
-        'comments': comments,
+        'reply_to': _reply_to(request),
+        'comments': (
+            writebehind.pending_comments(request.user, post.pk) + comments
+        ),
+        'next_cursor': page.next_cursor,
     }
     return render(request, template, context)
 
 
+@condition(etag_func=_post_etag)
+def post_comments(request, post_id):
+    """Фрагмент со следующей страницей комментариев для «Показать
+    более старые»."""
+    comments, page = comment_thread(post_id, request.GET.get('cursor'))
+    if not comments and not Post.objects.filter(pk=post_id).exists():
+        raise Http404
+    context = {
+        'post_id': post_id,
+        'comments': comments,
+        'next_cursor': page.next_cursor,
+    }
+    return render(request, 'posts/includes/comments.html', context)
+
+
 @login_required
 def post_create(request):
     template = 'posts/create_post.html'
@@ -83,7 +172,7 @@ def post_create(request):
 def post_edit(request, post_id):
     template = 'posts/create_post.html'
     post = get_object_or_404(Post, pk=post_id)
-    if post.author != request.user:
+    if post.author_id != request.user.pk:
         return redirect(
             'posts:post_detail', post_id
         )
@@ -108,21 +197,26 @@ def post_edit(request, post_id):
 @login_required
 def add_comment(request, post_id):
     template = 'posts:post_detail'
-    post = get_object_or_404(Post, pk=post_id)
-    form = CommentForm(request.POST or None)
+    post = get_object_or_404(Post.objects.only('id'), pk=post_id)
+    form = CommentForm(request.POST or None, post=post)
     if form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        if writebehind.enabled():
+            writebehind.buffer.add_comment(comment)
+        else:
+            comment.save()
     return redirect(template, post_id)
 
 
 @login_required
 def follow_index(request):
     template = 'posts/follow.html'
-    posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginations(request, posts)
+    entries = follow_feed(request.user)
+    page_obj = paginations(
+        request, entries, HybridFeedPaginator, user=request.user
+    )
     context = {
         'page_obj': page_obj,
     }
@@ -134,7 +228,9 @@ def profile_follow(request, username):
     """Функция подписки на автора."""
     author = User.objects.get(username=username)
     user = request.user
-    if author != user:
+    if author != user and writebehind.enabled():
+        writebehind.buffer.add_follow(user.pk, author)
+    elif author != user:
         Follow.objects.get_or_create(user=user, author=author)
     return redirect('posts:profile', username=username)
 
@@ -143,5 +239,9 @@ def profile_follow(request, username):
 def profile_unfollow(request, username):
     """Функция отписки от автора."""
     user = request.user
+    if writebehind.enabled():
+        author = User.objects.filter(username=username).first()
+        if author is not None:
+            writebehind.buffer.discard_follow(user.pk, author)
     Follow.objects.filter(user=user, author__username=username).delete()
     return redirect('posts:profile', username=username)
@@ -0,0 +1,352 @@
+"""Отложенная пакетная запись комментариев и подписок.
+
+При `WRITE_BEHIND = True` представления не пишут в базу сами, а кладут
+объекты в очередь процесса. Фоновый поток раз в
+`WRITE_BEHIND_FLUSH_INTERVAL` секунд сохраняет накопленное через
+`bulk_create` в одной транзакции, так что за блокировку записи SQLite
+борется один поток на процесс, а не каждый запрос. Сигналы `post_save`
+при этом не срабатывают: счётчики, ленты и кэш обновляются после
+сброса одним проходом на пачку.
+
+Пока запись ждёт в очереди, автор видит её через кэш: у каждой записи
+свой ключ, он живёт `WRITE_BEHIND_PENDING_TIMEOUT` секунд и удаляется
+после сброса именно этой записи. При остановке процесса очередь
+сбрасывается из `atexit`.
+"""
+import atexit
+import logging
+import os
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import (DatabaseError, OperationalError, connection,
+                       transaction)
+
+from . import counters, timeline
+from .cache import bump_feeds, feed_scopes
+from .models import Comment, Follow, Post, User
+from .search import get_backend
+
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    return settings.WRITE_BEHIND
+
+
+def comments_key(post_id, user_id):
+    """Счётчик комментариев пользователя к посту, попавших в очередь."""
+    return f'pending:comments:{post_id}:{user_id}'
+
+
+def comment_key(post_id, user_id, number):
+    return f'pending:comment:{post_id}:{user_id}:{number}'
+
+
+def follow_key(user_id, author_id):
+    return f'pending:follow:{user_id}:{author_id}'
+
+
+def _next_number(key):
+    # `add` и `incr` атомарны, поэтому номера не повторяются и при
+    # одновременных запросах.
+    timeout = settings.WRITE_BEHIND_PENDING_TIMEOUT
+    cache.add(key, 0, timeout)
+    try:
+        number = cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout)
+        number = cache.incr(key)
+    cache.touch(key, timeout)
+    return number
+
+
+class WriteBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.comments = []
+        self.follows = []
+        # Подписки пачки, которую сейчас сохраняет `flush()`, и те из них,
+        # от которых уже отписались.
+        self.saving = set()
+        self.cancelled = set()
+        self.thread = None
+        self.pid = None
+
+    def __len__(self):
+        return len(self.comments) + len(self.follows)
+
+    def start(self):
+        """Запускает поток сброса; после `fork` — заново в потомке."""
+        if (self.thread is not None and self.pid == os.getpid()
+                and self.thread.is_alive()):
+            return
+        if self.pid is None:
+            atexit.register(self.stop)
+        self.pid = os.getpid()
+        self.thread = threading.Thread(
+            target=self.run, name='write-behind', daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        """Останавливает поток и сбрасывает остаток очереди."""
+        thread, self.thread = self.thread, None
+        if thread is not None and self.pid == os.getpid():
+            self.wakeup.set()
+            thread.join(settings.WRITE_BEHIND_FLUSH_INTERVAL * 10)
+        self.flush()
+
+    def run(self):
+        try:
+            while self.thread is threading.current_thread():
+                self.wakeup.wait(settings.WRITE_BEHIND_FLUSH_INTERVAL)
+                self.wakeup.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('Сбой потока отложенной записи')
+        finally:
+            connection.close()
+
+    def _push(self, queue, item):
+        # Очередь берётся под блокировкой: `flush()` подменяет списки.
+        with self.lock:
+            getattr(self, queue).append(item)
+            size = len(self)
+        self.start()
+        if size >= settings.WRITE_BEHIND_BATCH_SIZE:
+            self.wakeup.set()
+
+    def add_comment(self, comment):
+        number = _next_number(
+            comments_key(comment.post_id, comment.author_id))
+        comment.pending_key = comment_key(
+            comment.post_id, comment.author_id, number)
+        cache.set(
+            comment.pending_key,
+            {'text': comment.text, 'parent': comment.parent_id},
+            settings.WRITE_BEHIND_PENDING_TIMEOUT,
+        )
+        self._push('comments', comment)
+
+    def add_follow(self, user_id, author):
+        follow = Follow(user_id=user_id, author_id=author.pk)
+        follow.pending_token = uuid.uuid4().hex
+        cache.set(
+            follow_key(user_id, author.pk),
+            follow.pending_token,
+            settings.WRITE_BEHIND_PENDING_TIMEOUT,
+        )
+        self._push('follows', follow)
+        bump_feeds(f'profile:{author.username}')
+
+    def discard_follow(self, user_id, author):
+        """Отписка до сброса отменяет ещё не записанную подписку, в том
+        числе ту, что сохраняется прямо сейчас: её удалит `flush()`."""
+        pair = (user_id, author.pk)
+        with self.lock:
+            self.follows = [
+                follow for follow in self.follows
+                if (follow.user_id, follow.author_id) != pair
+            ]
+            if pair in self.saving:
+                self.cancelled.add(pair)
+        key = follow_key(*pair)
+        if cache.get(key) is not None:
+            cache.delete(key)
+            bump_feeds(f'profile:{author.username}')
+
+    def flush(self):
+        """Записывает накопленное; возвращает число сохранённых объектов.
+
+        Если база занята, пачка возвращается в начало очереди. Если пачка
+        не сохранилась по другой причине, объекты сохраняются по одному,
+        а несохранившиеся пишутся в лог и отбрасываются. Подписки,
+        отменённые во время сохранения, удаляются после него.
+        """
+        with self.lock:
+            comments, self.comments = self.comments, []
+            follows, self.follows = self.follows, []
+            self.saving = {(f.user_id, f.author_id) for f in follows}
+        if not comments and not follows:
+            return 0
+        try:
+            return self.save(comments, follows)
+        finally:
+            self.undo_cancelled()
+
+    def save(self, comments, follows):
+        try:
+            saved = save_batch(comments, follows)
+        except OperationalError:
+            logger.warning(
+                'Отложенная запись не удалась, повтор при следующем сбросе',
+                exc_info=True,
+            )
+            self.requeue(comments, follows)
+            return 0
+        except DatabaseError:
+            logger.warning(
+                'Пачка отложенной записи не сохранилась, сохраняем по одной',
+                exc_info=True,
+            )
+            return self.save_each(comments, follows)
+        forget(comments, follows)
+        return saved
+
+    def save_each(self, comments, follows):
+        saved = 0
+        batches = (
+            [([comment], []) for comment in comments]
+            + [([], [follow]) for follow in follows]
+        )
+        for batch in batches:
+            try:
+                saved += save_batch(*batch)
+            except OperationalError:
+                self.requeue(*batch)
+                continue
+            except DatabaseError:
+                logger.exception('Отложенная запись отброшена: %r', batch)
+            forget(*batch)
+        return saved
+
+    def requeue(self, comments, follows):
+        with self.lock:
+            self.comments[:0] = comments
+            self.follows[:0] = [
+                follow for follow in follows
+                if (follow.user_id, follow.author_id) not in self.cancelled
+            ]
+
+    def undo_cancelled(self):
+        with self.lock:
+            cancelled, self.cancelled = self.cancelled, set()
+            self.saving = set()
+        for user_id, author_id in cancelled:
+            # Удаление через модели: сигналы уберут посты из ленты и
+            # пересчитают счётчики.
+            Follow.objects.filter(
+                user_id=user_id, author_id=author_id).delete()
+
+
+def forget(comments, follows):
+    """Убирает из кэша записи, которые больше не ждут в очереди.
+
+    Удаляются только ключи сохранённых объектов: запись, попавшая
+    в очередь во время сброса, остаётся видна автору. Ключ подписки
+    удаляется, только если его не переписала более новая подписка.
+    """
+    keys = {follow_key(f.user_id, f.author_id): f.pending_token
+            for f in follows}
+    current = cache.get_many(list(keys))
+    cache.delete_many(
+        [comment.pending_key for comment in comments]
+        + [key for key, token in keys.items() if current.get(key) == token]
+    )
+
+
+def save_batch(comments, follows):
+    with transaction.atomic():
+        return save_comments(comments) + save_follows(follows)
+
+
+def save_comments(comments):
+    """Комментарии удалённых авторов, к удалённым постам и ответы на
+    удалённые комментарии отбрасываются, иначе внешний ключ провалил бы
+    всю пачку."""
+    if not comments:
+        return 0
+    author_ids = set(User.objects.filter(
+        pk__in={comment.author_id for comment in comments}
+    ).values_list('pk', flat=True))
+    post_ids = set(Post.objects.filter(
+        pk__in={comment.post_id for comment in comments}
+    ).values_list('pk', flat=True))
+    parent_ids = set(Comment.objects.filter(
+        pk__in={comment.parent_id for comment in comments}
+    ).values_list('pk', flat=True))
+    comments = [
+        comment for comment in comments
+        if comment.post_id in post_ids and comment.author_id in author_ids
+        and (comment.parent_id is None or comment.parent_id in parent_ids)
+    ]
+    Comment.objects.bulk_create(
+        comments, batch_size=settings.WRITE_BEHIND_BATCH_SIZE
+    )
+    Comment.objects.fill_paths()
+    for post_id, added in Counter(c.post_id for c in comments).items():
+        counters.change_post(post_id, added)
+    backend = get_backend()
+    for comment in comments:
+        backend.comment_saved(comment)
+    scopes = set()
+    for post in Post.objects.filter(
+        pk__in={comment.post_id for comment in comments}
+    ).select_related('author', 'group'):
+        scopes.update(feed_scopes(post))
+    bump_feeds(*scopes)
+    return len(comments)
+
+
+def save_follows(follows):
+    """Повторные подписки и подписки удалённых пользователей пропускаются;
+    счётчики участников пересчитываются целиком."""
+    if not follows:
+        return 0
+    pairs = {(follow.user_id, follow.author_id) for follow in follows}
+    user_ids = {user_id for pair in pairs for user_id in pair}
+    existing = set(User.objects.filter(
+        pk__in=user_ids).values_list('pk', flat=True))
+    pairs = {
+        pair for pair in pairs if set(pair) <= existing
+    } - set(Follow.objects.filter(
+        user_id__in={user_id for user_id, _ in pairs},
+        author_id__in={author_id for _, author_id in pairs},
+    ).values_list('user_id', 'author_id'))
+    Follow.objects.bulk_create(
+        [Follow(user_id=user_id, author_id=author_id)
+         for user_id, author_id in pairs],
+        batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    for user_id, author_id in pairs:
+        timeline.backfill(user_id, author_id)
+    users = User.objects.filter(pk__in=user_ids)
+    counters.recount_users(users)
+    bump_feeds(*(
+        f'profile:{username}'
+        for username in users.values_list('username', flat=True)
+    ))
+    return len(pairs)
+
+
+buffer = WriteBuffer()
+
+
+def pending_comments(user, post_id):
+    """Ещё не записанные комментарии пользователя к посту, новые первыми."""
+    if not enabled() or not user.is_authenticated:
+        return []
+    last = cache.get(comments_key(post_id, user.pk), 0)
+    keys = [
+        comment_key(post_id, user.pk, number)
+        for number in range(last, 0, -1)
+    ]
+    pending = cache.get_many(keys)
+    return [
+        Comment(post_id=post_id, author=user, text=item['text'],
+                parent_id=item['parent'])
+        for item in (pending[key] for key in keys if key in pending)
+    ]
+
+
+def follow_pending(user, author_id):
+    if not enabled() or not user.is_authenticated:
+        return False
+    return cache.get(follow_key(user.pk, author_id)) is not None
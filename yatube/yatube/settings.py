@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,10 +87,17 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# core.backends.sqlite3 включает WAL и другие PRAGMA при каждом новом
+# соединении; `OPTIONS['pragmas']` дополняет или отключает (None)
+# значения из core.backends.sqlite3.base.DEFAULT_PRAGMAS. Сравнение со
+# стандартным бэкендом: `manage.py benchmark_sqlite`.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'core.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            'pragmas': {},
+        },
     }
 }
 
@@ -157,3 +165,75 @@ CACHES = {
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
+
+TIMELINE_BATCH_SIZE = 500
+# Сколько новейших постов хранится в ленте подписок пользователя;
+# более старые страницы читаются из постов напрямую.
+TIMELINE_DEPTH = 200
+FEED_CELEBRITY_THRESHOLD = 1000
+# Знаменитость возвращается в раскладку, только когда подписчиков
+# становится меньше этого.
+FEED_CELEBRITY_RELEASE_THRESHOLD = 800
+FEED_CELEBRITY_CACHE_TIMEOUT = 60 * 5
+
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+FEED_CACHE_TIMEOUT = 60 * 60 * 6
+VIEW_CACHE_STALE_TIMEOUT = 60 * 10
+VIEW_CACHE_LOCK_TIMEOUT = 10
+VIEW_CACHE_POLL_INTERVAL = 0.05
+VIEW_CACHE_EARLY_BETA = 1.0
+
+# None — FTS5, если SQLite его поддерживает, иначе 'inverted'.
+POSTS_SEARCH_BACKEND = None
+SEARCH_INDEX_PATH = os.path.join(BASE_DIR, 'search.idx')
+SEARCH_MAX_FILTER_IDS = 1000
+# Журнал изменений инвертированного индекса больше этого размера
+# сливается в файл индекса.
+SEARCH_INDEX_LOG_MAX_SIZE = 1024 * 1024
+
+# Размеры миниатюр из шаблонов постов: их заранее готовит
+# `process_thumbnails`. Должны совпадать с тегами `{% thumbnail %}`.
+POST_THUMBNAILS = (
+    ('960x339', {'crop': 'center', 'upscale': True}),
+)
+# Ширины вариантов картинки для `srcset` и их пропорции.
+POST_IMAGE_WIDTHS = (480, 960, 1440)
+POST_IMAGE_ASPECT = (960, 339)
+POST_IMAGE_SIZES = '(max-width: 992px) 100vw, 960px'
+THUMBNAIL_QUEUE_DIR = os.path.join(BASE_DIR, 'thumbnail_queue')
+THUMBNAIL_QUEUE_MAX_ATTEMPTS = 3
+THUMBNAIL_QUEUE_POLL_INTERVAL = 1
+# Задание, взятое раньше этого, считается брошенным упавшим обработчиком.
+THUMBNAIL_QUEUE_LEASE_TIMEOUT = 60 * 10
+THUMBNAIL_WORKERS = 4
+# Картинку, загруженную повторно позже этого, не удаляем: пост с ней
+# может быть ещё не записан.
+IMAGE_RELEASE_GRACE_PERIOD = 60 * 10
+
+# Загрузки сразу пишутся на диск; картинки проверяются по заголовку.
+FILE_UPLOAD_HANDLERS = ['posts.uploads.StreamingUploadHandler']
+POST_IMAGE_MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 50_000_000
+# Только JPEG декодируется сразу уменьшенным (`draft()`); картинки других
+# форматов перед уменьшением раскрываются целиком, поэтому предел ниже.
+POST_IMAGE_MAX_PIXELS_UNDRAFTABLE = 12_000_000
+POST_IMAGE_MAX_SIDE = 4096
+POST_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+# Замеры SQL, шаблонов и кэша на выборке запросов: Server-Timing и лог
+# `yatube.profiling`. При False middleware не подключается.
+REQUEST_PROFILING = False
+REQUEST_PROFILING_SAMPLE_RATE = 0.01
+
+# Корневых комментариев на странице поста и во фрагменте «более старые».
+COMMENTS_PAGE_SIZE = 20
+# Глубже этого уровня ответы прикрепляются к предку на последнем уровне.
+COMMENT_MAX_DEPTH = 4
+
+# Отложенная запись комментариев и подписок пачками из фонового потока
+# (posts.writebehind). Пока запись ждёт в очереди, автор видит её через
+# кэш, поэтому при нескольких процессах нужен общий кэш.
+WRITE_BEHIND = False
+WRITE_BEHIND_FLUSH_INTERVAL = 0.2
+WRITE_BEHIND_BATCH_SIZE = 500
+WRITE_BEHIND_PENDING_TIMEOUT = 60
@@ -9,6 +9,7 @@ from django.conf.urls.static import static
 urlpatterns = [
     # импорт правил из приложения posts
     path('', include('posts.urls', namespace='index')),
+    path('api/v1/', include('posts.api_urls', namespace='api')),
     path('admin/', admin.site.urls),
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),